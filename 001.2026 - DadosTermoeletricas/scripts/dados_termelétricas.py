@@ -10,33 +10,26 @@ Fonte dos CSVs: https://dados.ons.org.br/dataset/geracao-usina-2
 
 import pandas as pd
 import matplotlib.pyplot as plt
-import glob
 import os
 
+from functions_ons import load_ons_generation
+
 #%% organizando o dado em escala horária
 
 # Caminho para os arquivos CSV
 repopath = r'C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\001.2026 - DadosTermoeletricas'
 path = r'C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\001.2026 - DadosTermoeletricas\inputs\dados'
-files = glob.glob(os.path.join(path, "*.csv"))
 fig_path = r'C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\001.2026 - DadosTermoeletricas\figures'
 
-# Lista para armazenar os DataFrames
-df_list = []
-
-for file in files:
-    df = pd.read_csv(file, sep=";")
-    df_list.append(df)
-
-# Concatena todos os DataFrames em um só
-all_df = pd.concat(df_list, ignore_index=True)
+# Cache Parquet dos CSVs (cada CSV é convertido uma vez; meses novos entram sozinhos)
+cache_path = os.path.join(repopath, 'inputs', 'cache_parquet')
 
-all_df['nom_tipousina'].unique()
-
-all_termica = all_df [all_df['nom_tipousina'] == 'TÉRMICA']
-
-# garantir datetime
-all_termica['din_instante'] = pd.to_datetime(all_termica['din_instante'])
+# só instante e geração das usinas térmicas (filtro aplicado na leitura do Parquet)
+all_termica = load_ons_generation(
+    path, cache_path,
+    columns=['din_instante', 'val_geracao'],
+    tipo_usina='TÉRMICA',
+)
 
 # criar coluna horária
 all_termica['datetime'] = all_termica['din_instante'].dt.floor('h')
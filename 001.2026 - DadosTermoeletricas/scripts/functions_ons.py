@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Leitura dos CSVs de geração por usina do ONS com cache em Parquet.
+
+Cada CSV é convertido uma única vez para Parquet tipado:
+- din_instante como datetime;
+- usina, tipo de usina, combustível, subsistema e estado como categorias;
+- val_geracao como float.
+
+Os Parquet ficam em uma pasta de cache, nomeados pelo hash (SHA-1) do
+conteúdo do CSV, e um manifest.json guarda tamanho, mtime e hash de cada
+arquivo: só CSVs novos ou alterados são convertidos (novos meses entram
+de forma incremental) e um arquivo renomeado reaproveita o Parquet.
+
+Na leitura, só as colunas pedidas são lidas e o filtro de tipo de usina
+(ex.: TÉRMICA) é aplicado pelo pyarrow nos grupos de linhas do Parquet.
+
+Fonte dos CSVs: https://dados.ons.org.br/dataset/geracao-usina-2
+"""
+
+import glob
+import hashlib
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+#%% ── esquema dos CSVs ──────────────────────────────────────────────────────
+
+ONS_TIME_COLUMN = "din_instante"
+ONS_VALUE_COLUMNS = ["val_geracao"]
+
+# colunas de texto repetitivas, guardadas como categorias
+ONS_CATEGORICAL_COLUMNS = [
+    "id_subsistema", "nom_subsistema", "id_estado", "nom_estado",
+    "cod_modalidadeoperacao", "nom_tipousina", "nom_tipocombustivel",
+    "nom_usina", "id_ons", "ceg",
+]
+
+# linhas por grupo do Parquet: grupos menores deixam o filtro pular mais
+ONS_ROW_GROUP_SIZE = 100_000
+
+MANIFEST_NAME = "manifest.json"
+
+
+#%% ── cache ─────────────────────────────────────────────────────────────────
+
+def file_sha1(path, block_size=1 << 20):
+    """
+    SHA-1 do conteúdo de um arquivo, lido em blocos.
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _load_manifest(cache_dir):
+    path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f"Aviso: manifest ilegível, reconvertendo todos os CSVs: {path}")
+        return {}
+
+
+def _save_manifest(cache_dir, manifest):
+    path = os.path.join(cache_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def read_ons_csv(path):
+    """
+    Lê um CSV do ONS já tipado (datetime, categorias e valores float).
+    """
+    df = pd.read_csv(path, sep=";", dtype=str, keep_default_na=False, na_values=[""])
+
+    if ONS_TIME_COLUMN not in df.columns:
+        raise ValueError(f"Coluna '{ONS_TIME_COLUMN}' não encontrada em: {path}")
+
+    df[ONS_TIME_COLUMN] = pd.to_datetime(df[ONS_TIME_COLUMN])
+
+    for col in ONS_VALUE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col].str.replace(",", ".", regex=False), errors="coerce")
+
+    for col in ONS_CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+
+    return df
+
+
+def convert_ons_csv(csv_path, parquet_path):
+    """
+    Converte um CSV do ONS em Parquet tipado, ordenado por tipo de usina e
+    instante (grupos de linhas homogêneos para o filtro de leitura).
+    """
+    df = read_ons_csv(csv_path)
+
+    sort_cols = [c for c in ["nom_tipousina", ONS_TIME_COLUMN] if c in df.columns]
+    df = df.sort_values(sort_cols, kind="stable").reset_index(drop=True)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_table(table, parquet_path + ".tmp", row_group_size=ONS_ROW_GROUP_SIZE,
+                   compression="zstd")
+    os.replace(parquet_path + ".tmp", parquet_path)
+    return len(df)
+
+
+def update_ons_cache(csv_dir, cache_dir, verbose=True):
+    """
+    Sincroniza a pasta de cache com os CSVs de `csv_dir`: converte só os
+    arquivos novos ou alterados e esquece os removidos.
+
+    Retorna a lista de Parquet correspondente aos CSVs atuais (em ordem de
+    nome do CSV).
+    """
+    files = sorted(glob.glob(os.path.join(csv_dir, "*.csv")))
+    if not files:
+        raise FileNotFoundError(f"Nenhum CSV encontrado em: {csv_dir}")
+
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = _load_manifest(cache_dir)
+
+    new_manifest = {}
+    converted = 0
+    parquet_files = []
+
+    for csv_path in files:
+        name = os.path.basename(csv_path)
+        stat = os.stat(csv_path)
+        entry = manifest.get(name)
+
+        # tamanho e mtime iguais: confia no hash já calculado
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            sha1 = entry["sha1"]
+        else:
+            sha1 = file_sha1(csv_path)
+
+        parquet_path = os.path.join(cache_dir, f"{sha1[:20]}.parquet")
+        if not os.path.isfile(parquet_path):
+            rows = convert_ons_csv(csv_path, parquet_path)
+            converted += 1
+            if verbose:
+                print(f"Convertido para Parquet: {name} ({rows} linhas)")
+
+        new_manifest[name] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha1": sha1}
+        parquet_files.append(parquet_path)
+
+    removed = sorted(set(manifest) - set(new_manifest))
+    if converted or removed or new_manifest != manifest:
+        _save_manifest(cache_dir, new_manifest)
+
+    # Parquet de CSVs que não existem mais
+    keep = {os.path.basename(p) for p in parquet_files}
+    for path in glob.glob(os.path.join(cache_dir, "*.parquet")):
+        if os.path.basename(path) not in keep:
+            os.remove(path)
+
+    if verbose:
+        print(f"Cache ONS: {len(files)} CSV(s), {converted} convertido(s), "
+              f"{len(removed)} removido(s).")
+
+    return parquet_files
+
+
+#%% ── leitura ───────────────────────────────────────────────────────────────
+
+def load_ons_generation(csv_dir, cache_dir, columns=("din_instante", "val_geracao"),
+                        tipo_usina="TÉRMICA", verbose=True):
+    """
+    Geração por usina do ONS a partir do cache Parquet (atualizado antes).
+
+    Lê só `columns` (None = todas) e, se `tipo_usina` for informado, só as
+    linhas com nom_tipousina igual a ele (filtro aplicado na leitura).
+    """
+    parquet_files = update_ons_cache(csv_dir, cache_dir, verbose=verbose)
+
+    filters = [("nom_tipousina", "==", tipo_usina)] if tipo_usina is not None else None
+    columns = list(columns) if columns is not None else None
+
+    tables = [pq.read_table(path, columns=columns, filters=filters) for path in parquet_files]
+
+    # categorias podem variar entre arquivos: unifica os dicionários
+    table = pa.concat_tables(tables, promote_options="permissive").unify_dictionaries()
+    df = table.to_pandas()
+
+    if ONS_TIME_COLUMN in df.columns:
+        df = df.sort_values(ONS_TIME_COLUMN, kind="stable").reset_index(drop=True)
+
+    return df
@@ -0,0 +1,550 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de tempo e memória das funções de análise CMAQ com arquivos
+IOAPI sintéticos (synthetic_ioapi.py), sem depender dos NetCDF de produção.
+
+Para cada escala (NCOLS x NROWS x LAY x TSTEP) os arquivos diários são
+gerados em uma pasta temporária e cada função é medida:
+- tempo: `BENCHMARK_REPEATS` execuções cronometradas (time.perf_counter),
+  reportando mínimo e mediana;
+- memória: uma execução extra com tracemalloc (pico de alocações Python/
+  numpy) e amostragem do RSS do processo (psutil), que também cobre as
+  bibliotecas C (HDF5, matplotlib).
+
+Os resultados vão para um JSON em outputs/benchmarks, com commit do git,
+versões das bibliotecas e máquina, e compare_benchmarks mostra a razão
+entre duas execuções, destacando regressões.
+
+Uso: ajustar BENCHMARK_SCALES_TO_RUN e rodar o script; para comparar,
+chamar compare_benchmarks(json_antigo, json_novo).
+"""
+
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import psutil
+import xarray as xr
+
+from functions_render import set_headless
+
+# benchmark sempre sem janelas; antes de importar as funções de plotagem
+set_headless(True)
+
+import functions_emissions  # noqa: E402  (cache do índice regional)
+from functions_emissions import (  # noqa: E402
+    build_pollutant,
+    calculate_by_region_lay,
+    calculate_region_annual_mean,
+    compute_emission_products,
+    compute_temporal_profile_cubes,
+    eqmerc2latlon,
+    get_ioapi_datetimes,
+    get_region_index,
+    get_required_species,
+    ioapiCoords,
+    open_emission_dataset,
+    plot_annual_spatial_mosaic,
+    plot_layer_sheet,
+    plot_regional_total_map,
+    plot_regional_vertical_profile,
+    plot_spatial_mosaic,
+    plot_temporal_mosaic,
+)
+from functions_quality import (  # noqa: E402
+    compute_quality_annual_mean_map,
+    compute_quality_bundle,
+    compute_quality_daily_metric_field,
+    get_quality_datetimes,
+    plot_quality_legislative_mosaic,
+    plot_quality_summary,
+)
+from functions_stream import stream_emission_products  # noqa: E402
+from synthetic_ioapi import (  # noqa: E402
+    make_synthetic_regions,
+    write_emission_files,
+    write_quality_files,
+)
+
+#%% ── configuração ──────────────────────────────────────────────────────────
+
+SCRIPTS_PATH = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_OUTPUT_PATH = os.path.join(SCRIPTS_PATH, "..", "outputs", "benchmarks")
+
+# escalas: emissões em (NCOLS, NROWS, LAY, TSTEP) e qualidade em
+# (NCOLS, NROWS, TSTEP); "grande" equivale a um mês de emissões no grid
+# de produção e precisa de dezenas de GB em disco
+BENCHMARK_SCALES = {
+    "pequena": {
+        "emission": (50, 50, 10, 72),
+        "quality": (50, 50, 24 * 14),
+    },
+    "media": {
+        "emission": (100, 100, 20, 168),
+        "quality": (100, 100, 24 * 31),
+    },
+    "grande": {
+        "emission": (200, 200, 40, 744),
+        "quality": (200, 200, 24 * 365),
+    },
+}
+
+BENCHMARK_SCALES_TO_RUN = ["pequena", "media"]
+BENCHMARK_REPEATS = 3
+
+# False: mede só os cálculos (as figuras a 300 dpi dominam o tempo total)
+BENCHMARK_PLOTS = True
+
+# None: pasta temporária apagada ao final; um caminho mantém os arquivos
+# sintéticos para as próximas execuções (são reaproveitados se existirem)
+BENCHMARK_DATA_PATH = None
+
+# razão de tempo/memória acima da qual compare_benchmarks acusa regressão
+REGRESSION_THRESHOLD = 1.2
+
+# poluentes do benchmark: um simples e um composto de dois níveis (DAG)
+BENCHMARK_SPECIES = ("CO", "NO2", "PMC", "PMFINE_SO4", "PMFINE_NO3", "PMFINE_OTHR")
+BENCHMARK_POLLUTANT_SPECS = {
+    "CO": ["CO"],
+    "NO2": ["NO2"],
+    "MP25": ["PMFINE_SO4", "PMFINE_NO3", "PMFINE_OTHR"],
+    "MP10": ["MP25", "PMC"],
+}
+BENCHMARK_POLLUTANT = "MP10"
+BENCHMARK_UNIT = "g/s"
+
+
+#%% ── medição ───────────────────────────────────────────────────────────────
+
+class _RssSampler:
+    """
+    Amostra o RSS do processo em uma thread enquanto a função medida roda.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.start = self.process.memory_info().rss
+        self.peak = self.start
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.end = self.process.memory_info().rss
+        self.peak = max(self.peak, self.end)
+
+
+def measure_call(func, setup=None, repeats=BENCHMARK_REPEATS):
+    """
+    Mede `func(*args, **kwargs)`, com (args, kwargs) = setup() refeito antes
+    de cada execução e fora da medição (ex.: limpar caches).
+
+    Retorna tempos (s) e memória (MB): pico do tracemalloc e pico/variação
+    do RSS na execução medida com tracemalloc.
+    """
+    def _args():
+        return setup() if setup is not None else ((), {})
+
+    times = []
+    for _ in range(repeats):
+        args, kwargs = _args()
+        t0 = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - t0)
+
+    args, kwargs = _args()
+    tracemalloc.start()
+    try:
+        with _RssSampler() as rss:
+            func(*args, **kwargs)
+        _, traced_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    mb = 1024 ** 2
+    return {
+        "repeats": repeats,
+        "times_s": [round(t, 6) for t in times],
+        "time_min_s": round(min(times), 6),
+        "time_median_s": round(statistics.median(times), 6),
+        "tracemalloc_peak_mb": round(traced_peak / mb, 3),
+        "rss_peak_mb": round(rss.peak / mb, 3),
+        "rss_delta_mb": round((rss.peak - rss.start) / mb, 3),
+    }
+
+
+def _run_case(results, group, scale, name, func, setup=None, repeats=BENCHMARK_REPEATS):
+    """
+    Mede um caso e o acrescenta a `results`; erros são registrados no JSON
+    sem interromper os demais casos.
+    """
+    print(f"  [{scale}] {group}/{name} ...", end=" ", flush=True)
+    entry = {"group": group, "scale": scale, "name": name}
+
+    try:
+        entry.update(measure_call(func, setup=setup, repeats=repeats))
+        print(f"{entry['time_median_s']:.3f} s | pico {entry['tracemalloc_peak_mb']:.1f} MB")
+    except Exception as e:
+        entry["error"] = f"{type(e).__name__}: {e}"
+        print(f"erro: {entry['error']}")
+
+    results.append(entry)
+
+
+#%% ── casos de emissão ──────────────────────────────────────────────────────
+
+def benchmark_emission_scale(scale, dims, data_path, figpath, repeats=BENCHMARK_REPEATS,
+                             plots=BENCHMARK_PLOTS):
+    """
+    Gera os arquivos de emissão da escala e mede as funções de
+    functions_emissions sobre eles. Retorna a lista de medições.
+    """
+    ncols, nrows, nlays, nsteps = dims
+    pol = BENCHMARK_POLLUTANT
+    specs = BENCHMARK_POLLUTANT_SPECS
+    results = []
+
+    files = write_emission_files(
+        os.path.join(data_path, f"emissao_{scale}"),
+        ncols=ncols, nrows=nrows, nlays=nlays, nsteps=nsteps,
+        species=BENCHMARK_SPECIES
+    )
+
+    required = get_required_species(specs)
+    ds = open_emission_dataset(files, required_vars=required, verbose=False)
+    brazil = make_synthetic_regions()
+
+    try:
+        # TFLAG decodificado a cada execução (sem a coordenada memorizada)
+        _run_case(
+            results, "emissao", scale, "get_ioapi_datetimes", get_ioapi_datetimes,
+            setup=lambda: ((ds.drop_vars("TSTEP", errors="ignore"),), {}),
+            repeats=repeats
+        )
+        get_ioapi_datetimes(ds)
+
+        xv, yv, _, _ = ioapiCoords(ds)
+        xlon, ylat = eqmerc2latlon(ds, xv, yv)
+
+        def _fresh_region_index():
+            functions_emissions._REGION_INDEX_CACHE.clear()
+            return (xlon, ylat, brazil), {"ds": ds}
+
+        _run_case(
+            results, "emissao", scale, "get_region_index", get_region_index,
+            setup=_fresh_region_index, repeats=repeats
+        )
+        region_index = get_region_index(xlon, ylat, brazil, ds=ds)
+
+        # grafo lazy do poluente composto e a leitura completa (soma no tempo)
+        _run_case(
+            results, "emissao", scale, "build_pollutant",
+            lambda: build_pollutant(ds, pol, specs, verbose=False),
+            repeats=repeats
+        )
+        _run_case(
+            results, "emissao", scale, "build_pollutant+soma_TSTEP",
+            lambda: build_pollutant(ds, pol, specs, verbose=False)[0].sum("TSTEP").compute(),
+            repeats=repeats
+        )
+
+        da, _, _ = build_pollutant(ds, pol, specs, verbose=False)
+
+        _run_case(
+            results, "emissao", scale, "compute_emission_products",
+            lambda: compute_emission_products(da, ds, xlon, ylat, brazil, region_index=region_index),
+            repeats=repeats
+        )
+        _run_case(
+            results, "emissao", scale, "stream_emission_products",
+            lambda: stream_emission_products(
+                files, [pol], specs, region_index, max_workers=4, verbose=False
+            ),
+            repeats=repeats
+        )
+        _run_case(
+            results, "emissao", scale, "calculate_by_region_lay",
+            lambda: calculate_by_region_lay(da, xlon, ylat, brazil, region_index=region_index),
+            repeats=repeats
+        )
+        _run_case(
+            results, "emissao", scale, "calculate_region_annual_mean",
+            lambda: calculate_region_annual_mean(da, ds, xlon, ylat, brazil, region_index=region_index),
+            repeats=repeats
+        )
+        _run_case(
+            results, "emissao", scale, "compute_temporal_profile_cubes",
+            lambda: compute_temporal_profile_cubes(da, verbose=False),
+            repeats=repeats
+        )
+
+        if not plots:
+            return results
+
+        # figuras a partir dos agregados, como em process_emission_source
+        products = compute_emission_products(da, ds, xlon, ylat, brazil, region_index=region_index)
+        by_region_lay = calculate_by_region_lay(da, xlon, ylat, brazil, products=products)
+        common = dict(pol_name=pol, unit=BENCHMARK_UNIT, xlon=xlon, ylat=ylat,
+                      brazil=brazil, figpath=figpath, products=products)
+
+        plot_cases = {
+            "plot_spatial_mosaic": lambda: plot_spatial_mosaic(da=da, dims_time=["TSTEP"], **common),
+            "plot_layer_sheet": lambda: plot_layer_sheet(**common),
+            "plot_regional_vertical_profile": lambda: plot_regional_vertical_profile(
+                by_region_lay, pol, BENCHMARK_UNIT, brazil, figpath
+            ),
+            "plot_regional_total_map": lambda: plot_regional_total_map(
+                da=da, region_index=region_index, **common
+            ),
+            "plot_temporal_mosaic": lambda: plot_temporal_mosaic(
+                da=da, ds=ds, source_name="sintetica", **common
+            ),
+            "plot_annual_spatial_mosaic": lambda: plot_annual_spatial_mosaic(
+                da=da, ds=ds, source_name="sintetica", **common
+            ),
+        }
+
+        # figuras: uma execução cronometrada basta (o custo é estável)
+        for name, func in plot_cases.items():
+            _run_case(results, "figura_emissao", scale, name, func, repeats=1)
+
+    finally:
+        ds.close()
+
+    return results
+
+
+#%% ── casos de qualidade do ar ──────────────────────────────────────────────
+
+def benchmark_quality_scale(scale, dims, data_path, figpath, repeats=BENCHMARK_REPEATS,
+                            plots=BENCHMARK_PLOTS):
+    """
+    Gera os arquivos de qualidade da escala e mede as funções de
+    functions_quality sobre eles. Retorna a lista de medições.
+    """
+    ncols, nrows, nsteps = dims
+    results = []
+
+    files = write_quality_files(
+        os.path.join(data_path, f"qualidade_{scale}"),
+        ncols=ncols, nrows=nrows, nsteps=nsteps
+    )
+
+    # data_vars="minimal": LAT/LON (sem TSTEP) não são repetidos por arquivo
+    ds = xr.open_mfdataset(files, combine="by_coords", data_vars="minimal")
+    brazil = make_synthetic_regions()
+
+    try:
+        _run_case(
+            results, "qualidade", scale, "get_quality_datetimes",
+            lambda: get_quality_datetimes(ds), repeats=repeats
+        )
+        datetimes = get_quality_datetimes(ds)
+
+        # uma regra diária por poluente: média (PM10), máxima (NO2), MDA8 (O3)
+        for pol in ["PM10", "NO2", "O3"]:
+            _run_case(
+                results, "qualidade", scale, f"compute_quality_daily_metric_field[{pol}]",
+                lambda pol=pol: compute_quality_daily_metric_field(ds[pol], pol, datetimes).compute(),
+                repeats=repeats
+            )
+
+        _run_case(
+            results, "qualidade", scale, "compute_quality_annual_mean_map",
+            lambda: compute_quality_annual_mean_map(ds["O3"]), repeats=repeats
+        )
+        _run_case(
+            results, "qualidade", scale, "compute_quality_bundle",
+            lambda: compute_quality_bundle(ds["O3"], "O3", datetimes), repeats=repeats
+        )
+
+        if not plots:
+            return results
+
+        xlon = ds["LON"].values
+        ylat = ds["LAT"].values
+        common = dict(da=ds["O3"], ds=ds, pol_name="O3", unit=ds["O3"].attrs.get("units", "N/A"),
+                      xlon=xlon, ylat=ylat, brazil=brazil, figpath=figpath)
+
+        _run_case(results, "figura_qualidade", scale, "plot_quality_summary",
+                  lambda: plot_quality_summary(**common), repeats=1)
+        _run_case(results, "figura_qualidade", scale, "plot_quality_legislative_mosaic",
+                  lambda: plot_quality_legislative_mosaic(**common), repeats=1)
+
+    finally:
+        ds.close()
+
+    return results
+
+
+#%% ── ambiente e execução ───────────────────────────────────────────────────
+
+def _git_revision():
+    """
+    Commit atual do repositório e se há alterações não commitadas.
+    """
+    def _git(*args):
+        out = subprocess.run(
+            ["git", *args], cwd=SCRIPTS_PATH, capture_output=True, text=True, check=True
+        )
+        return out.stdout.strip()
+
+    try:
+        return {
+            "commit": _git("rev-parse", "HEAD"),
+            "branch": _git("rev-parse", "--abbrev-ref", "HEAD"),
+            "dirty": bool(_git("status", "--porcelain", "--", ".")),
+        }
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "branch": None, "dirty": None}
+
+
+def benchmark_environment():
+    """
+    Versões e máquina, gravadas junto das medições para comparar execuções.
+    """
+    import dask
+    import matplotlib
+
+    return {
+        "git": _git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "memory_total_gb": round(psutil.virtual_memory().total / 1024 ** 3, 2),
+        "packages": {
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "xarray": xr.__version__,
+            "dask": dask.__version__,
+            "matplotlib": matplotlib.__version__,
+        },
+    }
+
+
+def run_benchmarks(scales=None, output_path=BENCHMARK_OUTPUT_PATH, data_path=BENCHMARK_DATA_PATH,
+                   repeats=BENCHMARK_REPEATS, plots=BENCHMARK_PLOTS):
+    """
+    Roda o benchmark nas escalas pedidas (nomes de BENCHMARK_SCALES) e grava
+    benchmark_<data>_<commit>.json em `output_path`. Retorna o caminho do JSON.
+    """
+    scales = list(BENCHMARK_SCALES_TO_RUN if scales is None else scales)
+    unknown = [s for s in scales if s not in BENCHMARK_SCALES]
+    if unknown:
+        raise ValueError(f"Escalas desconhecidas: {unknown}. Disponíveis: {list(BENCHMARK_SCALES)}")
+
+    environment = benchmark_environment()
+    started = pd.Timestamp.now()
+
+    temp_data = data_path is None
+    if temp_data:
+        data_path = tempfile.mkdtemp(prefix="benchmark_cmaq_")
+    figpath = tempfile.mkdtemp(prefix="benchmark_figuras_")
+
+    results = []
+    try:
+        for scale in scales:
+            print(f"\n{'=' * 60}")
+            print(f"Escala {scale}: {BENCHMARK_SCALES[scale]}")
+            print(f"{'=' * 60}")
+
+            results += benchmark_emission_scale(
+                scale, BENCHMARK_SCALES[scale]["emission"], data_path, figpath,
+                repeats=repeats, plots=plots
+            )
+            results += benchmark_quality_scale(
+                scale, BENCHMARK_SCALES[scale]["quality"], data_path, figpath,
+                repeats=repeats, plots=plots
+            )
+    finally:
+        shutil.rmtree(figpath, ignore_errors=True)
+        if temp_data:
+            shutil.rmtree(data_path, ignore_errors=True)
+
+    report = {
+        "started": started.isoformat(timespec="seconds"),
+        "duration_s": round((pd.Timestamp.now() - started).total_seconds(), 1),
+        "environment": environment,
+        "scales": {s: BENCHMARK_SCALES[s] for s in scales},
+        "pollutant": BENCHMARK_POLLUTANT,
+        "results": results,
+    }
+
+    os.makedirs(output_path, exist_ok=True)
+    commit = (environment["git"]["commit"] or "semgit")[:8]
+    path = os.path.join(output_path, f"benchmark_{started:%Y%m%d_%H%M%S}_{commit}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1, ensure_ascii=False)
+
+    print(f"\nResultados salvos em: {path}")
+    return path
+
+
+#%% ── comparação entre execuções ────────────────────────────────────────────
+
+def load_benchmark(path):
+    """
+    Lê um JSON do benchmark como DataFrame indexado por (scale, group, name).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+
+    df = pd.DataFrame(report["results"])
+    df.attrs["commit"] = report["environment"]["git"]["commit"]
+    return df.set_index(["scale", "group", "name"])
+
+
+def compare_benchmarks(old_path, new_path, threshold=REGRESSION_THRESHOLD):
+    """
+    Compara duas execuções: razão novo/antigo da mediana do tempo e do pico
+    do tracemalloc por caso. Casos com razão acima de `threshold` são
+    marcados como regressão. Retorna o DataFrame da comparação.
+    """
+    old = load_benchmark(old_path)
+    new = load_benchmark(new_path)
+
+    cols = ["time_median_s", "tracemalloc_peak_mb"]
+    joined = old[cols].join(new[cols], lsuffix="_antigo", rsuffix="_novo", how="inner")
+
+    joined["razao_tempo"] = joined["time_median_s_novo"] / joined["time_median_s_antigo"]
+    joined["razao_memoria"] = joined["tracemalloc_peak_mb_novo"] / joined["tracemalloc_peak_mb_antigo"]
+    joined["regressao"] = (joined["razao_tempo"] > threshold) | (joined["razao_memoria"] > threshold)
+
+    print(f"Comparação {str(old.attrs['commit'])[:8]} → {str(new.attrs['commit'])[:8]}:")
+    with pd.option_context("display.width", 200, "display.max_rows", None):
+        print(joined[["time_median_s_antigo", "time_median_s_novo", "razao_tempo",
+                      "razao_memoria", "regressao"]].round(3))
+
+    n_reg = int(joined["regressao"].sum())
+    if n_reg:
+        print(f"Aviso: {n_reg} caso(s) com regressão acima de {threshold:.2f}x.")
+
+    return joined
+
+
+#%% ── execução ──────────────────────────────────────────────────────────────
+
+if __name__ == "__main__":
+    run_benchmarks()
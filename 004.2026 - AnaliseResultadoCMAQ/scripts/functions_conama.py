@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Padrões de qualidade do ar da Resolução CONAMA 491/2018 aplicados às
+saídas de qualidade do CMAQ.
+
+Para cada poluente com padrão (MP10, MP25, NO2, O3) e cada ano, por pixel:
+- dias de ultrapassagem de cada etapa (PI-1, PI-2, PI-3 e PF) do padrão de
+  curto prazo, com a métrica diária de QUALITY_RULES (média de 24 h,
+  máxima horária ou máxima média móvel de 8 h);
+- percentis 98 e 99 dos valores diários;
+- média anual e comparação com o padrão anual, quando existe;
+- etapa mais restritiva atendida (mapa de conformidade).
+
+Tudo sai de um único dask.compute sobre o cubo diário de
+compute_quality_daily_metric_field, que tem o tempo inteiro em cada bloco
+espacial: contagens e percentis são exatos e a memória fica limitada ao
+tamanho do bloco.
+
+As concentrações são convertidas para µg/m³ (25 °C e 1 atm, como na
+resolução) a partir do atributo units (ppb/ppbV, ppm/ppmV ou µg/m³).
+"""
+
+import os
+
+import dask
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from functions_quality import QUALITY_RULES, compute_quality_daily_metric_field
+
+
+#%% ── padrões ───────────────────────────────────────────────────────────────
+
+CONAMA_491_STAGES = ("PI-1", "PI-2", "PI-3", "PF")
+
+# limites em µg/m³, na ordem de CONAMA_491_STAGES
+CONAMA_491_STANDARDS = {
+    "PM10": {"averaging": "24 h", "short_term": (120, 100, 75, 50), "annual": (40, 35, 30, 20)},
+    "PM25": {"averaging": "24 h", "short_term": (60, 50, 37, 25), "annual": (20, 17, 15, 10)},
+    "NO2": {"averaging": "1 h", "short_term": (260, 240, 220, 200), "annual": (60, 50, 45, 40)},
+    "O3": {"averaging": "8 h", "short_term": (140, 130, 120, 100), "annual": None},
+}
+
+# massas molares (g/mol) para converter razão de mistura em µg/m³
+MOLAR_MASSES = {
+    "NO2": 46.0055,
+    "O3": 47.9982,
+    "SO2": 64.066,
+    "CO": 28.010,
+}
+
+# volume molar a 25 °C e 1 atm (L/mol)
+MOLAR_VOLUME_25C = 24.45
+
+
+def conama_unit_factor(pol_name, unit):
+    """
+    Fator que converte a unidade do arquivo em µg/m³.
+    """
+    key = str(unit).strip().lower().replace(" ", "").replace("µ", "u").replace("³", "3")
+
+    if key in ("ug/m3", "ugm-3", "ug.m-3", "microgram/m3"):
+        return 1.0
+
+    if key in ("ppb", "ppbv", "ppm", "ppmv"):
+        if pol_name not in MOLAR_MASSES:
+            raise ValueError(f"Massa molar de {pol_name} não definida para converter {unit}.")
+        factor = MOLAR_MASSES[pol_name] / MOLAR_VOLUME_25C
+        return factor * 1000.0 if key.startswith("ppm") else factor
+
+    raise ValueError(f"Unidade não suportada para os padrões CONAMA: {unit}")
+
+
+#%% ── motor de métricas ─────────────────────────────────────────────────────
+
+def compute_conama_metrics(da, pol_name, datetimes, unit=None, percentiles=(98, 99),
+                           allowed_exceedances=0, bundle=None):
+    """
+    Avalia todas as etapas da CONAMA 491/2018 de um poluente, por pixel e
+    por ano, em um único dask.compute.
+
+    `allowed_exceedances` é o número de dias de ultrapassagem tolerado no
+    padrão de curto prazo para considerar a etapa atendida (0 na resolução).
+
+    Com `bundle` (functions_quality.compute_quality_bundle, com o cubo
+    diário) as métricas saem do pacote já calculado, sem reler os dados.
+
+    Retorna um xr.Dataset com:
+    - exceedance_days (stage, year, ROW, COL)
+    - valid_days (year, ROW, COL): dias com métrica diária válida
+    - daily_p{N} (year, ROW, COL): percentis dos valores diários
+    - annual_mean (year, ROW, COL): média do período horário no ano
+    - stage_met (year, ROW, COL): etapas atendidas em sequência a partir do
+      PI-1 (0 = acima do PI-1, 4 = atende o PF; NaN sem dados)
+    """
+    if pol_name not in CONAMA_491_STANDARDS:
+        raise ValueError(f"Poluente {pol_name} sem padrão CONAMA 491 definido.")
+    if pol_name not in QUALITY_RULES:
+        raise ValueError(f"Poluente {pol_name} não está definido em QUALITY_RULES.")
+
+    standard = CONAMA_491_STANDARDS[pol_name]
+    if unit is None:
+        unit = da.attrs.get("units", "ug/m3")
+    factor = conama_unit_factor(pol_name, unit)
+
+    datetimes = pd.DatetimeIndex(datetimes)
+
+    # --- cubo diário e médias anuais em µg/m³ (preguiçosos sem bundle)
+    if bundle is not None:
+        if bundle.get("daily_field") is None:
+            raise ValueError("O bundle não contém o cubo diário (keep_daily_field=False).")
+        daily = bundle["daily_field"] * factor
+        annual_mean = bundle["yearly_mean_maps"] * factor
+    else:
+        daily = compute_quality_daily_metric_field(da, pol_name, datetimes) * factor
+        hourly = da.isel(LAY=0) if "LAY" in da.dims else da
+        hourly = hourly.assign_coords(TSTEP=datetimes.values) * factor
+        annual_mean = hourly.groupby(hourly["TSTEP"].dt.year.rename("year")).mean(dim="TSTEP")
+
+    day_year = daily["day"].dt.year.rename("year")
+
+    stage = xr.DataArray(list(CONAMA_491_STAGES), dims="stage", name="stage")
+    limits = xr.DataArray(np.asarray(standard["short_term"], dtype=float), dims="stage",
+                          coords={"stage": stage})
+
+    lazy = {
+        "exceedance_days": (daily > limits).groupby(day_year).sum(dim="day"),
+        "valid_days": daily.notnull().groupby(day_year).sum(dim="day"),
+        "annual_mean": annual_mean,
+    }
+    for p in percentiles:
+        lazy[f"daily_p{p}"] = (
+            daily.groupby(day_year).quantile(p / 100, dim="day", skipna=True).drop_vars("quantile")
+        )
+
+    (computed,) = dask.compute(lazy)
+
+    result = xr.Dataset(computed)
+    result["exceedance_days"] = result["exceedance_days"].transpose("stage", "year", "ROW", "COL")
+    result["valid_days"] = result["valid_days"].astype("int32")
+
+    # --- conformidade por etapa (curto prazo e, se houver, anual)
+    ok = result["exceedance_days"] <= allowed_exceedances
+    if standard["annual"] is not None:
+        annual_limits = xr.DataArray(np.asarray(standard["annual"], dtype=float), dims="stage",
+                                     coords={"stage": stage})
+        result["annual_limit"] = annual_limits
+        ok = ok & (result["annual_mean"] <= annual_limits)
+
+    # etapas são cumulativas: conta as atendidas em sequência desde o PI-1
+    stage_met = ok.astype(int).cumprod(dim="stage").sum(dim="stage")
+    result["stage_met"] = stage_met.where(result["valid_days"] > 0)
+    result["short_term_limit"] = limits
+
+    result.attrs.update(
+        pollutant=pol_name,
+        units="ug/m3",
+        source_units=str(unit),
+        averaging=standard["averaging"],
+        daily_rule=QUALITY_RULES[pol_name]["daily_rule"],
+        allowed_exceedances=int(allowed_exceedances),
+        stages=",".join(CONAMA_491_STAGES),
+        standard="CONAMA 491/2018",
+    )
+    return result
+
+
+def write_conama_compliance(result, output_path):
+    """
+    Grava as métricas/mapas de conformidade de um poluente em
+    {output_path}/conama491_{poluente}.nc e retorna o caminho.
+    """
+    os.makedirs(output_path, exist_ok=True)
+    path = os.path.join(output_path, f"conama491_{result.attrs['pollutant']}.nc")
+
+    encoding = {v: {"zlib": True, "complevel": 4} for v in result.data_vars}
+    result.to_netcdf(path + ".tmp", encoding=encoding)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def summarize_conama_compliance(result):
+    """
+    Tabela por ano: pixels válidos, fração em cada etapa atendida e máximo
+    de dias de ultrapassagem por etapa.
+    """
+    rows = []
+    for year in result["year"].values:
+        res_year = result.sel(year=year)
+        stage_met = res_year["stage_met"].values
+        valid = np.isfinite(stage_met)
+        n_valid = int(valid.sum())
+
+        row = {"year": int(year), "pixels": n_valid}
+        labels = ["Acima do PI-1"] + list(CONAMA_491_STAGES)
+        for level, label in enumerate(labels):
+            row[f"% {label}"] = 100 * float((stage_met[valid] == level).sum()) / n_valid if n_valid else np.nan
+        for st in CONAMA_491_STAGES:
+            row[f"máx. dias > {st}"] = int(res_year["exceedance_days"].sel(stage=st).max())
+        rows.append(row)
+
+    return pd.DataFrame(rows).set_index("year")
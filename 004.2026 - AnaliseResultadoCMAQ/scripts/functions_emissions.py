@@ -5,6 +5,7 @@ Created on Mon Mar  9 16:19:02 2026
 @author: glima
 """
 
+import dask
 import xarray as xr
 import numpy as np
 import pandas as pd
@@ -15,9 +16,13 @@ import matplotlib.gridspec as gridspec
 from matplotlib.lines import Line2D
 from matplotlib.patches import Patch
 import os
+import hashlib
+import weakref
 from shapely.geometry import box
 import geopandas as gpd
 
+from functions_render import finish_figure
+
 
 plt.rcParams["font.family"] = "Arial"
 
@@ -51,18 +56,195 @@ def ioapiCoords(ds):
     xv, yv = np.meshgrid(lon,lat)
     return xv,yv,lon,lat
 
+# projeções pyproj por grade (chave: XCENT), criadas uma única vez por sessão
+_IOAPI_PROJ_CACHE = {}
+
+def get_ioapi_projection(ds):
+    """
+    Projeção Mercator equatorial da grade IOAPI (esfera de 6370 km),
+    reaproveitada entre fontes e chamadas.
+    """
+    key = float(ds.XCENT)
+    if key not in _IOAPI_PROJ_CACHE:
+        mapstr = '+proj=merc +a=%s +b=%s +lat_ts=0 +lon_0=%s +units=m +no_defs' % (
+                  6370000, 6370000, ds.XCENT)
+        _IOAPI_PROJ_CACHE[key] = pyproj.Proj(mapstr)
+    return _IOAPI_PROJ_CACHE[key]
+
+def ioapi_lonlat_axes(ds):
+    """
+    Eixos 1D (lon por coluna, lat por linha) da grade. Na Mercator
+    equatorial a longitude depende só de x e a latitude só de y, então basta
+    transformar NCOLS + NROWS pontos em vez da grade inteira.
+    """
+    p = get_ioapi_projection(ds)
+    _, _, x, y = ioapiCoords(ds)
+
+    lon, _ = p(x, np.zeros_like(x), inverse=True)
+    _, lat = p(np.zeros_like(y), y, inverse=True)
+    return np.asarray(lon), np.asarray(lat)
+
 def eqmerc2latlon(ds,xv,yv):
 
-    mapstr = '+proj=merc +a=%s +b=%s +lat_ts=0 +lon_0=%s +units=m +no_defs' % (
-              6370000, 6370000, ds.XCENT)
     #p = pyproj.Proj("+proj=merc +lon_0="+str(ds.P_GAM)+" +k=1 +x_0=0 +y_0=0 +a=6370000 +b=6370000 +towgs84=0,0,0,0,0,0,0 +units=m +no_defs")
-    p = pyproj.Proj(mapstr)
+    p = get_ioapi_projection(ds)
+
+    # grade retangular em x/y: transforma só os eixos e expande
+    if np.ndim(xv) == 2 and separable_grid_axes(xv, yv) is not None:
+        lon, _ = p(xv[0, :], np.zeros(xv.shape[1]), inverse=True)
+        _, lat = p(np.zeros(yv.shape[0]), yv[:, 0], inverse=True)
+        xlon, ylat = np.meshgrid(lon, lat)
+        return xlon, ylat
+
     xlon, ylat = p(xv, yv, inverse=True)
-    
 
     return xlon,ylat
 
-def add_brazil_inverse_mask(ax, brazil, xlon, ylat, pad=1.0, facecolor="white"):
+def separable_grid_axes(xlon, ylat):
+    """
+    Retorna (x 1D por coluna, y 1D por linha) se a grade 2D for retangular
+    (x constante ao longo das linhas e y ao longo das colunas), ou None.
+    """
+    xlon = np.asarray(xlon)
+    ylat = np.asarray(ylat)
+    if xlon.ndim != 2 or xlon.shape != ylat.shape:
+        return None
+
+    if not (np.array_equal(xlon, np.broadcast_to(xlon[:1, :], xlon.shape))
+            and np.array_equal(ylat, np.broadcast_to(ylat[:, :1], ylat.shape))):
+        return None
+
+    return xlon[0, :], ylat[:, 0]
+
+def _cell_edges(centers):
+    """
+    Bordas das células a partir dos centros (pontos médios; extremos
+    extrapolados meia célula), como o shading="nearest" do pcolormesh.
+    """
+    mid = 0.5 * (centers[1:] + centers[:-1])
+    first = centers[0] - (mid[0] - centers[0])
+    last = centers[-1] + (centers[-1] - mid[-1])
+    return np.concatenate([[first], mid, [last]])
+
+def plot_grid_field(ax, xlon, ylat, data, cmap=None, norm=None, **kwargs):
+    """
+    Desenha um campo 2D da grade. Em grades retangulares em lon/lat (caso da
+    Mercator equatorial) usa pcolorfast, que vira uma imagem raster
+    (imshow/PcolorImage): bem mais rápido e arquivos menores que o
+    pcolormesh, que desenha um polígono por célula. Grades curvilíneas
+    continuam no pcolormesh.
+    """
+    axes_1d = separable_grid_axes(xlon, ylat)
+    values = np.asarray(data)
+
+    if axes_1d is None or min(values.shape) < 2:
+        return ax.pcolormesh(xlon, ylat, values, cmap=cmap, norm=norm, shading="auto", **kwargs)
+
+    lon, lat = axes_1d
+
+    # pcolorfast espera eixos crescentes (fontes com linhas invertidas)
+    if lon[-1] < lon[0]:
+        lon = lon[::-1]
+        values = values[:, ::-1]
+    if lat[-1] < lat[0]:
+        lat = lat[::-1]
+        values = values[::-1, :]
+
+    return ax.pcolorfast(_cell_edges(lon), _cell_edges(lat), values, cmap=cmap, norm=norm, **kwargs)
+
+# geometrias da máscara já calculadas nesta sessão
+_BRAZIL_UNION_CACHE = {}
+_INVERSE_MASK_CACHE = {}
+
+# hash das geometrias por GeoDataFrame vivo: id -> (weakref, hash); a entrada
+# sai quando o objeto é coletado, então um id reaproveitado não herda o hash
+_GEOMETRY_KEY_CACHE = {}
+
+
+def _geometry_to_path(geom):
+    """
+    Converte um Polygon/MultiPolygon do shapely em um único matplotlib Path,
+    com furos orientados no sentido oposto ao contorno externo.
+    """
+    from matplotlib.path import Path
+    from shapely.geometry.polygon import orient
+
+    polygons = getattr(geom, "geoms", [geom])
+
+    paths = []
+    for poly in polygons:
+        if poly.is_empty or poly.geom_type != "Polygon":
+            continue
+        poly = orient(poly, sign=1.0)
+        for ring in [poly.exterior, *poly.interiors]:
+            paths.append(Path(np.asarray(ring.coords)[:, :2], closed=True))
+
+    return Path.make_compound_path(*paths)
+
+
+def _geometry_key(gdf):
+    """
+    Hash do conteúdo das geometrias (WKB) de um GeoDataFrame, calculado uma
+    vez por objeto e reaproveitado pelos painéis seguintes.
+
+    O id() sozinho não serve de chave: o Python reaproveita ids de objetos
+    coletados, e outro shapefile carregado na mesma sessão herdaria o cache.
+    Por isso o hash fica associado ao objeto vivo (weakref) e é descartado
+    quando ele é coletado.
+    """
+    entry = _GEOMETRY_KEY_CACHE.get(id(gdf))
+    if entry is not None and entry[0]() is gdf:
+        return entry[1]
+
+    h = hashlib.sha1()
+    for wkb in gdf.geometry.to_wkb():
+        h.update(wkb if wkb is not None else b"")
+    key = h.hexdigest()[:16]
+
+    gdf_id = id(gdf)
+    _GEOMETRY_KEY_CACHE[gdf_id] = (
+        weakref.ref(gdf, lambda _ref: _GEOMETRY_KEY_CACHE.pop(gdf_id, None)),
+        key,
+    )
+    return key
+
+
+def get_brazil_inverse_mask_path(brazil, xlon, ylat, pad=1.0, simplify=None):
+    """
+    Retorna o Path (matplotlib) da área fora do Brasil dentro da extensão do
+    grid + pad.
+
+    A união do Brasil é feita uma vez por conteúdo de geometria (e tolerância
+    de simplificação) e o polígono inverso uma vez por extensão/pad, então os
+    painéis de um mosaico reaproveitam a mesma geometria.
+    """
+    xmin = float(np.nanmin(xlon)) - pad
+    xmax = float(np.nanmax(xlon)) + pad
+    ymin = float(np.nanmin(ylat)) - pad
+    ymax = float(np.nanmax(ylat)) + pad
+
+    union_key = (_geometry_key(brazil), simplify)
+    extent_key = tuple(round(v, 6) for v in (xmin, ymin, xmax, ymax))
+    mask_key = union_key + extent_key
+
+    if mask_key in _INVERSE_MASK_CACHE:
+        return _INVERSE_MASK_CACHE[mask_key]
+
+    if union_key not in _BRAZIL_UNION_CACHE:
+        brazil_union = brazil.union_all()
+        if simplify:
+            brazil_union = brazil_union.simplify(simplify, preserve_topology=True)
+        _BRAZIL_UNION_CACHE[union_key] = brazil_union
+
+    outer = box(xmin, ymin, xmax, ymax)
+    inverse_mask = outer.difference(_BRAZIL_UNION_CACHE[union_key])
+
+    path = _geometry_to_path(inverse_mask)
+    _INVERSE_MASK_CACHE[mask_key] = path
+    return path
+
+
+def add_brazil_inverse_mask(ax, brazil, xlon, ylat, pad=1.0, facecolor="white", simplify=None):
     """
     Plota uma máscara branca fora do Brasil para esconder pixels externos.
 
@@ -78,26 +260,26 @@ def add_brazil_inverse_mask(ax, brazil, xlon, ylat, pad=1.0, facecolor="white"):
         Margem adicional ao redor da extensão do grid.
     facecolor : str
         Cor da máscara externa.
-    """
-    # união do Brasil inteiro
-    brazil_union = brazil.unary_union
+    simplify : float, optional
+        Tolerância (graus) para simplificar o contorno do Brasil.
 
-    # extensão total do grid
-    xmin = float(np.nanmin(xlon)) - pad
-    xmax = float(np.nanmax(xlon)) + pad
-    ymin = float(np.nanmin(ylat)) - pad
-    ymax = float(np.nanmax(ylat)) + pad
+    A geometria vem do cache (get_brazil_inverse_mask_path); por eixo é
+    criado apenas um PathPatch leve, já que um artista do matplotlib não
+    pode pertencer a mais de um eixo.
+    """
+    from matplotlib.patches import PathPatch
 
-    outer = box(xmin, ymin, xmax, ymax)
-    inverse_mask = outer.difference(brazil_union)
+    path = get_brazil_inverse_mask_path(brazil, xlon, ylat, pad=pad, simplify=simplify)
 
-    mask_gdf = gpd.GeoDataFrame(geometry=[inverse_mask], crs="EPSG:4326")
-    mask_gdf.plot(
-        ax=ax,
-        color=facecolor,
-        edgecolor="none",
-        zorder=8
+    ax.add_patch(
+        PathPatch(
+            path,
+            facecolor=facecolor,
+            edgecolor="none",
+            zorder=8
+        )
     )
+    ax.autoscale_view()
 
 #%% ── helpers para espécies/poluentes ───────────────────────────────────────
 
@@ -110,61 +292,595 @@ def get_available_species(ds):
     return set(ds.data_vars)
 
 
-def build_pollutant(ds, pol_name, pollutant_specs, verbose=True):
+def _is_composite(component, pol_name, pollutant_specs):
+    """
+    Um componente é outro poluente (nó do DAG) quando é chave de
+    pollutant_specs e não é o próprio poluente (ex.: "CO": ["CO"]).
+    """
+    return component in pollutant_specs and component != pol_name
+
+
+def resolve_pollutant_species(pol_name, pollutant_specs, _stack=()):
+    """
+    Expande um poluente do DAG de POLLUTANT_SPECS até as espécies do arquivo.
+
+    Ex.: MP10 = ["MP25", "PMC"] -> PMC + todas as PMFINE_* do MP25.
+    A ordem é preservada e espécies repetidas aparecem uma única vez.
+    """
+    if pol_name not in pollutant_specs:
+        raise ValueError(f"Poluente '{pol_name}' não está em POLLUTANT_SPECS.")
+
+    if pol_name in _stack:
+        cycle = " -> ".join(list(_stack) + [pol_name])
+        raise ValueError(f"Definição circular em POLLUTANT_SPECS: {cycle}")
+
+    species = []
+    for comp in pollutant_specs[pol_name]:
+        if _is_composite(comp, pol_name, pollutant_specs):
+            sub = resolve_pollutant_species(comp, pollutant_specs, _stack + (pol_name,))
+        else:
+            sub = [comp]
+        species.extend(v for v in sub if v not in species)
+
+    return species
+
+
+def _sum_species(ds, species):
+    """
+    Soma espécies em uma única redução sobre um eixo SPECIES, em vez de uma
+    cadeia de adições (que gera grafos dask profundos).
+    """
+    if len(species) == 1:
+        return squeeze_var_dim(ds[species[0]])
+
+    stack = xr.concat(
+        [squeeze_var_dim(ds[v]) for v in species],
+        dim="SPECIES",
+        coords="minimal",
+        compat="override",
+        join="override"
+    )
+    return stack.sum(dim="SPECIES", skipna=False)
+
+
+def _report_pollutant_species(pol_name, present, missing):
+    """
+    Relatório das espécies encontradas/ausentes de um poluente.
+    """
+    print(f"\n--- {pol_name} ---")
+    print(f"Espécies pedidas: {len(present) + len(missing)}")
+    print(f"Espécies encontradas: {len(present)}")
+    if missing:
+        print("Espécies ausentes:")
+        print(", ".join(missing))
+    if not present:
+        print(f"{pol_name}: nenhuma espécie disponível. Pulando.")
+
+
+def build_pollutant(ds, pol_name, pollutant_specs, verbose=True, cache=None):
     """
     Monta um poluente a partir das espécies disponíveis no dataset.
     
     Regras:
     - CO, NO2, SO2: usa diretamente a variável.
     - MP10, MP25: soma apenas as espécies disponíveis.
+    - Um componente que também é poluente de pollutant_specs é montado antes
+      e reutilizado (ex.: MP10 = MP25 + PMC).
     - Se nenhuma espécie existir, retorna None.
+
+    `cache` (dict, um por fonte) guarda os poluentes já montados, para que
+    intermediários como o MP25 sejam compartilhados entre poluentes.
     """
-    if pol_name not in pollutant_specs:
-        raise ValueError(f"Poluente '{pol_name}' não está em POLLUTANT_SPECS.")
-    
-    requested = pollutant_specs[pol_name]
+    if cache is None:
+        cache = {}
+
+    # já montado (ex.: MP25 dentro do MP10, sem relatório): só reporta
+    if pol_name in cache:
+        if verbose:
+            _report_pollutant_species(pol_name, *cache[pol_name][1:])
+        return cache[pol_name]
+
+    requested = resolve_pollutant_species(pol_name, pollutant_specs)
     available = get_available_species(ds)
     
     present = [v for v in requested if v in available]
     missing = [v for v in requested if v not in available]
     
     if verbose:
-        print(f"\n--- {pol_name} ---")
-        print(f"Espécies pedidas: {len(requested)}")
-        print(f"Espécies encontradas: {len(present)}")
-        if missing:
-            print("Espécies ausentes:")
-            print(", ".join(missing))
+        _report_pollutant_species(pol_name, present, missing)
     
     if len(present) == 0:
-        if verbose:
-            print(f"{pol_name}: nenhuma espécie disponível. Pulando.")
-        return None, present, missing
+        cache[pol_name] = (None, present, missing)
+        return cache[pol_name]
     
-    # soma as espécies disponíveis
-    da = squeeze_var_dim(ds[present[0]])
-    for var in present[1:]:
-        da = da + squeeze_var_dim(ds[var])
+    # nós intermediários (outros poluentes) + espécies diretas
+    terms = []
+    species = []
+    for comp in pollutant_specs[pol_name]:
+        if _is_composite(comp, pol_name, pollutant_specs):
+            sub_da, _, _ = build_pollutant(ds, comp, pollutant_specs, verbose=False, cache=cache)
+            if sub_da is not None:
+                terms.append(sub_da)
+        elif comp in available:
+            species.append(comp)
+
+    if species:
+        terms.append(_sum_species(ds, species))
+
+    da = terms[0]
+    for term in terms[1:]:
+        da = da + term
     
-    da.name = pol_name
-    return da, present, missing
+    da = da.rename(pol_name)
+    cache[pol_name] = (da, present, missing)
+    return cache[pol_name]
+
+#%% ── leitura das pastas IOAPI ────────────────────────────────────────────────
+
+def get_required_species(pollutant_specs, pollutants=None):
+    """
+    Conjunto de variáveis que precisam ser lidas dos arquivos: as espécies de
+    todos os poluentes pedidos (DAG expandido) mais o TFLAG.
+    """
+    if pollutants is None:
+        pollutants = list(pollutant_specs)
+
+    required = {"TFLAG"}
+    for pol in pollutants:
+        required.update(resolve_pollutant_species(pol, pollutant_specs))
+
+    return required
+
+
+def plan_ioapi_chunks(sample_file, variables, target_chunk_mb=128):
+    """
+    Define os chunks (por arquivo) para as reduções usadas nas figuras.
+
+    As somas regionais e os mapas precisam de ROW/COL inteiros em cada
+    bloco, então o espaço nunca é dividido. O bloco cresce em TSTEP até
+    ~target_chunk_mb; se um único passo de tempo já passa disso, divide LAY.
+    """
+    with xr.open_dataset(sample_file) as sample:
+        ref = next((v for v in variables if v in sample and v != "TFLAG"), None)
+        if ref is None:
+            return {}
+
+        nt = sample.sizes.get("TSTEP", 1)
+        nlay = sample.sizes.get("LAY", 1)
+        nrow = sample.sizes["ROW"]
+        ncol = sample.sizes["COL"]
+        itemsize = sample[ref].dtype.itemsize
+
+    target = target_chunk_mb * 1024 ** 2
+    step_bytes = nlay * nrow * ncol * itemsize
+
+    if step_bytes <= target:
+        return {"TSTEP": int(min(nt, max(1, target // step_bytes))), "LAY": -1, "ROW": -1, "COL": -1}
+
+    lay_chunk = int(max(1, target // (nrow * ncol * itemsize)))
+    return {"TSTEP": 1, "LAY": lay_chunk, "ROW": -1, "COL": -1}
+
+
+def report_dataset_footprint(ds, n_workers=None):
+    """
+    Imprime o volume que será lido (preguiçoso) e o pico de memória esperado
+    pelos blocos, antes de qualquer .compute().
+    """
+    if n_workers is None:
+        n_workers = dask.config.get("num_workers", None) or os.cpu_count() or 1
+
+    emission_vars = [v for v in ds.data_vars if v != "TFLAG"]
+    total_bytes = sum(ds[v].nbytes for v in emission_vars)
+
+    chunk_bytes = 0
+    chunk_shape = None
+    for v in emission_vars:
+        data = ds[v].data
+        if hasattr(data, "chunksize"):
+            nbytes = int(np.prod(data.chunksize)) * data.dtype.itemsize
+            if nbytes > chunk_bytes:
+                chunk_bytes = nbytes
+                chunk_shape = dict(zip(ds[v].dims, data.chunksize))
+
+    print(f"Variáveis lidas: {len(emission_vars)} (+ TFLAG)")
+    print(f"Volume total: {total_bytes / 1024 ** 3:.2f} GB")
+    if chunk_shape is not None:
+        print(f"Maior bloco: {chunk_shape} = {chunk_bytes / 1024 ** 2:.1f} MB")
+        print(f"Pico estimado com {n_workers} worker(s): "
+              f"~{2 * n_workers * chunk_bytes / 1024 ** 2:.0f} MB")
+
+    return {"total_bytes": total_bytes, "chunk_bytes": chunk_bytes, "chunk_shape": chunk_shape}
+
+
+def open_emission_dataset(files, required_vars=None, target_chunk_mb=128, verbose=True):
+    """
+    Abre uma pasta de arquivos IOAPI de emissão ao longo de TSTEP.
+
+    - `required_vars` (ver get_required_species): todas as outras variáveis
+      são descartadas já no preprocess de cada arquivo, o que evita carregar
+      metadados das dezenas de COVs que não usamos;
+    - os chunks vêm de plan_ioapi_chunks;
+    - se verbose, reporta o volume e o pico de memória planejados.
+    """
+    def _keep_required(ds_file):
+        if required_vars is not None:
+            keep = [v for v in ds_file.data_vars if v in required_vars]
+            ds_file = ds_file[keep]
+
+        # TFLAG repete o mesmo tempo para todas as variáveis; mantém só VAR=0
+        # para que arquivos com NVARS diferentes possam ser concatenados
+        if "VAR" in ds_file.dims:
+            ds_file = ds_file.isel(VAR=slice(0, 1))
+
+        return ds_file
+
+    variables = sorted(required_vars) if required_vars is not None else []
+    if not variables:
+        with xr.open_dataset(files[0]) as sample:
+            variables = list(sample.data_vars)
+
+    chunks = plan_ioapi_chunks(files[0], variables, target_chunk_mb=target_chunk_mb)
+
+    ds = xr.open_mfdataset(
+        files,
+        concat_dim="TSTEP",
+        combine="nested",
+        parallel=True,
+        preprocess=_keep_required,
+        chunks=chunks,
+        data_vars="all",
+        coords="minimal",
+        compat="override"
+    )
+
+    if verbose:
+        report_dataset_footprint(ds)
+
+    return ds
+
+#%% ── índice grid → macro-região ─────────────────────────────────────────────
+
+IOAPI_GRID_ATTRS = ["XORIG", "YORIG", "XCELL", "YCELL", "NCOLS", "NROWS", "XCENT"]
+
+# índices já carregados nesta sessão, por chave do grid
+_REGION_INDEX_CACHE = {}
+
+
+def ioapi_grid_key(xlon, ylat, brazil, ds=None):
+    """
+    Chave curta (hash) que identifica o par grid + macro-regiões.
+
+    Usa os atributos IOAPI do grid (IOAPI_GRID_ATTRS) quando `ds` os possui;
+    caso contrário, usa o conteúdo de xlon/ylat. A orientação das linhas
+    entra na chave, pois as fontes rotacionadas invertem xlon/ylat.
+    """
+    ylat = np.asarray(ylat)
+
+    if ds is not None and all(a in ds.attrs for a in IOAPI_GRID_ATTRS):
+        grid_id = ";".join(f"{a}={float(ds.attrs[a]):.6f}" for a in IOAPI_GRID_ATTRS)
+    else:
+        grid_id = hashlib.sha1(
+            np.ascontiguousarray(xlon, dtype=float).tobytes()
+            + np.ascontiguousarray(ylat, dtype=float).tobytes()
+        ).hexdigest()
+
+    orientation = "N-S" if ylat[0, 0] > ylat[-1, 0] else "S-N"
+    labels = ",".join(sorted(brazil["NM_REGIA"].astype(str).unique()))
+    bounds = ",".join(f"{b:.4f}" for b in brazil.total_bounds)
+
+    raw = f"{grid_id}|{orientation}|{labels}|{bounds}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _build_region_mask(xlon, ylat, brazil):
+    """
+    Rasteriza as macro-regiões (NM_REGIA) no grid e retorna (mask, nomes).
+    """
+    import regionmask
+
+    if "NM_REGIA" not in brazil.columns:
+        raise ValueError("O shapefile precisa ter a coluna 'NM_REGIA'.")
+
+    brazil_reg = brazil.dissolve(by="NM_REGIA", as_index=False)
+    labels = brazil_reg["NM_REGIA"].astype(str).values
+
+    regions = regionmask.Regions(
+        outlines=list(brazil_reg.geometry),
+        names=list(labels),
+        abbrevs=list(labels),
+    )
+
+    mask = regions.mask(
+        xr.DataArray(xlon, dims=("ROW", "COL")),
+        xr.DataArray(ylat, dims=("ROW", "COL")),
+    ).rename("region_id")
+
+    return mask, regions.names
+
+
+def get_region_index(xlon, ylat, brazil, ds=None, cache_dir=None):
+    """
+    Retorna o índice célula → macro-região do grid, como matriz esparsa
+    (NROWS*NCOLS x n_regiões) com 1 nas células de cada região.
+
+    O índice é calculado uma única vez por grid (ver ioapi_grid_key): fica em
+    memória durante a sessão e, se `cache_dir` for informado, é salvo em disco
+    (.npz) para as próximas execuções.
+
+    Retorna um dicionário com: key, matrix (scipy.sparse.csr_matrix), names,
+    shape (NROWS, NCOLS) e n_cells (células por região).
+    """
+    from scipy import sparse
+
+    if "NM_REGIA" not in brazil.columns:
+        raise ValueError("O shapefile precisa ter a coluna 'NM_REGIA'.")
+
+    key = ioapi_grid_key(xlon, ylat, brazil, ds=ds)
+
+    if key in _REGION_INDEX_CACHE:
+        return _REGION_INDEX_CACHE[key]
+
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir, f"region_index_{key}.npz")
+
+    if cache_file is not None and os.path.isfile(cache_file):
+        with np.load(cache_file, allow_pickle=False) as f:
+            matrix = sparse.csr_matrix(
+                (f["data"], f["indices"], f["indptr"]), shape=tuple(f["matrix_shape"])
+            )
+            names = [str(n) for n in f["names"]]
+            shape = tuple(int(v) for v in f["grid_shape"])
+    else:
+        mask, names = _build_region_mask(xlon, ylat, brazil)
+        names = [str(n) for n in names]
+        shape = mask.shape
+
+        region_id = mask.values.ravel()
+        cells = np.flatnonzero(np.isfinite(region_id))
+
+        matrix = sparse.csr_matrix(
+            (np.ones(cells.size), (cells, region_id[cells].astype(int))),
+            shape=(region_id.size, len(names))
+        )
+
+        if cache_file is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.savez_compressed(
+                cache_file,
+                data=matrix.data,
+                indices=matrix.indices,
+                indptr=matrix.indptr,
+                matrix_shape=np.array(matrix.shape),
+                names=np.array(names),
+                grid_shape=np.array(shape),
+            )
+
+    region_index = {
+        "key": key,
+        "matrix": matrix,
+        "names": names,
+        "shape": shape,
+        "n_cells": np.asarray(matrix.sum(axis=0)).ravel(),
+    }
+    _REGION_INDEX_CACHE[key] = region_index
+    return region_index
+
+
+def aggregate_by_region(da, region_index):
+    """
+    Soma um campo (..., ROW, COL) por macro-região com um único produto
+    esparso sobre o grid achatado: (..., ROW*COL) @ (ROW*COL, região).
+
+    Funciona para qualquer pilha de camadas/tempos e também com dask
+    (cada bloco precisa ter ROW e COL inteiros; o rechunk é automático).
+    """
+    matrix = region_index["matrix"]
+    names = region_index["names"]
+
+    def _region_matmul(arr):
+        flat = arr.reshape(-1, arr.shape[-2] * arr.shape[-1])
+        if np.isnan(flat).any():
+            flat = np.nan_to_num(flat)
+        out = np.asarray(matrix.T @ flat.T).T
+        return out.reshape(arr.shape[:-2] + (len(names),))
+
+    by_region = xr.apply_ufunc(
+        _region_matmul,
+        da,
+        input_core_dims=[["ROW", "COL"]],
+        output_core_dims=[["region"]],
+        dask="parallelized",
+        output_dtypes=[float],
+        dask_gufunc_kwargs={"output_sizes": {"region": len(names)}, "allow_rechunk": True},
+    )
+    return by_region.assign_coords(region=("region", names))
+
+#%% ── planejador de agregados (passo único) ─────────────────────────────────
+
+def yearly_grouped_sum(da, datetimes):
+    """
+    Soma por ano, em uma única passada sobre TSTEP, no estilo das reduções
+    agrupadas do flox: cada chunk de tempo é multiplicado por uma matriz
+    indicadora (TSTEP x ano) e os parciais por ano são somados entre chunks.
+    Substitui o laço isel-por-ano, que relia os arquivos uma vez por ano.
+
+    As camadas (LAY), se existirem, também são somadas. NaN contam como
+    zero, como no .sum() do xarray.
+
+    Retorna (DataArray preguiçoso (year, ROW, COL), anos).
+    """
+    years = np.asarray(pd.DatetimeIndex(datetimes).year)
+    unique_years = np.sort(np.unique(years))
+
+    if unique_years.size == 0:
+        raise ValueError("Nenhum ano encontrado no TFLAG.")
+
+    if "LAY" in da.dims:
+        da = da.sum(dim="LAY")
+
+    onehot = xr.DataArray(
+        (years[:, None] == unique_years[None, :]).astype(da.dtype),
+        dims=("TSTEP", "year"),
+        coords={"year": unique_years}
+    )
+    if da.chunks is not None:
+        onehot = onehot.chunk({"TSTEP": da.chunksizes["TSTEP"], "year": -1})
+
+    stack = xr.dot(da.fillna(0), onehot, dims="TSTEP").transpose("year", ...)
+    return stack, unique_years
+
+
+def compute_emission_products(da, ds, xlon, ylat, brazil, region_index=None):
+    """
+    Monta, de forma preguiçosa, todos os agregados usados pelas figuras de um
+    poluente e avalia tudo com um único dask.compute, de modo que cada arquivo
+    .nc seja lido uma só vez.
+
+    Retorna um dicionário com:
+    - datetimes: DatetimeIndex do TFLAG
+    - lay_map: soma no tempo por camada (LAY, ROW, COL)
+    - map: soma no tempo e nas camadas (ROW, COL)
+    - domain_series: série do domínio em cada instante (TSTEP)
+    - years, yearly_maps, yearly_totals: mapas e totais anuais
+    - region_lay: soma por macro-região e camada (region, LAY)
+    - region_annual_mean: pd.Series com a média anual por macro-região
+
+    `region_index` (get_region_index) evita recalcular a máscara regional.
+    As funções de plotagem aceitam esse dicionário em `products` e apenas
+    consomem os resultados.
+    """
+    datetimes = get_ioapi_datetimes(ds)
+
+    if "LAY" not in da.dims:
+        da = da.expand_dims("LAY")
+
+    # --- grafo preguiçoso
+    lay_map = da.sum(dim="TSTEP")
+    domain_series = da.sum(dim=[d for d in da.dims if d != "TSTEP"])
+    yearly_maps, unique_years = yearly_grouped_sum(da, datetimes)
+
+    # --- avaliação única
+    lay_map, domain_series, yearly_maps = dask.compute(
+        lay_map, domain_series, yearly_maps
+    )
+
+    # --- derivados em memória
+    if region_index is None:
+        region_index = get_region_index(xlon, ylat, brazil, ds=ds)
+
+    return finish_emission_products(
+        datetimes, lay_map, domain_series, yearly_maps, unique_years, region_index
+    )
+
+
+def finish_emission_products(datetimes, lay_map, domain_series, yearly_maps, unique_years,
+                             region_index):
+    """
+    Completa o dicionário de produtos a partir dos agregados já avaliados
+    (soma por camada, série do domínio e mapas anuais): agregados regionais
+    e totais. Compartilhado por compute_emission_products e pelo modo
+    streaming (functions_stream), para que os dois caminhos coincidam.
+    """
+    region_lay = aggregate_by_region(lay_map, region_index)
+    region_year = aggregate_by_region(yearly_maps, region_index)
+
+    annual_df = pd.DataFrame(
+        region_year.transpose("year", "region").values.astype(float),
+        index=unique_years,
+        columns=region_year["region"].values
+    )
+    region_annual_mean = annual_df.mean(axis=0, skipna=True).fillna(0.0)
+
+    return {
+        "datetimes": datetimes,
+        "lay_map": lay_map,
+        "map": lay_map.sum(dim="LAY"),
+        "domain_series": domain_series,
+        "years": unique_years,
+        "yearly_maps": yearly_maps,
+        "yearly_totals": yearly_maps.sum(dim=["ROW", "COL"]).values.astype(float),
+        "region_lay": region_lay,
+        "region_annual_mean": region_annual_mean,
+    }
 
 #%% ── função: mosaico espacial pixelado ──────────────────────────────────────
 
-def plot_spatial_mosaic(da, pol_name, unit, xlon, ylat, brazil, dims_time, figpath):
+# camadas do mosaico padrão (numeração 1-based, como nos títulos)
+DEFAULT_MOSAIC_LAYERS = (1, 2, 3, 4, 39, 40)
+
+
+def compute_layer_map(da, dims_time=("TSTEP",)):
     """
-    Plota:
-    Camada 1, 2, 3, 4, 39, 40
+    Campo integrado no tempo por camada (LAY, ROW, COL), em uma única
+    passada. Base do mosaico por camadas e do perfil regional por camada.
     """
-    l1 = da.isel(LAY=0).sum(dim=dims_time).compute()
-    l2 = da.isel(LAY=1).sum(dim=dims_time).compute()
-    l3 = da.isel(LAY=2).sum(dim=dims_time).compute()
-    l4 = da.isel(LAY=3).sum(dim=dims_time).compute()
-    l39 = da.isel(LAY=38).sum(dim=dims_time).compute()
-    l40 = da.isel(LAY=39).sum(dim=dims_time).compute()
-    #lall = da.sum(dim="LAY").sum(dim=dims_time).compute()
+    if "LAY" not in da.dims:
+        da = da.expand_dims("LAY")
+    return da.sum(dim=list(dims_time)).compute()
 
-    maps = [l1, l2, l3, l4, l39, l40]
+
+def select_layer_panels(lay_map, layers=None, layer_bins=None):
+    """
+    Seleciona, do campo (LAY, ROW, COL) já em memória, os painéis do mosaico.
+
+    - layers: camadas individuais, numeração 1-based (padrão:
+      DEFAULT_MOSAIC_LAYERS; camadas inexistentes são ignoradas com aviso)
+    - layer_bins: faixas de altura como pares (primeira, última) 1-based,
+      inclusivas; cada faixa vira um painel com a soma das camadas
+
+    Retorna lista de (título, mapa 2D).
+    """
+    nlay = lay_map.sizes["LAY"]
+    panels = []
+
+    if layer_bins is not None:
+        for first, last in layer_bins:
+            if not 1 <= first <= last <= nlay:
+                raise ValueError(f"Faixa de camadas inválida: {first}-{last} (LAY = {nlay}).")
+            title = f"Camada {first}" if first == last else f"Camadas {first}–{last}"
+            panels.append((title, lay_map.isel(LAY=slice(first - 1, last)).sum(dim="LAY")))
+        return panels
+
+    if layers is None:
+        layers = DEFAULT_MOSAIC_LAYERS
+
+    missing = [k for k in layers if not 1 <= k <= nlay]
+    if missing:
+        print(f"Aviso: camadas inexistentes ignoradas (LAY = {nlay}): {missing}")
+
+    for k in layers:
+        if 1 <= k <= nlay:
+            panels.append((f"Camada {k}", lay_map.isel(LAY=k - 1)))
+
+    return panels
+
+
+def plot_spatial_mosaic(da, pol_name, unit, xlon, ylat, brazil, dims_time, figpath, products=None,
+                        layers=None, layer_bins=None, lay_map=None, ncols=3, panel_size=4,
+                        filename=None):
+    """
+    Mosaico de mapas por camada (padrão: camadas 1, 2, 3, 4, 39, 40).
+
+    O campo (LAY, ROW, COL) é calculado uma única vez (ou reaproveitado de
+    `products` / `lay_map`) e os painéis são apenas selecionados dele, para
+    qualquer conjunto de camadas (`layers`) ou faixas de altura
+    (`layer_bins`); ver select_layer_panels.
+    """
+    if lay_map is None:
+        if products is not None:
+            lay_map = products["lay_map"]
+        else:
+            lay_map = compute_layer_map(da, dims_time)
+
+    panels = select_layer_panels(lay_map, layers=layers, layer_bins=layer_bins)
+
+    if not panels:
+        print(f"Nenhuma camada selecionada para o mosaico de {pol_name}.")
+        return
+
+    titles = [title for title, _ in panels]
+    maps = [data for _, data in panels]
 
     eps = 1e-12
     positive_mins = []
@@ -179,36 +895,31 @@ def plot_spatial_mosaic(da, pol_name, unit, xlon, ylat, brazil, dims_time, figpa
 
     vmin = max(min(positive_mins), eps) if positive_mins else eps
     vmax = max(float(m.max()) for m in maps)
+    if not np.isfinite(vmax) or vmax <= vmin:
+        vmax = vmin * 10
 
     cmap = plt.colormaps["Spectral_r"].copy()
     norm = colors.LogNorm(vmin=vmin, vmax=vmax)
 
-    fig = plt.figure(figsize=(12, 8))
+    ncols = min(ncols, len(maps))
+    nrows = int(np.ceil(len(maps) / ncols))
+
+    fig = plt.figure(figsize=(panel_size * ncols, panel_size * nrows))
     gs = gridspec.GridSpec(
-        nrows=2,
-        ncols=3,
+        nrows=nrows,
+        ncols=ncols,
         figure=fig,
         wspace=-0.2,
         hspace=0.15
     )
 
-    axes = [
-        fig.add_subplot(gs[0, 0]),
-        fig.add_subplot(gs[0, 1]),
-        fig.add_subplot(gs[0, 2]),
-        fig.add_subplot(gs[1, 0]),
-        fig.add_subplot(gs[1, 1]),
-        fig.add_subplot(gs[1, 2]),
-    ]
-
-    titles = ["Camada 1", "Camada 2", "Camada 3", "Camada 4", "Camada 39", "Camada 40"]
+    axes = [fig.add_subplot(gs[i // ncols, i % ncols]) for i in range(len(maps))]
 
     for ax, data, title in zip(axes, maps, titles):
-        m = ax.pcolormesh(
-            xlon, ylat, data,
+        m = plot_grid_field(
+            ax, xlon, ylat, data,
             cmap=cmap,
-            norm=norm,
-            shading="auto"
+            norm=norm
         )
         
         add_brazil_inverse_mask(ax=ax, brazil=brazil, xlon=xlon, ylat=ylat, pad=1.0)
@@ -244,40 +955,52 @@ def plot_spatial_mosaic(da, pol_name, unit, xlon, ylat, brazil, dims_time, figpa
         fontsize=16,
         fontweight="bold"
     )
-    
-    plt.savefig(os.path.join(figpath,f'mosaico_emissoes_{pol_name}.png'),dpi=300)
-    plt.show()
-    
-    
-#%% ── função: cálculo regional por camada ────────────────────────────────────
 
-def calculate_by_region_lay(da, xlon, ylat, brazil):
-    import regionmask
+    if filename is None:
+        filename = f'mosaico_emissoes_{pol_name}.png'
 
-    brazil_reg = brazil.dissolve(by="NM_REGIA", as_index=False)
+    finish_figure(fig, os.path.join(figpath, filename))
 
-    da_lay_map = da.sum(dim="TSTEP").compute()
 
-    labels = brazil_reg["NM_REGIA"].astype(str).values
-
-    regions = regionmask.Regions(
-        outlines=list(brazil_reg.geometry),
-        names=list(labels),
-        abbrevs=list(labels),
+def plot_layer_sheet(pol_name, unit, xlon, ylat, brazil, figpath, products=None, lay_map=None,
+                     da=None, ncols=8):
+    """
+    Folha com todas as camadas (small multiples), montada a partir do mesmo
+    campo (LAY, ROW, COL) do mosaico, sem reprocessar os arquivos.
+    """
+    if lay_map is None:
+        lay_map = products["lay_map"] if products is not None else compute_layer_map(da)
+
+    plot_spatial_mosaic(
+        da=da,
+        pol_name=pol_name,
+        unit=unit,
+        xlon=xlon,
+        ylat=ylat,
+        brazil=brazil,
+        dims_time=["TSTEP"],
+        figpath=figpath,
+        lay_map=lay_map,
+        layers=range(1, lay_map.sizes["LAY"] + 1),
+        ncols=ncols,
+        panel_size=2.5,
+        filename=f"camadas_emissoes_{pol_name}.png"
     )
+    
+    
+#%% ── função: cálculo regional por camada ────────────────────────────────────
 
-    mask = regions.mask(
-        xr.DataArray(xlon, dims=("ROW", "COL")),
-        xr.DataArray(ylat, dims=("ROW", "COL")),
-    ).rename("region_id")
+def calculate_by_region_lay(da, xlon, ylat, brazil, products=None, region_index=None, lay_map=None):
+    if products is not None:
+        return products["region_lay"]
 
-    gb = da_lay_map.groupby(mask)
+    if region_index is None:
+        region_index = get_region_index(xlon, ylat, brazil)
 
-    by_region_lay = (
-        gb.sum(dim="stacked_ROW_COL")
-          .rename({"region_id": "region"})
-          .assign_coords(region=("region", regions.names))
-    )
+    # reaproveita o campo (LAY, ROW, COL) do mosaico, se já calculado
+    da_lay_map = lay_map if lay_map is not None else da.sum(dim="TSTEP")
+
+    by_region_lay = aggregate_by_region(da_lay_map, region_index).compute()
 
     return by_region_lay
 
@@ -403,38 +1126,115 @@ def plot_regional_vertical_profile(by_region_lay, pol_name, unit, brazil, figpat
     ax.spines["left"].set_position(("outward", 45))
     ax_left.tick_params(axis="y", colors="crimson")
 
-    plt.savefig(os.path.join(figpath,f'emissoes_por_camada_{pol_name}.png'),dpi=300)
-    plt.show()
+    finish_figure(fig, os.path.join(figpath,f'emissoes_por_camada_{pol_name}.png'))
     
  #%% ── helpers temporais IOAPI/CMAQ ───────────────────────────────────────────
 
-def get_ioapi_datetimes(ds):
+def decode_ioapi_tflag(tflag):
     """
-    Converte TFLAG do padrão IOAPI/CMAQ (<YYYYDDD, HHMMSS>) em DatetimeIndex.
-    Usa apenas VAR=0, pois o TFLAG costuma repetir o mesmo tempo para todas as variáveis.
+    Converte, de forma vetorizada, um array TFLAG (..., 2) no padrão IOAPI/CMAQ
+    <YYYYDDD, HHMMSS> em datetime64[ns].
+    """
+    tflag = np.asarray(tflag).astype(np.int64)
+
+    yyyyddd = tflag[..., 0]
+    hhmmss = tflag[..., 1]
+
+    year = yyyyddd // 1000
+    doy = yyyyddd % 1000
+    seconds = (hhmmss // 10000) * 3600 + (hhmmss // 100 % 100) * 60 + hhmmss % 100
+
+    base = (year - 1970).astype("datetime64[Y]").astype("datetime64[D]")
+    dt = base + (doy - 1).astype("timedelta64[D]") + seconds.astype("timedelta64[s]")
+
+    return dt.astype("datetime64[ns]")
+
+
+def _ioapi_tstep_seconds(hhmmss):
+    hhmmss = int(hhmmss)
+    return (hhmmss // 10000) * 3600 + (hhmmss // 100 % 100) * 60 + hhmmss % 100
+
+
+def _unique_step_mask(datetimes):
+    """
+    Máscara dos passos a manter em uma série de instantes já ordenada: de
+    cada instante repetido fica só a primeira ocorrência.
+    """
+    keep = np.ones(len(datetimes), dtype=bool)
+    if len(datetimes) > 1:
+        keep[1:] = np.diff(datetimes) != np.timedelta64(0, "s")
+    return keep
+
+
+def attach_ioapi_time(ds):
+    """
+    Decodifica o TFLAG uma única vez e o anexa ao dataset como coordenada
+    datetime64 de TSTEP. Use sempre o dataset retornado.
+
+    Valida o passo de tempo:
+    - instantes fora de ordem geram ValueError;
+    - instantes repetidos (sobreposição entre arquivos, ex.: arquivos diários
+      de 25 passos) são descartados, mantendo a primeira ocorrência; nesse
+      caso o retorno é um novo dataset (o ds original não é alterado);
+    - intervalos diferentes do atributo TSTEP (HHMMSS) são apenas avisados,
+      pois costumam indicar arquivos faltando na pasta.
     """
     if "TFLAG" not in ds:
         raise ValueError("O dataset não possui a variável 'TFLAG'.")
 
-    tflag = ds["TFLAG"].isel(VAR=0).compute().values  # shape: (TSTEP, 2)
+    tflag = ds["TFLAG"]
+    if "VAR" in tflag.dims:
+        tflag = tflag.isel(VAR=0)
+
+    datetimes = decode_ioapi_tflag(tflag.values)  # shape: (TSTEP,)
+
+    steps = np.diff(datetimes).astype("timedelta64[s]").astype(np.int64)
 
-    dates = tflag[:, 0].astype(int)   # YYYYDDD
-    times = tflag[:, 1].astype(int)   # HHMMSS
+    if np.any(steps < 0):
+        raise ValueError("TFLAG com instantes fora de ordem.")
 
-    datetimes = []
-    for yyyyddd, hhmmss in zip(dates, times):
-        yyyyddd = f"{yyyyddd:07d}"
-        hhmmss = f"{hhmmss:06d}"
+    expected = _ioapi_tstep_seconds(ds.attrs.get("TSTEP", 0))
+    if expected > 0:
+        n_gaps = int(np.count_nonzero((steps != expected) & (steps != 0)))
+        if n_gaps:
+            print(f"Aviso: {n_gaps} intervalo(s) do TFLAG diferente(s) do TSTEP "
+                  f"de {expected} s. Verifique se há arquivos faltando.")
 
-        base_date = pd.to_datetime(yyyyddd, format="%Y%j")
-        hour = int(hhmmss[0:2])
-        minute = int(hhmmss[2:4])
-        second = int(hhmmss[4:6])
+    # arquivos diários de 25 passos repetem a hora 00 do dia seguinte
+    keep = _unique_step_mask(datetimes)
+    n_repeated = int(np.count_nonzero(~keep))
+    if n_repeated:
+        print(f"Aviso: {n_repeated} instante(s) repetido(s) no TFLAG "
+              f"(arquivos que se sobrepõem no tempo) descartado(s).")
+        close = ds.close
+        ds = ds.isel(TSTEP=np.flatnonzero(keep))
+        ds.set_close(close)
+        datetimes = datetimes[keep]
 
-        dt = base_date + pd.Timedelta(hours=hour, minutes=minute, seconds=second)
-        datetimes.append(dt)
+    ds.coords["TSTEP"] = ("TSTEP", datetimes)
+    return ds
 
-    return pd.DatetimeIndex(datetimes)
+
+def get_ioapi_datetimes(ds):
+    """
+    Converte TFLAG do padrão IOAPI/CMAQ (<YYYYDDD, HHMMSS>) em DatetimeIndex.
+    Usa apenas VAR=0, pois o TFLAG costuma repetir o mesmo tempo para todas as variáveis.
+
+    O resultado fica memorizado no próprio dataset como coordenada TSTEP
+    (ver attach_ioapi_time), então chamadas seguintes não decodificam de novo.
+    Se o TFLAG tiver instantes repetidos, o dataset precisa passar antes por
+    attach_ioapi_time (que os descarta); caso contrário gera ValueError.
+    """
+    if "TSTEP" in ds.coords and np.issubdtype(ds["TSTEP"].dtype, np.datetime64):
+        return pd.DatetimeIndex(ds["TSTEP"].values)
+
+    attached = attach_ioapi_time(ds)
+    if attached is not ds:
+        raise ValueError(
+            "TFLAG com instantes repetidos: use o dataset retornado por "
+            "attach_ioapi_time antes de get_ioapi_datetimes."
+        )
+    return pd.DatetimeIndex(ds["TSTEP"].values)
 
 
 def build_domain_time_series(da):
@@ -477,7 +1277,8 @@ def summarize_temporal_patterns(ts, datetimes):
     return hour_stats, weekday_stats, month_stats
 
 
-def _plot_time_band(ax, stats_df, x_values, x_labels, title, color="crimson", show_legend=False):
+def _plot_time_band(ax, stats_df, x_values, x_labels, title, color="crimson", show_legend=False,
+                    band_label="Intervalo min–max"):
     """
     Plota linha da média com faixa sombreada entre mínimo e máximo.
     """
@@ -507,7 +1308,7 @@ def _plot_time_band(ax, stats_df, x_values, x_labels, title, color="crimson", sh
     if show_legend:
         handles = [
             Line2D([0], [0], color=color, lw=2.5, marker="o", markersize=4, label="Média"),
-            Patch(facecolor=color, alpha=0.18, edgecolor="none", label="Intervalo min–max"),
+            Patch(facecolor=color, alpha=0.18, edgecolor="none", label=band_label),
         ]
         ax.legend(
             handles=handles,
@@ -517,9 +1318,500 @@ def _plot_time_band(ax, stats_df, x_values, x_labels, title, color="crimson", sh
             ncol=2
         )
         
+#%% ── perfis temporais por célula (out-of-core) ─────────────────────────────
+
+# categorias dos perfis: (nome da dimensão, função sobre o DatetimeIndex, valores)
+TEMPORAL_PROFILE_KINDS = {
+    "hour": (lambda dt: dt.hour, np.arange(24)),
+    "weekday": (lambda dt: dt.dayofweek, np.arange(7)),
+    "month": (lambda dt: dt.month, np.arange(1, 13)),
+}
+
+
+def _tstep_blocks(da, block_steps=None):
+    """
+    Fatias de TSTEP percorridas pelo motor de perfis: os chunks dask de TSTEP
+    (ou blocos de `block_steps` passos, se informado).
+    """
+    nt = da.sizes["TSTEP"]
+
+    if block_steps is None and da.chunks is not None:
+        sizes = da.chunks[da.get_axis_num("TSTEP")]
+    else:
+        step = block_steps or nt
+        sizes = [min(step, nt - i) for i in range(0, nt, step)]
+
+    start = 0
+    for size in sizes:
+        yield slice(start, start + size)
+        start += size
+
+
+def compute_temporal_profile_cubes(da, datetimes=None, block_steps=None, verbose=True,
+                                   region_index=None):
+    """
+    Perfis temporais por célula (hora do dia, dia da semana e mês do ano)
+    sem carregar o array inteiro: percorre TSTEP bloco a bloco e mantém
+    acumuladores de contagem, soma, mínimo e máximo por (categoria, ROW, COL).
+
+    O poluente é somado nas camadas antes (emissão da coluna em cada célula).
+    NaN são ignorados, como no .sum() do xarray.
+
+    Com `region_index`, cada bloco também é agregado por macro-região
+    (aggregate_by_region) e o mínimo/máximo exato do total de cada região e
+    do domínio em cada categoria é guardado (alguns floats por região).
+
+    Retorna um xr.Dataset com, para cada tipo (hour, weekday, month):
+    - {tipo}_nsteps (categoria): passos de tempo na categoria
+    - {tipo}_count / _sum / _min / _max (categoria, ROW, COL)
+    - {tipo}_domain_min / _max (categoria): total do domínio
+    - {tipo}_region_min / _max (categoria, region): total de cada região
+      (estes dois pares apenas com `region_index`)
+    """
+    if "TSTEP" not in da.dims:
+        raise ValueError("O DataArray não possui a dimensão 'TSTEP'.")
+
+    if "LAY" in da.dims:
+        da = da.sum(dim="LAY")
+    da = da.transpose("TSTEP", "ROW", "COL")
+
+    if datetimes is None:
+        datetimes = pd.DatetimeIndex(da["TSTEP"].values)
+    datetimes = pd.DatetimeIndex(datetimes)
+
+    if len(datetimes) != da.sizes["TSTEP"]:
+        raise ValueError("O tamanho da série temporal e do vetor de datas não coincide.")
+
+    nrow, ncol = da.sizes["ROW"], da.sizes["COL"]
+
+    # totais por área: coluna 0 = domínio, demais = macro-regiões
+    n_areas = 1 + (len(region_index["names"]) if region_index is not None else 0)
+
+    acc = {}
+    for kind, (get_cat, cats) in TEMPORAL_PROFILE_KINDS.items():
+        ncat = len(cats)
+        acc[kind] = {
+            "codes": np.asarray(get_cat(datetimes)) - cats[0],
+            "nsteps": np.zeros(ncat, dtype=np.int64),
+            "count": np.zeros((ncat, nrow, ncol), dtype=np.int32),
+            "sum": np.zeros((ncat, nrow, ncol), dtype=np.float64),
+            "min": np.full((ncat, nrow, ncol), np.inf),
+            "max": np.full((ncat, nrow, ncol), -np.inf),
+            "total_min": np.full((ncat, n_areas), np.inf),
+            "total_max": np.full((ncat, n_areas), -np.inf),
+        }
+
+    blocks = list(_tstep_blocks(da, block_steps))
+
+    for i, sl in enumerate(blocks):
+        block = np.asarray(da.isel(TSTEP=sl).values, dtype=np.float64)
+        valid = np.isfinite(block)
+
+        # total de cada passo no domínio e nas regiões (NaN contam como zero)
+        flat = np.where(valid, block, 0.0).reshape(block.shape[0], nrow * ncol)
+        totals = flat.sum(axis=1)[:, None]
+        if region_index is not None:
+            by_region = np.asarray(region_index["matrix"].T @ flat.T).T
+            totals = np.hstack([totals, by_region])
+
+        for kind, a in acc.items():
+            codes = a["codes"][sl]
+            for c in np.unique(codes):
+                sel = codes == c
+                values = block[sel]
+                ok = valid[sel]
+
+                a["nsteps"][c] += int(sel.sum())
+                a["count"][c] += ok.sum(axis=0, dtype=np.int32)
+                a["sum"][c] += np.where(ok, values, 0.0).sum(axis=0)
+                a["min"][c] = np.minimum(a["min"][c], np.where(ok, values, np.inf).min(axis=0))
+                a["max"][c] = np.maximum(a["max"][c], np.where(ok, values, -np.inf).max(axis=0))
+                a["total_min"][c] = np.minimum(a["total_min"][c], totals[sel].min(axis=0))
+                a["total_max"][c] = np.maximum(a["total_max"][c], totals[sel].max(axis=0))
+
+        if verbose:
+            print(f"Perfis temporais: bloco {i + 1}/{len(blocks)}", end="\r")
+
+    if verbose:
+        print()
+
+    data_vars = {}
+    for kind, a in acc.items():
+        empty = a["count"] == 0
+        a["min"][empty] = np.nan
+        a["max"][empty] = np.nan
+
+        dims = (kind, "ROW", "COL")
+        data_vars[f"{kind}_nsteps"] = ((kind,), a["nsteps"])
+        data_vars[f"{kind}_count"] = (dims, a["count"])
+        data_vars[f"{kind}_sum"] = (dims, a["sum"])
+        data_vars[f"{kind}_min"] = (dims, a["min"])
+        data_vars[f"{kind}_max"] = (dims, a["max"])
+
+        no_steps = a["nsteps"] == 0
+        a["total_min"][no_steps] = np.nan
+        a["total_max"][no_steps] = np.nan
+        data_vars[f"{kind}_domain_min"] = ((kind,), a["total_min"][:, 0])
+        data_vars[f"{kind}_domain_max"] = ((kind,), a["total_max"][:, 0])
+        if region_index is not None:
+            data_vars[f"{kind}_region_min"] = ((kind, "region"), a["total_min"][:, 1:])
+            data_vars[f"{kind}_region_max"] = ((kind, "region"), a["total_max"][:, 1:])
+
+    coords = {kind: cats for kind, (_, cats) in TEMPORAL_PROFILE_KINDS.items()}
+    if region_index is not None:
+        coords["region"] = list(region_index["names"])
+
+    return xr.Dataset(
+        data_vars,
+        coords=coords,
+        attrs={
+            "start": str(datetimes.min()),
+            "end": str(datetimes.max()),
+            "n_tsteps": len(datetimes),
+        },
+    )
+
+
+def temporal_profile_mean(cubes, kind):
+    """
+    Média por célula e categoria (categoria, ROW, COL) a partir dos cubos.
+    """
+    count = cubes[f"{kind}_count"]
+    return (cubes[f"{kind}_sum"] / count.where(count > 0)).rename(f"{kind}_mean")
+
+
+def temporal_cubes_have_exact_range(cubes, region=None):
+    """
+    True se os cubos guardam o mínimo/máximo exato do total do domínio
+    (region=None) ou da macro-região `region`.
+    """
+    kinds = list(TEMPORAL_PROFILE_KINDS)
+    if region is None:
+        return all(f"{kind}_domain_min" in cubes for kind in kinds)
+    return (
+        all(f"{kind}_region_min" in cubes for kind in kinds)
+        and region in cubes["region"].values.tolist()
+    )
+
+
+def summarize_temporal_cubes(cubes, region_index=None, region=None):
+    """
+    Converte os cubos por célula nas tabelas de summarize_temporal_patterns
+    (colunas mean/min/max por categoria), prontas para _plot_time_band.
+
+    Agrega o domínio inteiro ou, com `region_index` e `region`, apenas as
+    células daquela macro-região. A média do total agregado é exata
+    (soma das células / passos da categoria). O mínimo e o máximo também são
+    exatos quando os cubos têm os totais por área ({tipo}_domain_min,
+    {tipo}_region_min...); senão são a envoltória (soma dos mínimos e dos
+    máximos das células), mais larga que o intervalo min–max real
+    (ver temporal_cubes_have_exact_range).
+
+    Retorna (hour_stats, weekday_stats, month_stats).
+    """
+    nrow, ncol = cubes.sizes["ROW"], cubes.sizes["COL"]
+
+    if region is None:
+        weights = np.ones(nrow * ncol)
+    else:
+        if region_index is None:
+            raise ValueError("Informe region_index para agregar uma macro-região.")
+        names = list(region_index["names"])
+        if region not in names:
+            raise ValueError(f"Macro-região não encontrada: {region}")
+        weights = region_index["matrix"][:, names.index(region)].toarray().ravel()
+
+    tables = []
+    for kind in TEMPORAL_PROFILE_KINDS:
+        def _reduce(var):
+            values = np.nan_to_num(cubes[f"{kind}_{var}"].values.reshape(-1, nrow * ncol))
+            return values @ weights
+
+        if temporal_cubes_have_exact_range(cubes, region):
+            if region is None:
+                low, high = cubes[f"{kind}_domain_min"], cubes[f"{kind}_domain_max"]
+            else:
+                low = cubes[f"{kind}_region_min"].sel(region=region)
+                high = cubes[f"{kind}_region_max"].sel(region=region)
+            low, high = low.values.astype(float), high.values.astype(float)
+        else:
+            low, high = _reduce("min"), _reduce("max")
+
+        nsteps = cubes[f"{kind}_nsteps"].values.astype(float)
+        stats = pd.DataFrame(
+            {
+                "mean": _reduce("sum") / np.where(nsteps > 0, nsteps, np.nan),
+                "min": low,
+                "max": high,
+            },
+            index=cubes[kind].values,
+        )
+        stats.loc[nsteps == 0] = np.nan
+        tables.append(stats)
+
+    return tuple(tables)
+
+
+def plot_region_temporal_bands(cubes, region_index, pol_name, unit, figpath, source_name=None):
+    """
+    Faixas hora/dia da semana/mês (média e intervalo min–max) por
+    macro-região, a partir dos cubos de perfis temporais por célula.
+    Uma linha por macro-região + uma para o domínio. Cubos sem os totais por
+    área (compute_temporal_profile_cubes sem region_index) mostram a
+    envoltória das células, identificada como tal na legenda.
+    """
+    regions = [None] + list(region_index["names"])
+
+    weekday_labels = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom"]
+    month_labels = ["Jan", "Fev", "Mar", "Abr", "Mai", "Jun",
+                    "Jul", "Ago", "Set", "Out", "Nov", "Dez"]
+
+    fig, axes = plt.subplots(
+        nrows=len(regions), ncols=3,
+        figsize=(14, 2.6 * len(regions)),
+        squeeze=False,
+        constrained_layout=True
+    )
+
+    for row, region in enumerate(regions):
+        hour_stats, weekday_stats, month_stats = summarize_temporal_cubes(
+            cubes, region_index=region_index, region=region
+        )
+        label = "Domínio" if region is None else region
+        band_label = (
+            "Intervalo min–max" if temporal_cubes_have_exact_range(cubes, region)
+            else "Envoltória min–max (soma das células)"
+        )
+
+        _plot_time_band(
+            axes[row, 0], hour_stats, np.arange(24),
+            [str(h) if h % 3 == 0 else "" for h in range(24)],
+            f"{label} - hora do dia", show_legend=(row == 0), band_label=band_label
+        )
+        _plot_time_band(
+            axes[row, 1], weekday_stats, np.arange(7), weekday_labels,
+            f"{label} - dia da semana"
+        )
+        _plot_time_band(
+            axes[row, 2], month_stats, np.arange(1, 13), month_labels,
+            f"{label} - mês do ano"
+        )
+        axes[row, 0].set_ylabel(unit)
+
+    title = f"Perfis temporais por macro-região - {pol_name}"
+    if source_name:
+        title += f" ({source_name})"
+    fig.suptitle(title, fontsize=16, fontweight="bold")
+
+    finish_figure(
+        fig,
+        os.path.join(figpath, f"perfis_temporais_regioes_{pol_name}.png"),
+        bbox_inches="tight"
+    )
+
+
+#%% ── cubos de injeção região x camada x hora/mês ───────────────────────────
+
+# categorias dos cubos de injeção (subconjunto de TEMPORAL_PROFILE_KINDS)
+INJECTION_PROFILE_KINDS = ("hour", "month")
+
+
+def compute_region_injection_cubes(da, region_index, datetimes=None, kinds=INJECTION_PROFILE_KINDS):
+    """
+    Cubos de injeção vertical por macro-região, em uma única passada pelos
+    arquivos: (region, LAY, hour) e (region, LAY, month).
+
+    Cada passo de tempo é agregado por macro-região com o índice esparso
+    (get_region_index, já em cache) e os totais por categoria saem de um
+    produto com matrizes indicadoras (TSTEP x categoria), como em
+    yearly_grouped_sum; todos os cubos são avaliados com um único
+    dask.compute.
+
+    Retorna um xr.Dataset com, para cada tipo:
+    - {tipo}_sum (region, LAY, categoria): emissão total
+    - {tipo}_pct (region, LAY, categoria): % de cada camada no total da
+      coluna daquela região/categoria (soma 100 em LAY)
+    - {tipo}_nsteps (categoria): passos de tempo na categoria
+    """
+    if "TSTEP" not in da.dims:
+        raise ValueError("O DataArray não possui a dimensão 'TSTEP'.")
+
+    unknown = [k for k in kinds if k not in TEMPORAL_PROFILE_KINDS]
+    if unknown:
+        raise ValueError(f"Tipos de perfil desconhecidos: {unknown}")
+
+    if "LAY" not in da.dims:
+        da = da.expand_dims("LAY")
+
+    if datetimes is None:
+        datetimes = pd.DatetimeIndex(da["TSTEP"].values)
+    datetimes = pd.DatetimeIndex(datetimes)
+
+    if len(datetimes) != da.sizes["TSTEP"]:
+        raise ValueError("O tamanho da série temporal e do vetor de datas não coincide.")
+
+    by_region = aggregate_by_region(da, region_index)  # (TSTEP, LAY, region)
+
+    lazy = {}
+    nsteps = {}
+    for kind in kinds:
+        get_cat, cats = TEMPORAL_PROFILE_KINDS[kind]
+        codes = np.asarray(get_cat(datetimes))
+
+        onehot = xr.DataArray(
+            (codes[:, None] == cats[None, :]).astype(by_region.dtype),
+            dims=("TSTEP", kind),
+            coords={kind: cats}
+        )
+        if by_region.chunks is not None:
+            onehot = onehot.chunk({"TSTEP": by_region.chunksizes["TSTEP"], kind: -1})
+
+        lazy[kind] = xr.dot(by_region, onehot, dims="TSTEP").transpose("region", "LAY", kind)
+        nsteps[kind] = (codes[:, None] == cats[None, :]).sum(axis=0)
+
+    (computed,) = dask.compute(lazy)
+
+    data_vars = {}
+    for kind, cube in computed.items():
+        column = cube.sum(dim="LAY")
+        data_vars[f"{kind}_sum"] = cube
+        data_vars[f"{kind}_pct"] = 100 * cube / column.where(column > 0)
+        data_vars[f"{kind}_nsteps"] = ((kind,), nsteps[kind])
+
+    cubes = xr.Dataset(data_vars)
+    cubes.attrs.update(
+        start=str(datetimes.min()),
+        end=str(datetimes.max()),
+        n_tsteps=len(datetimes),
+    )
+    return cubes
+
+
+def injection_mean_layer(cubes, kind):
+    """
+    Camada média de injeção (1-based, ponderada pela emissão) por região e
+    categoria: resumo de uma linha do perfil vertical.
+    """
+    cube = cubes[f"{kind}_sum"]
+    lay = xr.DataArray(np.arange(1, cube.sizes["LAY"] + 1), dims="LAY")
+    column = cube.sum(dim="LAY")
+    return ((cube * lay).sum(dim="LAY") / column.where(column > 0)).rename("mean_layer")
+
+
+def plot_region_injection_profile(cubes, pol_name, figpath, kind="hour", source_name=None,
+                                  max_layer=None):
+    """
+    Perfil de injeção por macro-região ao longo do dia (kind="hour") ou do
+    ano (kind="month"): um mapa de calor camada x categoria com a % de cada
+    camada na coluna, por região, e um painel com a camada média de
+    injeção de cada região.
+
+    `max_layer` (1-based) limita as camadas mostradas; por padrão, até a
+    última camada com emissão.
+    """
+    if f"{kind}_pct" not in cubes:
+        raise ValueError(f"Os cubos não possuem o tipo '{kind}'.")
+
+    pct = cubes[f"{kind}_pct"]
+    region_names = pct["region"].values.tolist()
+    cats = pct[kind].values
+
+    if max_layer is None:
+        layer_total = cubes[f"{kind}_sum"].sum(dim=["region", kind]).values
+        nonzero = np.flatnonzero(layer_total > 0)
+        max_layer = int(nonzero[-1]) + 1 if nonzero.size else pct.sizes["LAY"]
+    max_layer = max(1, min(int(max_layer), pct.sizes["LAY"]))
+
+    lay = np.arange(1, max_layer + 1)
+    mean_layer = injection_mean_layer(cubes, kind)
+
+    if kind == "hour":
+        x_labels = [str(h) if h % 3 == 0 else "" for h in cats]
+        x_title = "Hora do dia"
+    elif kind == "month":
+        x_labels = ["Jan", "Fev", "Mar", "Abr", "Mai", "Jun",
+                    "Jul", "Ago", "Set", "Out", "Nov", "Dez"]
+        x_title = "Mês do ano"
+    else:
+        x_labels = [str(c) for c in cats]
+        x_title = kind
+
+    palette = plt.cm.Set2(np.linspace(0, 1, len(region_names)))
+    color_map = dict(zip(region_names, palette))
+
+    npanels = len(region_names) + 1
+    ncols = min(3, npanels)
+    nrows = int(np.ceil(npanels / ncols))
+
+    fig, axes = plt.subplots(
+        nrows=nrows, ncols=ncols,
+        figsize=(4.6 * ncols, 3.8 * nrows),
+        squeeze=False,
+        constrained_layout=True
+    )
+    axes = axes.ravel()
+
+    cmap = plt.get_cmap("YlOrRd").copy()
+    cmap.set_bad("gainsboro")
+    # escala comum entre regiões, até a maior % nas camadas mostradas
+    vmax = float(pct.isel(LAY=slice(0, max_layer)).max(skipna=True))
+    norm = colors.Normalize(vmin=0, vmax=vmax if np.isfinite(vmax) and vmax > 0 else 100)
+    mesh = None
+
+    for ax, reg in zip(axes, region_names):
+        values = pct.sel(region=reg).isel(LAY=slice(0, max_layer)).values
+        mesh = ax.pcolormesh(
+            np.arange(len(cats)), lay, np.ma.masked_invalid(values),
+            cmap=cmap, norm=norm, shading="nearest"
+        )
+        ax.plot(
+            np.arange(len(cats)), mean_layer.sel(region=reg).values,
+            color="black", linewidth=1.5, linestyle="--"
+        )
+        ax.set_title(reg, fontsize=11, fontweight="bold", color=color_map[reg])
+        ax.set_xticks(np.arange(len(cats)))
+        ax.set_xticklabels(x_labels, fontsize=8)
+        ax.set_ylabel("Camada da atmosfera")
+        ax.set_ylim(0.5, max_layer + 0.5)
+
+    ax_line = axes[len(region_names)]
+    ax_line.set_facecolor("gainsboro")
+    for reg in region_names:
+        ax_line.plot(
+            np.arange(len(cats)), mean_layer.sel(region=reg).values,
+            color=color_map[reg], linewidth=2, marker="o", markersize=3, label=reg
+        )
+    ax_line.set_title("Camada média de injeção", fontsize=11, fontweight="bold")
+    ax_line.set_xticks(np.arange(len(cats)))
+    ax_line.set_xticklabels(x_labels, fontsize=8)
+    ax_line.set_xlabel(x_title)
+    ax_line.set_ylabel("Camada (ponderada pela emissão)")
+    ax_line.grid(True, linestyle="--", alpha=0.4)
+    ax_line.legend(fontsize=8, frameon=False)
+
+    for ax in axes[npanels:]:
+        ax.set_visible(False)
+
+    if mesh is not None:
+        cbar = fig.colorbar(mesh, ax=axes[:len(region_names)].tolist(), shrink=0.8, pad=0.02)
+        cbar.set_label("% da emissão da coluna")
+
+    title = f"Injeção vertical por macro-região - {pol_name}"
+    if source_name:
+        title += f" ({source_name})"
+    fig.suptitle(title, fontsize=16, fontweight="bold")
+
+    finish_figure(
+        fig,
+        os.path.join(figpath, f"injecao_vertical_{kind}_{pol_name}.png"),
+        bbox_inches="tight"
+    )
+
+
 #%% ── função: mosaico temporal ───────────────────────────────────────────────
 
-def plot_temporal_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil, figpath, source_name=None):
+def plot_temporal_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil, figpath, source_name=None,
+                         products=None):
     """
     Painel com:
     - mapa acumulado no tempo e nas camadas
@@ -529,8 +1821,11 @@ def plot_temporal_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil, figpath, so
     """
 
     # --- 1) mapa acumulado total (tempo + camadas)
-    map_dims = [d for d in da.dims if d in ["TSTEP", "LAY"]]
-    da_map = da.sum(dim=map_dims).compute()
+    if products is not None:
+        da_map = products["map"]
+    else:
+        map_dims = [d for d in da.dims if d in ["TSTEP", "LAY"]]
+        da_map = da.sum(dim=map_dims).compute()
 
     positive = da_map.where(da_map > 0)
     try:
@@ -548,8 +1843,12 @@ def plot_temporal_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil, figpath, so
     norm = colors.LogNorm(vmin=vmin, vmax=vmax)
 
     # --- 2) série temporal do domínio
-    datetimes = get_ioapi_datetimes(ds)
-    ts = build_domain_time_series(da)
+    if products is not None:
+        datetimes = products["datetimes"]
+        ts = products["domain_series"]
+    else:
+        datetimes = get_ioapi_datetimes(ds)
+        ts = build_domain_time_series(da)
 
     hour_stats, weekday_stats, month_stats = summarize_temporal_patterns(ts, datetimes)
 
@@ -577,11 +1876,10 @@ def plot_temporal_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil, figpath, so
     ax_m   = fig.add_subplot(gs[2, 1])
 
     # mapa
-    m = ax_map.pcolormesh(
-        xlon, ylat, da_map,
+    m = plot_grid_field(
+        ax_map, xlon, ylat, da_map,
         cmap=cmap,
-        norm=norm,
-        shading="auto"
+        norm=norm
     )
     
     add_brazil_inverse_mask(ax=ax_map, brazil=brazil, xlon=xlon, ylat=ylat, pad=1.0)
@@ -660,16 +1958,16 @@ def plot_temporal_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil, figpath, so
     
     ax_map.set_anchor("C")
     
-    plt.savefig(
+    finish_figure(
+        fig,
         os.path.join(figpath, f"temporal_emissoes_{pol_name}.png"),
-        dpi=300,
         bbox_inches="tight"
     )
-    plt.show()   
     
 #%% ── função: mosaico espacial anual + série histórica ──────────────────────
 
-def plot_annual_spatial_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil, figpath, source_name=None):
+def plot_annual_spatial_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil, figpath, source_name=None,
+                               products=None):
     """
     Figura com:
     - mosaico espacial por ano (3 colunas fixas)
@@ -677,32 +1975,24 @@ def plot_annual_spatial_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil, figpa
     - série histórica anual na última linha, ocupando toda a largura
     """
 
-    # --- tempo -> anos
-    datetimes = get_ioapi_datetimes(ds)
-    years = np.array(datetimes.year)
-    unique_years = np.sort(np.unique(years))
-
-    if unique_years.size == 0:
-        raise ValueError("Nenhum ano encontrado no TFLAG.")
-
     # --- mapas por ano
-    yearly_maps = []
-    yearly_totals = []
-    
-    for year in unique_years:
-        idx = np.where(years == year)[0]
+    if products is not None:
+        unique_years = products["years"]
+        yearly_maps = [
+            (year, products["yearly_maps"].sel(year=year)) for year in unique_years
+        ]
+        yearly_totals = list(products["yearly_totals"])
 
-        da_year = da.isel(TSTEP=idx)
+    else:
+        # --- pilha (ano, ROW, COL) em uma única passada; totais derivados dela
+        stack, unique_years = yearly_grouped_sum(da, get_ioapi_datetimes(ds))
+        stack = stack.compute()
 
-        # mapa espacial do ano: soma no tempo do ano + soma nas camadas
-        dims_map = [d for d in da_year.dims if d in ["TSTEP", "LAY"]]
-        da_map = da_year.sum(dim=dims_map).compute()
-        yearly_maps.append((year, da_map))
+        yearly_maps = [(year, stack.sel(year=year)) for year in unique_years]
+        yearly_totals = list(stack.sum(dim=["ROW", "COL"]).values.astype(float))
 
-        # total anual do domínio: soma tempo + camadas + espaço
-        dims_total = [d for d in da_year.dims if d in ["TSTEP", "LAY", "ROW", "COL"]]
-        total_val = float(da_year.sum(dim=dims_total).compute())
-        yearly_totals.append(total_val)
+    if unique_years.size == 0:
+        raise ValueError("Nenhum ano encontrado no TFLAG.")
 
     # --- escala comum para todos os mapas
     eps = 1e-12
@@ -758,11 +2048,10 @@ def plot_annual_spatial_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil, figpa
 
     mappable = None
     for ax, (year, da_map) in zip(map_axes, yearly_maps):
-        mappable = ax.pcolormesh(
-            xlon, ylat, da_map,
+        mappable = plot_grid_field(
+            ax, xlon, ylat, da_map,
             cmap=cmap,
-            norm=norm,
-            shading="auto"
+            norm=norm
         )
         
         add_brazil_inverse_mask(ax=ax, brazil=brazil, xlon=xlon, ylat=ylat, pad=1.0)
@@ -851,41 +2140,31 @@ def plot_annual_spatial_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil, figpa
         y=0.98
     )
 
-    plt.savefig(
+    finish_figure(
+        fig,
         os.path.join(figpath, f"mosaico_anual_emissoes_{pol_name}.png"),
-        dpi=300,
         bbox_inches="tight"
     )
-    plt.show()
     
-def plot_regional_total_map(da, pol_name, unit, xlon, ylat, brazil, figpath):
+def plot_regional_total_map(da, pol_name, unit, xlon, ylat, brazil, figpath, products=None,
+                            region_index=None):
     """
     Plota apenas o mapa das macro-regiões com a porcentagem das emissões totais.
     Indicado para inventários com uma única camada (LAY = 1).
     """
-    import regionmask
-
-    # soma no tempo e na(s) camada(s), preservando o espaço
-    dims_sum = [d for d in da.dims if d in ["TSTEP", "LAY"]]
-    da_map = da.sum(dim=dims_sum).compute()
-
     brazil_reg = brazil.dissolve(by="NM_REGIA", as_index=False)
     labels = brazil_reg["NM_REGIA"].astype(str).values
 
-    regions = regionmask.Regions(
-        outlines=list(brazil_reg.geometry),
-        names=list(labels),
-        abbrevs=list(labels),
-    )
-
-    mask = regions.mask(
-        xr.DataArray(xlon, dims=("ROW", "COL")),
-        xr.DataArray(ylat, dims=("ROW", "COL")),
-    ).rename("region_id")
+    if products is not None:
+        by_region = products["region_lay"].sum(dim="LAY")
+    else:
+        # soma no tempo e na(s) camada(s), preservando o espaço
+        dims_sum = [d for d in da.dims if d in ["TSTEP", "LAY"]]
+        da_map = da.sum(dim=dims_sum).compute()
 
-    gb = da_map.groupby(mask)
-    by_region = gb.sum(dim="stacked_ROW_COL").rename({"region_id": "region"})
-    by_region = by_region.assign_coords(region=("region", regions.names))
+        if region_index is None:
+            region_index = get_region_index(xlon, ylat, brazil)
+        by_region = aggregate_by_region(da_map, region_index)
 
     region_vals = by_region.values.astype(float)
     total = region_vals.sum()
@@ -931,12 +2210,11 @@ def plot_regional_total_map(da, pol_name, unit, xlon, ylat, brazil, figpath):
             fontsize=10, weight="bold"
         )
 
-    plt.savefig(
+    finish_figure(
+        fig,
         os.path.join(figpath, f"mapa_regional_total_{pol_name}.png"),
-        dpi=300,
         bbox_inches="tight"
     )
-    plt.show()
   
 def plot_source_comparison_mosaic(source_maps, pol_name, unit, brazil, figpath, source_labels=None):
     """
@@ -1009,11 +2287,10 @@ def plot_source_comparison_mosaic(source_maps, pol_name, unit, brazil, figpath,
         ylat = source_maps[src]["ylat"]
         label_name = source_labels.get(src, src)
 
-        mappable = ax.pcolormesh(
-            xlon, ylat, da_map,
+        mappable = plot_grid_field(
+            ax, xlon, ylat, da_map,
             cmap=cmap,
-            norm=norm,
-            shading="auto"
+            norm=norm
         )
 
         add_brazil_inverse_mask(ax=ax, brazil=brazil, xlon=xlon, ylat=ylat, pad=1.0)
@@ -1055,12 +2332,11 @@ def plot_source_comparison_mosaic(source_maps, pol_name, unit, brazil, figpath,
         y=0.98
     )
 
-    plt.savefig(
+    finish_figure(
+        fig,
         os.path.join(figpath, f"comparacao_fontes_{pol_name}.png"),
-        dpi=300,
         bbox_inches="tight"
     )
-    plt.show()
 
 def plot_source_comparison_timeseries(source_series, pol_name, unit, figpath, source_labels=None):
     """
@@ -1109,69 +2385,40 @@ def plot_source_comparison_timeseries(source_series, pol_name, unit, figpath, so
 
     ax.set_yscale("log")
 
-    plt.savefig(
+    finish_figure(
+        fig,
         os.path.join(figpath, f"comparacao_temporal_fontes_{pol_name}.png"),
-        dpi=300,
         bbox_inches="tight"
     )
-    plt.show()
 
-def calculate_region_annual_mean(da, ds, xlon, ylat, brazil):
+def calculate_region_annual_mean(da, ds, xlon, ylat, brazil, products=None, region_index=None):
     """
     Calcula, para um poluente e uma fonte, a emissão média anual por macro-região.
 
     Etapas:
-    - separa por ano usando TFLAG
-    - soma no tempo dentro de cada ano
-    - soma nas camadas
+    - soma por ano (TFLAG) e nas camadas, em uma única passada
+      (yearly_grouped_sum)
     - agrega espacialmente por macro-região
     - calcula a média entre os anos disponíveis
     """
-    import regionmask
-
-    datetimes = get_ioapi_datetimes(ds)
-    years = np.array(datetimes.year)
-    unique_years = np.sort(np.unique(years))
-
-    if "NM_REGIA" not in brazil.columns:
-        raise ValueError("O shapefile precisa ter a coluna 'NM_REGIA'.")
-
-    brazil_reg = brazil.dissolve(by="NM_REGIA", as_index=False)
-    labels = brazil_reg["NM_REGIA"].astype(str).values
-
-    regions = regionmask.Regions(
-        outlines=list(brazil_reg.geometry),
-        names=list(labels),
-        abbrevs=list(labels),
-    )
-
-    mask = regions.mask(
-        xr.DataArray(xlon, dims=("ROW", "COL")),
-        xr.DataArray(ylat, dims=("ROW", "COL")),
-    ).rename("region_id")
+    if products is not None:
+        return products["region_annual_mean"]
 
-    annual_series = []
+    if region_index is None:
+        region_index = get_region_index(xlon, ylat, brazil, ds=ds)
 
-    for year in unique_years:
-        idx = np.where(years == year)[0]
-        da_year = da.isel(TSTEP=idx).sum(dim="TSTEP")
+    # pilha anual em uma passada e agregação regional sobre ela
+    stack, unique_years = yearly_grouped_sum(da, get_ioapi_datetimes(ds))
+    region_year = aggregate_by_region(stack, region_index).compute()
 
-        if "LAY" in da_year.dims:
-            da_year = da_year.sum(dim="LAY")
-
-        by_region = (
-            da_year.groupby(mask)
-            .sum(dim="stacked_ROW_COL")
-            .rename({"region_id": "region"})
-            .assign_coords(region=("region", regions.names))
-        )
-
-        s = pd.Series(
-            by_region.values.astype(float),
-            index=by_region["region"].values,
+    annual_series = [
+        pd.Series(
+            region_year.sel(year=year).values.astype(float),
+            index=region_year["region"].values,
             name=year
         )
-        annual_series.append(s)
+        for year in unique_years
+    ]
 
     if not annual_series:
         return pd.Series(dtype=float)
@@ -1289,9 +2536,8 @@ def plot_region_source_stacked_bars(region_source_means, pol_name, unit, figpath
         loc="lower right"
     )
 
-    plt.savefig(
+    finish_figure(
+        fig,
         os.path.join(figpath, f"barras_regionais_fontes_{pol_name}.png"),
-        dpi=300,
         bbox_inches="tight"
-    )
-    plt.show()
\ No newline at end of file
+    )
\ No newline at end of file
@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+"""
+Avaliação modelo x observação das saídas de qualidade do CMAQ.
+
+Fluxo:
+- observações de estações em CSV (formato longo: estação, data/hora,
+  poluente, valor) e tabela de estações (estação, lon, lat);
+- cada estação é associada a uma célula da grade pelo localizador de
+  functions_points, e as séries do modelo de todas as estações e poluentes
+  saem de uma única leitura vetorizada;
+- o tempo do modelo vem do TFLAG (YYYYMMDDHH, UTC) e o das observações é
+  convertido para UTC;
+- os pares são formados em três períodos: horário, média diária e métrica
+  diária regulatória (QUALITY_RULES), com critério de completude diária;
+- as estatísticas (MB, NMB, NME, RMSE, r, IOA, FAC2) são calculadas com
+  groupby sobre a tabela de pares, por estação e para todas as estações
+  juntas, sem laços por estação.
+
+Os critérios de desempenho do diagrama "soccer" seguem Emery et al. (2017):
+O3 (MDA8/horário) NMB ±5/±15 % e NME 15/25 %; MP2,5 NMB ±10/±30 % e
+NME 35/50 % (meta/critério).
+"""
+
+import glob
+import os
+
+import dask
+import matplotlib.patches as mpatches
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from functions_conama import conama_unit_factor
+from functions_points import build_grid_locator, extract_points
+from functions_quality import (
+    MDA8_MIN_HOURS,
+    MDA8_WINDOW,
+    QUALITY_RULES,
+    _rolling_mean_cumsum,
+    daily_mda8,
+)
+from functions_render import finish_figure
+
+
+#%% ── configuração ──────────────────────────────────────────────────────────
+
+EVALUATION_PERIODS = ("hourly", "daily_mean", "daily_metric")
+
+EVALUATION_PERIOD_LABELS = {
+    "hourly": "Horário",
+    "daily_mean": "Média diária",
+    "daily_metric": "Métrica diária regulatória",
+}
+
+# mínimo de horas válidas (pares) para um dia entrar nas médias/máximas
+DAILY_MIN_HOURS = 18
+
+# mínimo de médias móveis de 8 h válidas (de 24) para um dia entrar no MDA8;
+# cada janela vale com MDA8_MIN_HOURS de 8 horas válidas, como no próprio MDA8
+DAILY_MIN_MDA8_WINDOWS = 18
+
+# metas e critérios (NMB absoluto, NME) em %, Emery et al. (2017)
+EMERY_2017_BENCHMARKS = {
+    "O3": {"goal": (5, 15), "criteria": (15, 25)},
+    "PM25": {"goal": (10, 35), "criteria": (30, 50)},
+}
+
+EVALUATION_STATS = ["n", "obs_mean", "mod_mean", "MB", "NMB", "NME", "RMSE", "r", "IOA", "FAC2"]
+
+
+#%% ── leitura das observações ───────────────────────────────────────────────
+
+def load_observations(obs_path, station_col="station", time_col="datetime",
+                      pollutant_col="pollutant", value_col="value", utc_offset_hours=0,
+                      time_format=None):
+    """
+    Lê todos os CSV de observações de uma pasta (ou um arquivo) no formato
+    longo e retorna DataFrame com station, datetime (UTC), pollutant, value.
+
+    `utc_offset_hours` é o fuso das observações (ex.: -3 para horário de
+    Brasília); o horário é convertido para UTC, como o TFLAG do CMAQ.
+    """
+    if os.path.isdir(obs_path):
+        files = sorted(glob.glob(os.path.join(obs_path, "*.csv")))
+    else:
+        files = [obs_path]
+
+    if not files:
+        raise FileNotFoundError(f"Nenhum CSV de observações encontrado em: {obs_path}")
+
+    frames = []
+    for file in files:
+        df = pd.read_csv(file, sep=None, engine="python")
+        missing = [c for c in [station_col, time_col, pollutant_col, value_col] if c not in df.columns]
+        if missing:
+            raise ValueError(f"Colunas ausentes em {file}: {missing}")
+        frames.append(df[[station_col, time_col, pollutant_col, value_col]])
+
+    obs = pd.concat(frames, ignore_index=True)
+    obs.columns = ["station", "datetime", "pollutant", "value"]
+
+    obs["station"] = obs["station"].astype(str)
+    obs["pollutant"] = obs["pollutant"].astype(str)
+    obs["value"] = pd.to_numeric(obs["value"], errors="coerce")
+    obs["datetime"] = (
+        pd.to_datetime(obs["datetime"], format=time_format)
+        - pd.Timedelta(hours=utc_offset_hours)
+    )
+
+    # duplicatas (mesmo instante em arquivos diferentes) viram a média
+    obs = obs.dropna(subset=["value"])
+    return obs.groupby(["station", "pollutant", "datetime"], as_index=False)["value"].mean()
+
+
+def load_stations(stations_file, station_col="station", lon_col="lon", lat_col="lat"):
+    """
+    Tabela de estações indexada pelo código, com colunas lon e lat.
+    """
+    df = pd.read_csv(stations_file, sep=None, engine="python")
+    missing = [c for c in [station_col, lon_col, lat_col] if c not in df.columns]
+    if missing:
+        raise ValueError(f"Colunas ausentes em {stations_file}: {missing}")
+
+    stations = df[[station_col, lon_col, lat_col]].copy()
+    stations.columns = ["station", "lon", "lat"]
+    stations["station"] = stations["station"].astype(str)
+    return stations.drop_duplicates("station").set_index("station")
+
+
+#%% ── pareamento modelo x observação ────────────────────────────────────────
+
+def extract_station_series(ds, pollutants, stations, datetimes, method="nearest", locator=None):
+    """
+    Séries do modelo (camada superficial, µg/m³) em todas as estações, para
+    todos os poluentes, em um único dask.compute.
+
+    Retorna ({poluente: DataFrame (datetime x estação)}, estações dentro
+    da grade).
+    """
+    if locator is None:
+        locator = build_grid_locator(ds["LON"].values, ds["LAT"].values)
+
+    lazy = {}
+    for pol in pollutants:
+        da = ds[pol]
+        if "LAY" in da.dims:
+            da = da.isel(LAY=0)
+        factor = conama_unit_factor(pol, da.attrs.get("units", "ug/m3"))
+        lazy[pol] = extract_points(
+            da, locator, stations["lon"].values, stations["lat"].values,
+            names=stations.index.values, method=method
+        ) * factor
+
+    (computed,) = dask.compute(lazy)
+
+    inside = None
+    model = {}
+    for pol, out in computed.items():
+        if inside is None:
+            inside = out["point"].values[out["inside"].values]
+        model[pol] = pd.DataFrame(
+            np.asarray(out.transpose("TSTEP", "point").values, dtype=float),
+            index=pd.DatetimeIndex(datetimes),
+            columns=out["point"].values,
+        )
+
+    outside = sorted(set(stations.index) - set(inside if inside is not None else []))
+    if outside:
+        print(f"Aviso: {len(outside)} estação(ões) fora da grade ignorada(s): {outside[:10]}")
+
+    return model, list(inside if inside is not None else [])
+
+
+def _daily_with_completeness(wide, how):
+    """
+    Média ou máxima diária de um quadro (tempo x estação), exigindo
+    DAILY_MIN_HOURS valores no dia.
+    """
+    grouped = wide.resample("D")
+    daily = grouped.mean() if how == "mean" else grouped.max()
+    return daily.where(grouped.count() >= DAILY_MIN_HOURS)
+
+
+def _period_pairs(obs_wide, mod_wide, pol_name, period):
+    """
+    Quadros (tempo x estação) observado e modelado no período pedido, com
+    os mesmos buracos nos dois.
+    """
+    valid = obs_wide.notna() & mod_wide.notna()
+    obs_wide = obs_wide.where(valid)
+    mod_wide = mod_wide.where(valid)
+
+    if period == "hourly":
+        return obs_wide, mod_wide
+
+    rule = QUALITY_RULES.get(pol_name, {}).get("daily_rule", "daily_mean")
+    if period == "daily_mean":
+        rule = "daily_mean"
+
+    if rule == "daily_mean":
+        return _daily_with_completeness(obs_wide, "mean"), _daily_with_completeness(mod_wide, "mean")
+
+    if rule == "daily_max_hour":
+        return _daily_with_completeness(obs_wide, "max"), _daily_with_completeness(mod_wide, "max")
+
+    if rule == "daily_mda8":
+        # grade horária completa, para a janela de 8 h não pular buracos
+        full = pd.date_range(obs_wide.index[0].floor("D"), obs_wide.index[-1], freq="h")
+        obs_full = obs_wide.reindex(full)
+        mod_full = mod_wide.reindex(full)
+        obs_d, days = daily_mda8(obs_full.values, full)
+        mod_d, _ = daily_mda8(mod_full.values, full)
+
+        # completude: janelas de 8 h válidas (>= MDA8_MIN_HOURS horas) por dia,
+        # rotuladas na última hora como no MDA8; os buracos são os mesmos nos
+        # dois lados
+        windows = np.isfinite(
+            _rolling_mean_cumsum(obs_full.values.T, MDA8_WINDOW, MDA8_MIN_HOURS)
+        ).T
+        n_windows = (
+            pd.DataFrame(windows, index=full, columns=obs_wide.columns)
+            .resample("D").sum()
+            .reindex(days, fill_value=0)
+        )
+        complete = n_windows.values >= DAILY_MIN_MDA8_WINDOWS
+
+        return (pd.DataFrame(np.where(complete, obs_d, np.nan), index=days, columns=obs_wide.columns),
+                pd.DataFrame(np.where(complete, mod_d, np.nan), index=days, columns=mod_wide.columns))
+
+    raise ValueError(f"Regra desconhecida: {rule}")
+
+
+def pair_observations(obs, model, periods=EVALUATION_PERIODS):
+    """
+    Tabela longa de pares (pollutant, period, station, time, obs, mod).
+
+    `model` é a saída de extract_station_series. Só entram instantes e
+    estações presentes nos dois lados; o trabalho é vetorizado por poluente
+    (quadros tempo x estação), sem laços por estação.
+    """
+    pairs = []
+    for pol, mod_wide in model.items():
+        obs_pol = obs[obs["pollutant"] == pol]
+        if obs_pol.empty:
+            print(f"Aviso: sem observações de {pol}.")
+            continue
+
+        obs_wide = obs_pol.pivot(index="datetime", columns="station", values="value")
+        stations = [s for s in mod_wide.columns if s in obs_wide.columns]
+        if not stations:
+            print(f"Aviso: nenhuma estação de {pol} dentro da grade.")
+            continue
+
+        # eixo do modelo (TFLAG decodificado); observações fora dele caem
+        obs_wide = obs_wide.reindex(index=mod_wide.index, columns=stations)
+        mod_wide = mod_wide[stations]
+
+        for period in periods:
+            o, m = _period_pairs(obs_wide, mod_wide, pol, period)
+            stacked = pd.DataFrame({
+                "obs": o.stack(future_stack=True),
+                "mod": m.stack(future_stack=True),
+            }).dropna()
+            if stacked.empty:
+                print(f"Aviso: nenhum par de {pol} no período {period} "
+                      f"(dados insuficientes pelos critérios de completude).")
+                continue
+            stacked.index.names = ["time", "station"]
+            stacked = stacked.reset_index()
+            stacked.insert(0, "period", period)
+            stacked.insert(0, "pollutant", pol)
+            pairs.append(stacked)
+
+    if not pairs:
+        raise ValueError("Nenhum par modelo x observação foi formado.")
+
+    return pd.concat(pairs, ignore_index=True)
+
+
+#%% ── estatísticas ──────────────────────────────────────────────────────────
+
+def _stats_from_groups(pairs, keys):
+    """
+    Estatísticas pareadas por grupo a partir de somas (groupby vetorizado).
+    """
+    df = pairs[keys + ["obs", "mod"]].copy()
+    df["diff"] = df["mod"] - df["obs"]
+    df["abs_diff"] = df["diff"].abs()
+    df["sq_diff"] = df["diff"] ** 2
+    df["oo"] = df["obs"] ** 2
+    df["mm"] = df["mod"] ** 2
+    df["om"] = df["obs"] * df["mod"]
+    # FAC2 só sobre pares com observação positiva
+    ratio = df["mod"] / df["obs"].where(df["obs"] > 0)
+    df["fac2"] = ((ratio >= 0.5) & (ratio <= 2)).astype(float).where(ratio.notna())
+
+    # média observada do grupo, para o IOA
+    obs_mean = df.groupby(keys)["obs"].transform("mean")
+    df["ioa_den"] = ((df["mod"] - obs_mean).abs() + (df["obs"] - obs_mean).abs()) ** 2
+
+    g = df.groupby(keys)
+    s = g[["obs", "mod", "diff", "abs_diff", "sq_diff", "oo", "mm", "om", "ioa_den"]].sum()
+    n = g.size()
+
+    stats = pd.DataFrame(index=s.index)
+    stats["n"] = n
+    stats["obs_mean"] = s["obs"] / n
+    stats["mod_mean"] = s["mod"] / n
+    stats["MB"] = s["diff"] / n
+    stats["NMB"] = 100 * s["diff"] / s["obs"]
+    stats["NME"] = 100 * s["abs_diff"] / s["obs"]
+    stats["RMSE"] = np.sqrt(s["sq_diff"] / n)
+
+    cov = s["om"] - s["obs"] * s["mod"] / n
+    var_o = s["oo"] - s["obs"] ** 2 / n
+    var_m = s["mm"] - s["mod"] ** 2 / n
+    stats["r"] = cov / np.sqrt((var_o * var_m).where((var_o > 0) & (var_m > 0)))
+
+    stats["IOA"] = 1 - s["sq_diff"] / s["ioa_den"].where(s["ioa_den"] > 0)
+    stats["FAC2"] = g["fac2"].mean()
+    return stats[EVALUATION_STATS]
+
+
+def compute_evaluation_stats(pairs, min_pairs=10):
+    """
+    MB, NMB, NME, RMSE, r, IOA e FAC2 por poluente x período x estação e
+    para todas as estações juntas (station = "Todas").
+
+    Grupos com menos de `min_pairs` pares ficam de fora; um aviso é mostrado
+    quando isso elimina um poluente x período inteiro.
+    """
+    by_station = _stats_from_groups(pairs, ["pollutant", "period", "station"])
+
+    overall = _stats_from_groups(pairs, ["pollutant", "period"])
+    for (pol, period), n in overall["n"].items():
+        if n < min_pairs:
+            print(f"Aviso: {pol} no período {period} fica fora das estatísticas "
+                  f"({n} par(es), mínimo {min_pairs}).")
+    overall["station"] = "Todas"
+    overall = overall.set_index("station", append=True)
+
+    stats = pd.concat([by_station, overall]).sort_index()
+    return stats[stats["n"] >= min_pairs]
+
+
+def summarize_evaluation(stats):
+    """
+    Tabela resumo (todas as estações): uma linha por poluente x período,
+    com a mediana das estatísticas por estação ao lado.
+    """
+    overall = stats.xs("Todas", level="station")
+    per_station = stats.drop("Todas", level="station")
+
+    median = per_station.groupby(level=["pollutant", "period"])[["NMB", "NME", "r", "IOA", "FAC2"]].median()
+    median.columns = [f"{c} (mediana est.)" for c in median.columns]
+    n_stations = per_station.groupby(level=["pollutant", "period"]).size().rename("estações")
+
+    return overall.join(n_stations).join(median)
+
+
+#%% ── figuras ───────────────────────────────────────────────────────────────
+
+def plot_soccer(stats, pol_name, period, figpath):
+    """
+    Diagrama "soccer" (NMB x NME) das estações de um poluente e período,
+    com as metas e critérios de Emery et al. (2017) quando definidos.
+    """
+    try:
+        sel = stats.xs((pol_name, period), level=["pollutant", "period"])
+    except KeyError:
+        raise ValueError(f"Sem estatísticas para {pol_name} / {period}.")
+
+    per_station = sel.drop("Todas", errors="ignore")
+    overall = sel.loc["Todas"] if "Todas" in sel.index else None
+
+    bench = EMERY_2017_BENCHMARKS.get(pol_name)
+
+    lim_x = np.nanmax(np.abs(per_station["NMB"].values)) if len(per_station) else 0
+    lim_y = np.nanmax(per_station["NME"].values) if len(per_station) else 0
+    if bench is not None:
+        lim_x = max(lim_x, bench["criteria"][0])
+        lim_y = max(lim_y, bench["criteria"][1])
+    lim_x = 1.15 * (lim_x if np.isfinite(lim_x) and lim_x > 0 else 10)
+    lim_y = 1.15 * (lim_y if np.isfinite(lim_y) and lim_y > 0 else 10)
+
+    fig, ax = plt.subplots(figsize=(7.5, 6.5))
+
+    handles = []
+    if bench is not None:
+        for level, color, label in [("criteria", "#fddbc7", "Critério"), ("goal", "#d1e5f0", "Meta")]:
+            nmb, nme = bench[level]
+            ax.add_patch(mpatches.Rectangle((-nmb, 0), 2 * nmb, nme, facecolor=color,
+                                            edgecolor="gray", linewidth=0.8, zorder=1))
+            handles.append(mpatches.Patch(facecolor=color, edgecolor="gray",
+                                          label=f"{label} (|NMB| ≤ {nmb}%, NME ≤ {nme}%)"))
+
+    sc = ax.scatter(per_station["NMB"], per_station["NME"], c=per_station["r"], cmap="viridis",
+                    vmin=0, vmax=1, s=40, edgecolor="black", linewidth=0.4, zorder=3)
+    if overall is not None:
+        ax.scatter([overall["NMB"]], [overall["NME"]], marker="*", s=260, color="crimson",
+                   edgecolor="black", linewidth=0.6, zorder=4)
+        handles.append(plt.Line2D([], [], marker="*", color="crimson", linestyle="",
+                                  markersize=14, label="Todas as estações"))
+
+    ax.axvline(0, color="black", linewidth=0.8, zorder=2)
+    ax.set_xlim(-lim_x, lim_x)
+    ax.set_ylim(0, lim_y)
+    ax.set_xlabel("NMB (%)")
+    ax.set_ylabel("NME (%)")
+    ax.grid(True, linestyle="--", alpha=0.35)
+    for spine in ["top", "right"]:
+        ax.spines[spine].set_visible(False)
+
+    cbar = fig.colorbar(sc, ax=ax, fraction=0.05, pad=0.03)
+    cbar.set_label("r")
+
+    if handles:
+        ax.legend(handles=handles, loc="upper left", frameon=False, fontsize=9)
+
+    ax.set_title(
+        f"{pol_name} - {EVALUATION_PERIOD_LABELS.get(period, period)}\n"
+        f"{len(per_station)} estação(ões)",
+        fontsize=13,
+        fontweight="bold"
+    )
+
+    finish_figure(
+        fig,
+        os.path.join(figpath, f"soccer_{pol_name}_{period}.png"),
+        bbox_inches="tight"
+    )
+
+
+def plot_evaluation_table(summary, figpath, name="evaluation_summary"):
+    """
+    Tabela resumo (summarize_evaluation) renderizada como figura.
+    """
+    table = summary[["n", "obs_mean", "mod_mean", "MB", "NMB", "NME", "RMSE", "r", "IOA", "FAC2"]].copy()
+    table.index = [f"{pol} - {EVALUATION_PERIOD_LABELS.get(per, per)}" for pol, per in table.index]
+
+    cells = [
+        [f"{int(v)}" if col == "n" else f"{v:.2f}" for col, v in row.items()]
+        for _, row in table.iterrows()
+    ]
+
+    fig, ax = plt.subplots(figsize=(13, 0.45 * len(table) + 1.2))
+    ax.axis("off")
+
+    tab = ax.table(cellText=cells, rowLabels=list(table.index), colLabels=list(table.columns),
+                   loc="center", cellLoc="center")
+    tab.auto_set_font_size(False)
+    tab.set_fontsize(9)
+    tab.scale(1, 1.3)
+
+    ax.set_title("Avaliação modelo x observação - todas as estações", fontsize=13, fontweight="bold")
+
+    finish_figure(fig, os.path.join(figpath, f"{name}.png"), bbox_inches="tight")
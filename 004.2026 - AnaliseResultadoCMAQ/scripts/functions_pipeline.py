@@ -0,0 +1,562 @@
+# -*- coding: utf-8 -*-
+"""
+Execução das análises de emissão por fonte, em série ou em paralelo.
+
+process_emission_source contém todo o processamento de uma fonte (leitura,
+agregados, figuras) e devolve apenas os produtos usados na comparação entre
+fontes. run_emission_sources distribui as fontes em um pool de processos,
+com limite de memória e de threads dask por worker, e junta os resultados;
+a falha de uma fonte não derruba as demais.
+"""
+
+import glob
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import dask
+import psutil
+
+from functions_emissions import (
+    open_emission_dataset,
+    ioapiCoords,
+    eqmerc2latlon,
+    squeeze_var_dim,
+    attach_ioapi_time,
+    build_pollutant,
+    get_region_index,
+    compute_emission_products,
+    plot_spatial_mosaic,
+    plot_layer_sheet,
+    calculate_by_region_lay,
+    plot_regional_vertical_profile,
+    plot_temporal_mosaic,
+    plot_annual_spatial_mosaic,
+    plot_regional_total_map,
+    calculate_region_annual_mean,
+    plot_region_temporal_bands,
+    plot_region_injection_profile,
+)
+from functions_render import render_figure_jobs, set_headless
+from functions_stream import stream_emission_products
+from functions_store import (
+    update_emission_store,
+    load_emission_products,
+    update_temporal_profile_cubes,
+    update_region_injection_cubes,
+    write_comparison_product,
+)
+
+
+#%% ── processamento de uma fonte ────────────────────────────────────────────
+
+def process_emission_source(source_name, repo_path, brazil, config):
+    """
+    Processa uma fonte de emissão: gera as figuras da fonte e retorna, por
+    poluente, os produtos da comparação entre fontes:
+
+        {pol: {"map", "xlon", "ylat", "time", "values", "region_mean"}}
+
+    `config` é um dicionário com: pollutants, pollutant_specs,
+    pollutant_units, required_species, rotated_sources, figures_base_path,
+    cache_base_path, store_base_path e use_store; opcionalmente
+    render_workers (processos para as figuras), force_render,
+    temporal_cubes (perfis temporais por célula, gravados no store_base_path),
+    streaming / stream_workers (agregados arquivo a arquivo, ver
+    functions_stream, quando não vêm do cubo em disco),
+    mosaic_layers / mosaic_layer_bins (painéis do mosaico por camada),
+    layer_sheet (folha com todas as camadas) e injection_cubes (cubos
+    região x camada x hora/mês e figuras de injeção vertical).
+
+    Com comparison_store_path em `config`, os produtos são gravados no
+    armazenamento de comparação (write_comparison_product) e o retorno é
+    apenas {pol: caminho do arquivo gravado}.
+
+    Retorna None se a pasta não existir ou não tiver dados utilizáveis.
+    """
+    pollutants = config["pollutants"]
+    pollutant_specs = config["pollutant_specs"]
+
+    print(f"\n{'#' * 50}")
+    print(f"Processando fonte de emissão: {source_name}")
+    print(f"{'#' * 50}")
+
+    if not os.path.isdir(repo_path):
+        print(f"Pasta não encontrada. Pulando: {repo_path}")
+        return None
+
+    file_pattern = os.path.join(repo_path, "*.nc")
+    files = sorted(glob.glob(file_pattern))
+
+    if not files:
+        print(f"Nenhum arquivo .nc encontrado em: {repo_path}")
+        return None
+
+    print(f"Arquivos encontrados: {len(files)}")
+
+    # lê apenas as espécies usadas pelos poluentes (+ TFLAG), com chunks planejados.
+    # Também no modo streaming: as figuras, os cubos e calculate_region_annual_mean
+    # continuam usando o DataArray lazy de cada poluente
+    ds = open_emission_dataset(
+        files,
+        required_vars=config["required_species"],
+        target_chunk_mb=128
+    )
+
+    try:
+        print("Dataset carregado com sucesso.")
+
+        # TFLAG decodificado uma única vez e anexado como coordenada TSTEP
+        ds = attach_ioapi_time(ds)
+
+        # coordenadas do grid
+        xv, yv, lon, lat = ioapiCoords(ds)
+        xlon, ylat = eqmerc2latlon(ds, xv, yv)
+
+        # correção global de orientação para fontes invertidas
+        if source_name in config["rotated_sources"]:
+            xlon = xlon[::-1, :]
+            ylat = ylat[::-1, :]
+
+        # índice célula → macro-região (reaproveitado do disco se o grid já foi visto)
+        region_index = get_region_index(
+            xlon, ylat, brazil, ds=ds, cache_dir=config["cache_base_path"]
+        )
+
+        # atualiza o cubo pré-agregado apenas nos meses com arquivos novos/alterados
+        if config["use_store"]:
+            update_emission_store(
+                store_path=config["store_base_path"],
+                source_name=source_name,
+                files=files,
+                pollutants=pollutants,
+                pollutant_specs=pollutant_specs,
+                region_index=region_index
+            )
+
+        # pasta de saída específica da fonte
+        figpath = os.path.join(config["figures_base_path"], source_name)
+        os.makedirs(figpath, exist_ok=True)
+
+        ### ── dimensões padrão ──────────────────────────────────────────────
+
+        candidate_vars = [v for v in ds.data_vars if v != "TFLAG"]
+
+        if not candidate_vars:
+            print("Nenhuma variável de emissão encontrada além de TFLAG. Pulando esta fonte.")
+            return None
+
+        ref_var = "CO" if "CO" in candidate_vars else candidate_vars[0]
+        ref_da = squeeze_var_dim(ds[ref_var])
+
+        dims_time = [d for d in ["TSTEP"] if d in ref_da.dims]
+
+        if not dims_time:
+            print("A dimensão TSTEP não foi encontrada no dataset. Pulando esta fonte.")
+            return None
+
+        ### ── loop por poluente ─────────────────────────────────────────────
+
+        # poluentes já montados nesta fonte (ex.: MP25 reaproveitado no MP10)
+        pollutant_cache = {}
+
+        # agregados do modo streaming: uma passada nos arquivos para todos os
+        # poluentes, feita só quando o primeiro deles precisar
+        streamed = None
+        comparison = {}
+
+        # figuras da fonte, geradas ao final (puladas se já atualizadas)
+        jobs = []
+
+        for pol in pollutants:
+            # limite de memória do worker estourado: a fonte para aqui
+            _check_memory_limit()
+
+            print(f"\n{'=' * 60}")
+            print(f"Fonte: {source_name} | Processando poluente: {pol}")
+            print(f"{'=' * 60}")
+
+            try:
+                da, present, missing = build_pollutant(
+                    ds=ds,
+                    pol_name=pol,
+                    pollutant_specs=pollutant_specs,
+                    verbose=True,
+                    cache=pollutant_cache
+                )
+
+                if da is None:
+                    print(f"{pol}: não disponível em {source_name}. Pulando apenas este poluente.")
+                    continue
+
+                unit = config["pollutant_units"][pol]
+
+                print(f"{pol}: usando {len(present)} espécie(s).")
+                if missing:
+                    print(f"{pol}: cálculo parcial. Espécies ausentes: {len(missing)}")
+
+                # todos os agregados do poluente: do cubo em disco ou em uma única
+                # passada nos arquivos brutos
+                products = None
+                if config["use_store"]:
+                    products = load_emission_products(config["store_base_path"], source_name, pol)
+
+                if products is None and config.get("streaming", False):
+                    if streamed is None:
+                        try:
+                            streamed = stream_emission_products(
+                                files=files,
+                                pollutants=pollutants,
+                                pollutant_specs=pollutant_specs,
+                                region_index=region_index,
+                                max_workers=config.get("stream_workers", 4)
+                            )
+                        except Exception as e:
+                            # falha lembrada: os demais poluentes vão direto ao grafo dask
+                            print(f"Aviso: modo streaming falhou em {source_name} ({e}). "
+                                  f"Usando o grafo dask para todos os poluentes.")
+                            streamed = {}
+                    products = streamed.get(pol)
+
+                if products is None:
+                    products = compute_emission_products(
+                        da=da,
+                        ds=ds,
+                        xlon=xlon,
+                        ylat=ylat,
+                        brazil=brazil,
+                        region_index=region_index
+                    )
+
+                # média anual por macro-região para gráfico de barras empilhadas
+                region_mean_annual = calculate_region_annual_mean(
+                    da=da,
+                    ds=ds,
+                    xlon=xlon,
+                    ylat=ylat,
+                    brazil=brazil,
+                    products=products
+                )
+
+                # produtos para a comparação entre fontes
+                comparison[pol] = {
+                    "map": products["map"],
+                    "xlon": xlon,
+                    "ylat": ylat,
+                    "time": products["datetimes"],
+                    "values": products["domain_series"].values,
+                    "region_mean": region_mean_annual,
+                }
+
+                # com armazenamento em disco, só o caminho volta ao chamador
+                if config.get("comparison_store_path"):
+                    comparison[pol] = write_comparison_product(
+                        config["comparison_store_path"], source_name, pol, comparison[pol]
+                    )
+
+                nlay = da.sizes.get("LAY", 1)
+                print(f"LAY size para {source_name} - {pol}: {nlay}")
+
+                # argumentos comuns às figuras do poluente
+                common = dict(
+                    pol_name=pol,
+                    unit=unit,
+                    xlon=xlon,
+                    ylat=ylat,
+                    brazil=brazil,
+                    figpath=figpath,
+                    products=products
+                )
+
+                if nlay > 1:
+                    jobs.append((plot_spatial_mosaic, dict(
+                        common,
+                        da=da,
+                        dims_time=dims_time,
+                        layers=config.get("mosaic_layers"),
+                        layer_bins=config.get("mosaic_layer_bins")
+                    )))
+
+                    if config.get("layer_sheet", False):
+                        jobs.append((plot_layer_sheet, dict(common, da=da)))
+
+                    by_region_lay = calculate_by_region_lay(
+                        da=da,
+                        xlon=xlon,
+                        ylat=ylat,
+                        brazil=brazil,
+                        products=products
+                    )
+
+                    jobs.append((plot_regional_vertical_profile, dict(
+                        by_region_lay=by_region_lay,
+                        pol_name=pol,
+                        unit=unit,
+                        brazil=brazil,
+                        figpath=figpath
+                    )))
+
+                    # divisão entre camadas ao longo do dia e do ano (cubos em
+                    # disco, refeitos só quando os arquivos mudam)
+                    if config.get("injection_cubes", False):
+                        injection = update_region_injection_cubes(
+                            store_path=config["store_base_path"],
+                            source_name=source_name,
+                            pol_name=pol,
+                            da=da,
+                            files=files,
+                            pollutant_specs=pollutant_specs,
+                            region_index=region_index
+                        )
+                        for kind in ("hour", "month"):
+                            jobs.append((plot_region_injection_profile, dict(
+                                cubes=injection,
+                                pol_name=pol,
+                                figpath=figpath,
+                                kind=kind,
+                                source_name=source_name
+                            )))
+
+                else:
+                    print(f"{pol}: inventário monocamada. Pulando análises por camada.")
+
+                    jobs.append((plot_regional_total_map, dict(common, da=da)))
+
+                jobs.append((plot_temporal_mosaic, dict(common, da=da, ds=ds, source_name=source_name)))
+                jobs.append((plot_annual_spatial_mosaic, dict(common, da=da, ds=ds, source_name=source_name)))
+
+                # perfis hora/dia da semana/mês por célula (cubos em disco)
+                if config.get("temporal_cubes", False):
+                    cubes = update_temporal_profile_cubes(
+                        store_path=config["store_base_path"],
+                        source_name=source_name,
+                        pol_name=pol,
+                        da=da,
+                        files=files,
+                        pollutant_specs=pollutant_specs,
+                        region_index=region_index
+                    )
+                    jobs.append((plot_region_temporal_bands, dict(
+                        cubes=cubes,
+                        region_index=region_index,
+                        pol_name=pol,
+                        unit=unit,
+                        figpath=figpath,
+                        source_name=source_name
+                    )))
+
+            except Exception as e:
+                print(f"Erro ao processar {pol} em {source_name}: {e}")
+                continue
+
+        _check_memory_limit()
+
+        render_figure_jobs(
+            jobs,
+            figpath,
+            max_workers=config.get("render_workers", 1),
+            force=config.get("force_render", False)
+        )
+
+        return comparison
+
+    finally:
+        ds.close()
+
+
+#%% ── execução de várias fontes ─────────────────────────────────────────────
+
+# estado do worker: limite de RSS, fonte em execução, estouro detectado e
+# fila que avisa o processo principal quando o worker é encerrado por memória
+_WORKER_STATE = {"limit": None, "source": None, "exceeded": None, "killed": None}
+
+# intervalo entre leituras do RSS e tolerância até encerrar o processo
+MEMORY_POLL_SECONDS = 0.5
+MEMORY_GRACE_SECONDS = 30.0
+
+
+def _memory_error_message(rss):
+    return (f"RSS de {rss / 1024 ** 3:.1f} GB acima do limite de "
+            f"{_WORKER_STATE['limit'] / 1024 ** 3:.1f} GB")
+
+
+def _check_memory_limit():
+    """
+    Levanta MemoryError se o watchdog marcou a fonte em execução como acima
+    do limite de memória. Chamada entre os poluentes de
+    process_emission_source (fora do try de cada poluente); sem watchdog
+    (execução em série) não faz nada.
+    """
+    rss = _WORKER_STATE["exceeded"]
+    if rss is not None:
+        raise MemoryError(_memory_error_message(rss))
+
+
+def _memory_watchdog(limit_bytes):
+    """
+    Thread do worker que acompanha o RSS do processo (psutil, em qualquer
+    sistema). Acima do limite, marca a fonte em execução, que falha no
+    próximo _check_memory_limit; se o RSS continuar alto por
+    MEMORY_GRACE_SECONDS, avisa o processo principal e encerra o worker.
+    """
+    process = psutil.Process()
+    exceeded_at = None
+
+    while True:
+        time.sleep(MEMORY_POLL_SECONDS)
+        rss = process.memory_info().rss
+
+        if _WORKER_STATE["source"] is None or rss <= limit_bytes:
+            exceeded_at = None
+            continue
+
+        if exceeded_at is None:
+            exceeded_at = time.monotonic()
+            _WORKER_STATE["exceeded"] = rss
+            print(f"Aviso: fonte {_WORKER_STATE['source']} excedeu o limite de memória "
+                  f"({rss / 1024 ** 3:.1f} GB > {limit_bytes / 1024 ** 3:.1f} GB); "
+                  f"interrompendo após o poluente atual.")
+        elif time.monotonic() - exceeded_at > MEMORY_GRACE_SECONDS:
+            print(f"Aviso: fonte {_WORKER_STATE['source']} não liberou memória; encerrando o worker.")
+            # SimpleQueue grava no pipe de forma síncrona, antes do _exit
+            _WORKER_STATE["killed"].put((_WORKER_STATE["source"], _memory_error_message(rss)))
+            os._exit(1)
+
+
+def _init_source_worker(memory_limit_gb, threads_per_worker, killed_queue):
+    """
+    Configura cada processo do pool: backend sem janela, número de threads
+    do dask e, com `memory_limit_gb`, um watchdog de RSS (psutil). Ao
+    estourar o limite a fonte falha com MemoryError, sem afetar as demais.
+    """
+    set_headless(True)
+
+    if threads_per_worker:
+        dask.config.set(scheduler="threads", num_workers=threads_per_worker)
+
+    if memory_limit_gb:
+        _WORKER_STATE["limit"] = int(memory_limit_gb * 1024 ** 3)
+        _WORKER_STATE["killed"] = killed_queue
+        threading.Thread(
+            target=_memory_watchdog, args=(_WORKER_STATE["limit"],), daemon=True
+        ).start()
+
+
+def _process_source_in_worker(source_name, repo_path, brazil, config):
+    """
+    process_emission_source dentro do pool, com a fonte registrada para o
+    watchdog de memória.
+    """
+    _WORKER_STATE["source"] = source_name
+    _WORKER_STATE["exceeded"] = None
+    try:
+        return process_emission_source(source_name, repo_path, brazil, config)
+    finally:
+        _WORKER_STATE["source"] = None
+        _WORKER_STATE["exceeded"] = None
+
+
+def _run_pool(batch, brazil, config, max_workers, memory_limit_gb, threads_per_worker,
+              results, failures):
+    """
+    Executa um lote de fontes em um pool. Retorna as fontes perdidas porque
+    um processo do pool morreu (ex.: OOM killer), sem culpado identificável;
+    as encerradas pelo próprio watchdog de memória entram em `failures`.
+    """
+    lost = []
+
+    # spawn: workers novos, sem herdar locks de threads dask/HDF5 já usadas
+    # pelo processo principal (com fork podem travar no Linux)
+    context = multiprocessing.get_context("spawn")
+    killed_queue = context.SimpleQueue()
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=context,
+        initializer=_init_source_worker,
+        initargs=(memory_limit_gb, threads_per_worker, killed_queue)
+    ) as pool:
+        futures = {
+            pool.submit(_process_source_in_worker, name, path, brazil, config): name
+            for name, path in batch
+        }
+
+        for fut in as_completed(futures):
+            name = futures[fut]
+            try:
+                results[name] = fut.result()
+                print(f"Fonte concluída: {name}")
+            except BrokenProcessPool:
+                lost.append(name)
+            except Exception as e:
+                failures[name] = repr(e)
+                print(f"Falha na fonte {name}: {e}")
+
+    # fontes que o watchdog encerrou por memória: falham sem nova tentativa
+    while not killed_queue.empty():
+        name, message = killed_queue.get()
+        failures[name] = repr(MemoryError(message))
+        print(f"Falha na fonte {name}: {message}")
+        if name in lost:
+            lost.remove(name)
+
+    killed_queue.close()
+    return lost
+
+
+def run_emission_sources(sources, brazil, config, parallel=True, max_workers=None,
+                         memory_limit_gb=None, threads_per_worker=None):
+    """
+    Processa todas as fontes de `sources` ({nome: pasta}) e retorna
+    (results, failures):
+
+    - results: {fonte: saída de process_emission_source}
+    - failures: {fonte: descrição do erro}
+
+    Em paralelo, cada fonte roda em um processo com até `threads_per_worker`
+    threads dask e `memory_limit_gb` de memória residente (RSS); a fonte que
+    estourar o limite falha com MemoryError (no próximo poluente, ou com o
+    worker encerrado se a memória não baixar) e não é repetida. Se um
+    processo morrer por outro motivo e quebrar o pool, as fontes afetadas
+    são repetidas uma a uma, em pools isolados, para que apenas a fonte
+    problemática seja perdida.
+    """
+    results = {}
+    failures = {}
+    items = list(sources.items())
+
+    if not parallel or max_workers == 1:
+        for name, path in items:
+            try:
+                results[name] = process_emission_source(name, path, brazil, config)
+            except Exception as e:
+                failures[name] = repr(e)
+                print(f"Falha na fonte {name}: {e}")
+        return results, failures
+
+    if max_workers is None:
+        max_workers = min(len(items), os.cpu_count() or 1)
+
+    # com as fontes já em paralelo, as figuras de cada fonte ficam no seu worker
+    config = dict(config, render_workers=1)
+
+    lost = _run_pool(
+        items, brazil, config, max_workers, memory_limit_gb, threads_per_worker,
+        results, failures
+    )
+
+    # repete isoladamente as fontes perdidas com a quebra do pool
+    for name in lost:
+        print(f"Repetindo a fonte {name} em um processo isolado...")
+        again = _run_pool(
+            [(name, sources[name])], brazil, config, 1, memory_limit_gb,
+            threads_per_worker, results, failures
+        )
+        for lost_name in again:
+            failures[lost_name] = "Processo encerrado inesperadamente (memória insuficiente?)"
+            print(f"Falha na fonte {lost_name}: processo encerrado inesperadamente.")
+
+    return results, failures
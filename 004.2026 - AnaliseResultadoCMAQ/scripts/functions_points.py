@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+"""
+Extração de séries do CMAQ (qualidade ou emissões) em pontos: instalações
+do inventário (005), centroides de municípios, estações de monitoramento.
+
+O localizador da grade é construído uma única vez por grade e fica em cache
+na sessão. Ele converte lon/lat em índices fracionários (linha, coluna):
+- "ioapi": inversa analítica da Mercator equatorial IOAPI (atributos XORIG,
+  YORIG, XCELL, YCELL, XCENT do dataset);
+- "axes": grade retangular em lon/lat (como a saída de eqmerc2latlon),
+  com busca binária nos eixos 1D;
+- "kdtree": grade curvilínea qualquer (LAT/LON 2D), com KD-tree na esfera e
+  refinamento local pela jacobiana da grade.
+
+Na inversa IOAPI, XORIG/YORIG são o canto inferior esquerdo da grade e a
+célula j cobre [XORIG + j*XCELL, XORIG + (j+1)*XCELL]. ioapiCoords usa
+XORIG + j*XCELL (o canto) como coordenada da célula; quando xlon/ylat são
+cantos (saída de eqmerc2latlon), "axes" e "kdtree" deslocam os índices
+meia célula para o centro, e os três métodos devolvem a mesma célula. Com
+`ds`, cantos ou centros são detectados pelos atributos da grade; sem ele,
+informe cell_corners=True. LAT/LON das saídas de qualidade já são centros.
+
+A leitura é uma única indexação vetorizada (isel com DataArrays), que o dask
+resolve lendo apenas os blocos tocados pelos pontos: milhares de pontos
+não viram milhares de chamadas a sel.
+"""
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from functions_emissions import IOAPI_GRID_ATTRS, get_ioapi_projection, separable_grid_axes
+
+
+#%% ── localizador da grade ──────────────────────────────────────────────────
+
+# localizadores já construídos nesta sessão, por chave da grade
+_LOCATOR_CACHE = {}
+
+POINT_METHODS = ("nearest", "bilinear")
+
+
+def _grid_key(xlon, ylat, ds=None):
+    """
+    Chave curta (hash) da grade: atributos IOAPI quando existem, senão o
+    conteúdo de xlon/ylat.
+    """
+    h = hashlib.sha1()
+    if ds is not None and all(a in ds.attrs for a in IOAPI_GRID_ATTRS):
+        h.update(";".join(f"{a}={float(ds.attrs[a]):.6f}" for a in IOAPI_GRID_ATTRS).encode("utf-8"))
+    h.update(np.ascontiguousarray(xlon, dtype=float).tobytes())
+    h.update(np.ascontiguousarray(ylat, dtype=float).tobytes())
+    return h.hexdigest()[:16]
+
+
+def _lonlat_to_xyz(lon, lat):
+    """
+    Coordenadas cartesianas na esfera unitária (distâncias sem distorção
+    de longitude para o KD-tree).
+    """
+    lon = np.deg2rad(np.asarray(lon, dtype=float))
+    lat = np.deg2rad(np.asarray(lat, dtype=float))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def _axis_fraction(axis, values):
+    """
+    Índice fracionário de `values` em um eixo 1D monotônico (crescente ou
+    decrescente), extrapolado linearmente fora dele.
+    """
+    axis = np.asarray(axis, dtype=float)
+    index = np.arange(axis.size, dtype=float)
+    if axis[0] > axis[-1]:
+        axis = axis[::-1]
+        index = index[::-1]
+
+    frac = np.interp(values, axis, index)
+
+    # extrapolação (para marcar pontos fora da grade)
+    below = values < axis[0]
+    above = values > axis[-1]
+    frac[below] = index[0] + (values[below] - axis[0]) / (axis[1] - axis[0]) * (index[1] - index[0])
+    frac[above] = index[-1] + (values[above] - axis[-1]) / (axis[-1] - axis[-2]) * (index[-1] - index[-2])
+    return frac
+
+
+def _ioapi_grid(ds, xlon, ylat):
+    """
+    Parâmetros da inversa IOAPI: projeção, origem, tamanho das células e
+    orientação das linhas/colunas de xlon/ylat.
+    """
+    return dict(
+        proj=get_ioapi_projection(ds),
+        xorig=float(ds.XORIG),
+        yorig=float(ds.YORIG),
+        xcell=float(ds.XCELL),
+        ycell=float(ds.YCELL),
+        # fontes rotacionadas trazem as linhas de norte para sul
+        flip_rows=bool(ylat[0, 0] > ylat[-1, 0]),
+        flip_cols=bool(xlon[0, 0] > xlon[0, -1]),
+    )
+
+
+def _ioapi_fraction(grid, shape, lon, lat):
+    """
+    Índices fracionários (linha, coluna) de centro de célula pela inversa
+    analítica da grade IOAPI (`grid` de _ioapi_grid).
+    """
+    nrows, ncols = shape
+    x, y = grid["proj"](lon, lat)
+    col = (np.asarray(x) - grid["xorig"]) / grid["xcell"] - 0.5
+    row = (np.asarray(y) - grid["yorig"]) / grid["ycell"] - 0.5
+    if grid["flip_rows"]:
+        row = (nrows - 1) - row
+    if grid["flip_cols"]:
+        col = (ncols - 1) - col
+    return row, col
+
+
+def _half_cell_shift(xlon, ylat, ds=None, cell_corners=None):
+    """
+    Deslocamento (linha, coluna) entre o índice nos nós xlon/ylat e o índice
+    de centro de célula: 0 para centros, ±0.5 para cantos (o sinal segue a
+    orientação da grade).
+
+    Com os atributos IOAPI em `ds`, o nó [0, 0] é localizado pela inversa
+    analítica (e o deslocamento sai dele); senão vale `cell_corners`.
+    """
+    if ds is not None and all(a in ds.attrs for a in IOAPI_GRID_ATTRS):
+        row, col = _ioapi_fraction(_ioapi_grid(ds, xlon, ylat), xlon.shape, xlon[0, 0], ylat[0, 0])
+        return float(np.round(2 * row) / 2), float(np.round(2 * col) / 2)
+
+    flip_rows = bool(ylat[0, 0] > ylat[-1, 0])
+    flip_cols = bool(xlon[0, 0] > xlon[0, -1])
+    if cell_corners:
+        return (0.5 if flip_rows else -0.5), (0.5 if flip_cols else -0.5)
+
+    return 0.0, 0.0
+
+
+def build_grid_locator(xlon, ylat, ds=None, method=None, cell_corners=None):
+    """
+    Localizador lon/lat → (linha, coluna) fracionária da grade, reutilizado
+    entre chamadas (cache por grade).
+
+    `method` força "ioapi", "axes" ou "kdtree"; por padrão usa a inversa
+    IOAPI se `ds` tiver os atributos da grade, depois os eixos 1D se a
+    grade for retangular em lon/lat e, por fim, o KD-tree.
+
+    `cell_corners=True` indica que xlon/ylat são os cantos das células
+    (eqmerc2latlon) quando `ds` não é informado; com `ds`, isso é detectado.
+    """
+    xlon = np.asarray(xlon, dtype=float)
+    ylat = np.asarray(ylat, dtype=float)
+    if xlon.ndim != 2 or xlon.shape != ylat.shape:
+        raise ValueError("xlon e ylat devem ser 2D (ROW, COL) e do mesmo tamanho.")
+
+    if method is None:
+        if ds is not None and all(a in ds.attrs for a in IOAPI_GRID_ATTRS):
+            method = "ioapi"
+        elif separable_grid_axes(xlon, ylat) is not None:
+            method = "axes"
+        else:
+            method = "kdtree"
+
+    shift = _half_cell_shift(xlon, ylat, ds=ds, cell_corners=cell_corners)
+
+    key = f"{_grid_key(xlon, ylat, ds=ds)}:{method}:{shift[0]:+.1f},{shift[1]:+.1f}"
+    if key in _LOCATOR_CACHE:
+        return _LOCATOR_CACHE[key]
+
+    # "axes"/"kdtree" localizam nos nós; shift leva o índice ao centro da célula
+    locator = {"key": key, "method": method, "shape": xlon.shape, "shift": shift}
+
+    if method == "ioapi":
+        if ds is None or not all(a in ds.attrs for a in IOAPI_GRID_ATTRS):
+            raise ValueError("O método 'ioapi' exige o dataset com os atributos da grade.")
+        locator.update(_ioapi_grid(ds, xlon, ylat))
+
+    elif method == "axes":
+        axes = separable_grid_axes(xlon, ylat)
+        if axes is None:
+            raise ValueError("A grade não é retangular em lon/lat; use 'kdtree'.")
+        locator["lon_axis"], locator["lat_axis"] = axes
+
+    elif method == "kdtree":
+        from scipy.spatial import cKDTree
+
+        locator["tree"] = cKDTree(_lonlat_to_xyz(xlon, ylat).reshape(-1, 3))
+        locator["xlon"] = xlon
+        locator["ylat"] = ylat
+
+    else:
+        raise ValueError(f"Método de localização desconhecido: {method}")
+
+    _LOCATOR_CACHE[key] = locator
+    return locator
+
+
+def locate_points(locator, lon, lat):
+    """
+    Índices fracionários (linha, coluna) dos pontos; o centro da célula
+    (i, j) corresponde a (i, j) exatos.
+    """
+    lon = np.atleast_1d(np.asarray(lon, dtype=float))
+    lat = np.atleast_1d(np.asarray(lat, dtype=float))
+    nrows, ncols = locator["shape"]
+
+    if locator["method"] == "ioapi":
+        return _ioapi_fraction(locator, locator["shape"], lon, lat)
+
+    shift_row, shift_col = locator["shift"]
+
+    if locator["method"] == "axes":
+        return (
+            _axis_fraction(locator["lat_axis"], lat) + shift_row,
+            _axis_fraction(locator["lon_axis"], lon) + shift_col,
+        )
+
+    # kdtree: célula mais próxima + passo de Newton com a jacobiana local
+    xlon, ylat = locator["xlon"], locator["ylat"]
+    _, flat = locator["tree"].query(_lonlat_to_xyz(lon, lat))
+    r0, c0 = np.unravel_index(flat, (nrows, ncols))
+
+    def _diff(field, axis):
+        lo_r = np.clip(r0 - (axis == 0), 0, nrows - 1)
+        hi_r = np.clip(r0 + (axis == 0), 0, nrows - 1)
+        lo_c = np.clip(c0 - (axis == 1), 0, ncols - 1)
+        hi_c = np.clip(c0 + (axis == 1), 0, ncols - 1)
+        steps = (hi_r - lo_r) + (hi_c - lo_c)
+        return (field[hi_r, hi_c] - field[lo_r, lo_c]) / np.maximum(steps, 1)
+
+    dlon_dr, dlon_dc = _diff(xlon, 0), _diff(xlon, 1)
+    dlat_dr, dlat_dc = _diff(ylat, 0), _diff(ylat, 1)
+    det = dlon_dc * dlat_dr - dlon_dr * dlat_dc
+    det = np.where(np.abs(det) > 0, det, np.nan)
+
+    dlon = lon - xlon[r0, c0]
+    dlat = lat - ylat[r0, c0]
+    dc = (dlon * dlat_dr - dlat * dlon_dr) / det
+    dr = (dlat * dlon_dc - dlon * dlat_dc) / det
+
+    row = r0 + np.nan_to_num(np.clip(dr, -1, 1)) + shift_row
+    col = c0 + np.nan_to_num(np.clip(dc, -1, 1)) + shift_col
+    return row, col
+
+
+#%% ── extração vetorizada ───────────────────────────────────────────────────
+
+def points_from_frame(df, lon_col="Longitude", lat_col="Latitude", name_col=None):
+    """
+    (lon, lat, nomes) a partir de uma tabela de pontos (ex.: inventário).
+    """
+    for col in [lon_col, lat_col] + ([name_col] if name_col else []):
+        if col not in df.columns:
+            raise ValueError(f"Coluna '{col}' não encontrada na tabela de pontos.")
+
+    names = df[name_col].astype(str).values if name_col else np.asarray(df.index).astype(str)
+    return df[lon_col].to_numpy(dtype=float), df[lat_col].to_numpy(dtype=float), names
+
+
+def extract_points(da, locator, lon, lat, names=None, method="nearest"):
+    """
+    Séries de `da` (..., ROW, COL) nos pontos, em uma única indexação
+    vetorizada. O resultado é preguiçoso se `da` for dask e troca (ROW, COL)
+    por uma dimensão "point", com coordenadas lon, lat, row e col (índices
+    fracionários) e inside (ponto dentro da grade).
+
+    method:
+    - "nearest": valor da célula que contém o ponto;
+    - "bilinear": interpolação entre os centros das 4 células vizinhas.
+
+    Pontos fora da grade ficam NaN.
+    """
+    if method not in POINT_METHODS:
+        raise ValueError(f"method deve ser um de {POINT_METHODS}.")
+
+    lon = np.atleast_1d(np.asarray(lon, dtype=float))
+    lat = np.atleast_1d(np.asarray(lat, dtype=float))
+    if lon.shape != lat.shape:
+        raise ValueError("lon e lat devem ter o mesmo tamanho.")
+
+    names = np.arange(lon.size) if names is None else np.asarray(names)
+    nrows, ncols = locator["shape"]
+    if (da.sizes["ROW"], da.sizes["COL"]) != (nrows, ncols):
+        raise ValueError("O campo e o localizador não são da mesma grade.")
+
+    row, col = locate_points(locator, lon, lat)
+    inside = (
+        np.isfinite(row) & np.isfinite(col)
+        & (row >= -0.5) & (row <= nrows - 0.5)
+        & (col >= -0.5) & (col <= ncols - 0.5)
+    )
+
+    point_coords = {
+        "point": ("point", names),
+        "lon": ("point", lon),
+        "lat": ("point", lat),
+        "row": ("point", row),
+        "col": ("point", col),
+        "inside": ("point", inside),
+    }
+
+    if method == "nearest":
+        r = np.clip(np.rint(np.nan_to_num(row)), 0, nrows - 1).astype(int)
+        c = np.clip(np.rint(np.nan_to_num(col)), 0, ncols - 1).astype(int)
+        out = da.isel(ROW=xr.DataArray(r, dims="point"), COL=xr.DataArray(c, dims="point"))
+
+    else:
+        # na borda (meia célula para fora) repete a última célula
+        row_b = np.clip(np.nan_to_num(row), 0, nrows - 1)
+        col_b = np.clip(np.nan_to_num(col), 0, ncols - 1)
+        r0 = np.minimum(np.floor(row_b).astype(int), max(nrows - 2, 0))
+        c0 = np.minimum(np.floor(col_b).astype(int), max(ncols - 2, 0))
+        r1 = np.minimum(r0 + 1, nrows - 1)
+        c1 = np.minimum(c0 + 1, ncols - 1)
+        fr = row_b - r0
+        fc = col_b - c0
+
+        rows = np.stack([r0, r0, r1, r1], axis=1)
+        cols = np.stack([c0, c1, c0, c1], axis=1)
+        weights = np.stack([(1 - fr) * (1 - fc), (1 - fr) * fc, fr * (1 - fc), fr * fc], axis=1)
+
+        corners = da.isel(
+            ROW=xr.DataArray(rows, dims=("point", "corner")),
+            COL=xr.DataArray(cols, dims=("point", "corner")),
+        )
+        out = corners.dot(xr.DataArray(weights, dims=("point", "corner")), dim="corner")
+        out = out.rename(da.name)
+        out.attrs = da.attrs
+
+    out = out.drop_vars([c for c in ["ROW", "COL"] if c in out.coords])
+    out = out.assign_coords(point_coords)
+    return out.where(out["inside"])
+
+
+def extract_points_frame(da, locator, lon, lat, names=None, method="nearest", time_dim="TSTEP"):
+    """
+    Como extract_points, mas já calculado e em tabela (tempo x ponto) para
+    campos (TSTEP, point) ou (TSTEP, LAY, point) na camada superficial.
+    """
+    out = extract_points(da, locator, lon, lat, names=names, method=method)
+    if "LAY" in out.dims:
+        out = out.isel(LAY=0)
+
+    values = np.asarray(out.transpose(time_dim, "point").values)
+    return pd.DataFrame(values, index=out[time_dim].values, columns=out["point"].values)
+
+
+#%% ── conferência dos localizadores ─────────────────────────────────────────
+
+def check_locator_agreement(xlon, ylat, ds, lon=None, lat=None, n_points=5000, seed=0):
+    """
+    Compara "axes" e "kdtree" com a inversa analítica "ioapi" em pontos
+    (aleatórios dentro da grade, se lon/lat não forem informados).
+
+    Retorna um DataFrame por método com o maior desvio do índice fracionário
+    (max_drow, max_dcol) e o número de pontos em outra célula (nearest).
+    """
+    xlon = np.asarray(xlon, dtype=float)
+    ylat = np.asarray(ylat, dtype=float)
+
+    if lon is None or lat is None:
+        rng = np.random.default_rng(seed)
+        lon = rng.uniform(np.nanmin(xlon), np.nanmax(xlon), n_points)
+        lat = rng.uniform(np.nanmin(ylat), np.nanmax(ylat), n_points)
+
+    ref_row, ref_col = locate_points(build_grid_locator(xlon, ylat, ds=ds, method="ioapi"), lon, lat)
+
+    rows = {}
+    for method in ["axes", "kdtree"]:
+        if method == "axes" and separable_grid_axes(xlon, ylat) is None:
+            continue
+        row, col = locate_points(build_grid_locator(xlon, ylat, ds=ds, method=method), lon, lat)
+        rows[method] = {
+            "max_drow": float(np.nanmax(np.abs(row - ref_row))),
+            "max_dcol": float(np.nanmax(np.abs(col - ref_col))),
+            "nearest_mismatch": int(
+                ((np.rint(row) != np.rint(ref_row)) | (np.rint(col) != np.rint(ref_col))).sum()
+            ),
+        }
+
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+if __name__ == "__main__":
+    # grade sintética (synthetic_ioapi), nos cantos (eqmerc2latlon) e rotacionada
+    from functions_emissions import eqmerc2latlon, ioapiCoords
+    from synthetic_ioapi import make_emission_dataset
+
+    ds_check = make_emission_dataset(ncols=120, nrows=100, nlays=1, nsteps=1)
+    xv, yv, _, _ = ioapiCoords(ds_check)
+    xlon_check, ylat_check = eqmerc2latlon(ds_check, xv, yv)
+
+    for label, (xl, yl) in {
+        "cantos": (xlon_check, ylat_check),
+        "cantos rotacionados": (xlon_check[::-1, :], ylat_check[::-1, :]),
+    }.items():
+        agreement = check_locator_agreement(xl, yl, ds_check)
+        print(f"\nLocalizadores ({label}):")
+        print(agreement.to_string())
+        if agreement["nearest_mismatch"].any():
+            raise ValueError(f"Os métodos de localização divergem na grade sintética ({label}).")
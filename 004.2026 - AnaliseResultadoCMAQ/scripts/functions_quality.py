@@ -9,6 +9,7 @@ Created on Fri Mar 27 14:33:30 2026
 
 import os
 
+import dask
 import geopandas as gpd
 import matplotlib.colors as colors
 import matplotlib.gridspec as gridspec
@@ -16,36 +17,15 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import xarray as xr
-from shapely.geometry import box
+
+from functions_emissions import add_brazil_inverse_mask, plot_grid_field
+from functions_render import finish_figure
 
 plt.rcParams["font.family"] = "Arial"
 
 
 #%% ── helpers básicos ────────────────────────────────────────────────────────
 
-def add_brazil_inverse_mask(ax, brazil, xlon, ylat, pad=1.0, facecolor="white"):
-    """
-    Plota uma máscara branca fora do Brasil para esconder pixels externos.
-    """
-    brazil_union = brazil.unary_union
-
-    xmin = float(np.nanmin(xlon)) - pad
-    xmax = float(np.nanmax(xlon)) + pad
-    ymin = float(np.nanmin(ylat)) - pad
-    ymax = float(np.nanmax(ylat)) + pad
-
-    outer = box(xmin, ymin, xmax, ymax)
-    inverse_mask = outer.difference(brazil_union)
-
-    mask_gdf = gpd.GeoDataFrame(geometry=[inverse_mask], crs="EPSG:4326")
-    mask_gdf.plot(
-        ax=ax,
-        color=facecolor,
-        edgecolor="none",
-        zorder=8
-    )
-
-
 def squeeze_var_dim(da):
     if "VAR" in da.dims and da.sizes["VAR"] == 1:
         da = da.squeeze("VAR", drop=True)
@@ -88,18 +68,12 @@ def compute_quality_surface_domain_series(da):
     return ts
 
 
-def compute_quality_daily_metric(da, pol_name, datetimes):
+def _daily_domain_metric(values, datetimes, pol_name):
     """
-    Calcula a métrica diária apropriada por poluente, usando a camada superficial.
-
-    Regras:
-    - PM10 / PM25 / PMC: média diária
-    - NO2: máxima horária diária
-    - O3: máxima média móvel de 8h diária
-    - padrão fallback: média diária
+    Métrica diária de uma série horária do domínio (regras de
+    compute_quality_daily_metric).
     """
-    ts = compute_quality_surface_domain_series(da)
-    values = np.asarray(ts.values, dtype=float)
+    values = np.asarray(values, dtype=float)
 
     if len(values) != len(datetimes):
         raise ValueError("O tamanho da série e das datas não coincide.")
@@ -109,19 +83,30 @@ def compute_quality_daily_metric(da, pol_name, datetimes):
     pol_upper = pol_name.upper()
 
     if pol_upper in ["PM10", "PM25", "PMC"]:
-        daily = s.resample("D").mean()
+        return s.resample("D").mean()
 
     elif pol_upper == "NO2":
-        daily = s.resample("D").max()
+        return s.resample("D").max()
 
     elif pol_upper == "O3":
-        rolling8 = s.rolling(window=8, min_periods=8).mean()
-        daily = rolling8.resample("D").max()
+        mda8, days = daily_mda8(values, datetimes)
+        return pd.Series(mda8, index=days)
 
-    else:
-        daily = s.resample("D").mean()
+    return s.resample("D").mean()
 
-    return daily
+
+def compute_quality_daily_metric(da, pol_name, datetimes):
+    """
+    Calcula a métrica diária apropriada por poluente, usando a camada superficial.
+
+    Regras:
+    - PM10 / PM25 / PMC: média diária
+    - NO2: máxima horária diária
+    - O3: máxima média móvel de 8h diária
+    - padrão fallback: média diária
+    """
+    ts = compute_quality_surface_domain_series(da)
+    return _daily_domain_metric(ts.values, datetimes, pol_name)
 
 
 def get_quality_metric_label(pol_name):
@@ -161,18 +146,22 @@ def compute_quality_annual_domain_mean(da):
 
 #%% ── figura principal ───────────────────────────────────────────────────────
 
-def plot_quality_summary(da, ds, pol_name, unit, xlon, ylat, brazil, figpath):
+def plot_quality_summary(da, ds, pol_name, unit, xlon, ylat, brazil, figpath, bundle=None):
     """
     Figura resumo para qualidade do ar:
     - mapa da média anual na camada superficial
     - série diária da métrica apropriada por poluente
+
+    `bundle` (compute_quality_bundle) evita recalcular as métricas.
     """
-    datetimes = get_quality_datetimes(ds)
+    if bundle is None:
+        bundle = compute_quality_bundle(da, pol_name, get_quality_datetimes(ds),
+                                        keep_daily_field=False)
 
-    da_map = compute_quality_annual_mean_map(da)
-    daily_metric = compute_quality_daily_metric(da, pol_name, datetimes)
-    metric_label = get_quality_metric_label(pol_name)
-    domain_mean = compute_quality_annual_domain_mean(da)
+    da_map = bundle["annual_map"]
+    daily_metric = bundle["daily_series"]
+    metric_label = bundle["metric_label"]
+    domain_mean = bundle["domain_mean"]
 
     positive = da_map.where(da_map > 0)
     try:
@@ -202,11 +191,10 @@ def plot_quality_summary(da, ds, pol_name, unit, xlon, ylat, brazil, figpath):
     ax_ts = fig.add_subplot(gs[0, 1])
 
     # mapa
-    m = ax_map.pcolormesh(
-        xlon, ylat, da_map,
+    m = plot_grid_field(
+        ax_map, xlon, ylat, da_map,
         cmap=cmap,
-        norm=norm,
-        shading="auto"
+        norm=norm
     )
 
     add_brazil_inverse_mask(ax=ax_map, brazil=brazil, xlon=xlon, ylat=ylat, pad=1.0)
@@ -266,12 +254,11 @@ def plot_quality_summary(da, ds, pol_name, unit, xlon, ylat, brazil, figpath):
         y=0.98
     )
 
-    plt.savefig(
+    finish_figure(
+        fig,
         os.path.join(figpath, f"quality_summary_{pol_name}.png"),
-        dpi=300,
         bbox_inches="tight"
     )
-    plt.show()
     
 #%%
 
@@ -282,138 +269,359 @@ QUALITY_RULES = {
     "O3":   {"map_label": "Média anual", "daily_rule": "daily_mda8"},
 }
 
-def compute_quality_daily_metric_field(da, pol_name, datetimes):
+def _quality_spatial_chunks(da, target_chunk_mb=128):
     """
-    Calcula a métrica diária por pixel na camada superficial.
-
-    Retorna:
-    - daily_df: DataFrame (dias x pixels)
-    - ny, nx: dimensões espaciais
+    Chunks (ROW, COL) para as métricas diárias: o eixo TSTEP fica inteiro
+    em cada bloco (a janela de 8 h atravessa dias e arquivos) e o espaço é
+    dividido até ~target_chunk_mb por bloco em float64.
     """
-    if pol_name not in QUALITY_RULES:
-        raise ValueError(f"Poluente {pol_name} não está definido em QUALITY_RULES.")
+    nt, ny, nx = da.sizes["TSTEP"], da.sizes["ROW"], da.sizes["COL"]
+    pixels = max(1, int(target_chunk_mb * 1024 ** 2 // (nt * 8)))
 
-    rule = QUALITY_RULES[pol_name]["daily_rule"]
+    if pixels >= nx:
+        return {"TSTEP": -1, "ROW": int(min(ny, pixels // nx)), "COL": -1}
+    return {"TSTEP": -1, "ROW": 1, "COL": int(pixels)}
 
-    if "LAY" in da.dims:
-        da = da.isel(LAY=0)
 
-    nt = da.sizes["TSTEP"]
-    ny = da.sizes["ROW"]
-    nx = da.sizes["COL"]
+MDA8_WINDOW = 8
 
-    arr = da.values.reshape(nt, -1)
-    df = pd.DataFrame(arr, index=datetimes)
+# horas válidas mínimas para uma média móvel de 8 h valer (75% da janela)
+MDA8_MIN_HOURS = 6
+
+# pixels processados por vez dentro de um bloco: limita os temporários
+# (somas acumuladas, janelas) a alguns MB, mesmo com um ano de dados
+_PIXEL_GROUP = 256
 
-    if rule == "daily_mean":
-        daily_df = df.resample("D").mean()
 
-    elif rule == "daily_max_hour":
-        daily_df = df.resample("D").max()
+def _rolling_mean_cumsum(arr, window=MDA8_WINDOW, min_periods=None):
+    """
+    Média móvel de `window` passos ao longo do último eixo de um array 2D
+    (pixel, tempo), pelo truque da soma acumulada: soma da janela =
+    S[t] - S[t - window], em O(pixel x tempo) qualquer que seja a janela.
+
+    Segue rolling(window, min_periods=min_periods).mean() do pandas (padrão
+    min_periods=window): a janela é rotulada no último passo, as primeiras
+    window-1 posições ficam NaN e a janela só vale com pelo menos
+    `min_periods` valores finitos, cuja média é devolvida. As somas são
+    acumuladas em float64; sem NaN no bloco, a contagem de válidos é pulada.
+    """
+    if min_periods is None:
+        min_periods = window
 
-    elif rule == "daily_mda8":
-        rolling8 = df.rolling(window=8, min_periods=8).mean()
-        daily_df = rolling8.resample("D").max()
+    npix, nt = arr.shape
+    out = np.full((npix, nt), np.nan)
+    if nt < window:
+        return out
 
+    valid = np.isfinite(arr)
+    all_valid = bool(valid.all())
+
+    csum = np.zeros((npix, nt + 1))
+    np.cumsum(arr if all_valid else np.where(valid, arr, 0.0), axis=-1, out=csum[:, 1:])
+
+    # janelas completas escritas direto na saída
+    means = out[:, window - 1:]
+    np.subtract(csum[:, window:], csum[:, :-window], out=means)
+
+    if all_valid:
+        means /= window
     else:
-        raise ValueError(f"Regra desconhecida: {rule}")
+        ccount = np.zeros((npix, nt + 1), dtype=np.int32)
+        np.cumsum(valid, axis=-1, dtype=np.int32, out=ccount[:, 1:])
+        counts = ccount[:, window:] - ccount[:, :-window]
+        means /= np.maximum(counts, 1)
+        np.putmask(means, counts < min_periods, np.nan)
 
-    return daily_df, ny, nx
+    return out
 
-def compute_quality_daily_metric_field(da, pol_name, datetimes):
-    """
-    Calcula a métrica diária por pixel na camada superficial.
 
-    Retorna:
-    - daily_df: DataFrame (dias x pixels)
-    - ny, nx: dimensões espaciais
+def _day_segments(datetimes):
     """
-    if pol_name not in QUALITY_RULES:
-        raise ValueError(f"Poluente {pol_name} não está definido em QUALITY_RULES.")
+    Segmentos diários de uma série horária ordenada: (índice do primeiro
+    passo de cada dia presente, posição desses dias no intervalo completo,
+    intervalo completo de dias).
+    """
+    datetimes = pd.DatetimeIndex(datetimes)
+    if not datetimes.is_monotonic_increasing:
+        raise ValueError("As datas da série precisam estar em ordem crescente.")
 
-    rule = QUALITY_RULES[pol_name]["daily_rule"]
+    days = datetimes.floor("D")
+    all_days = pd.date_range(days[0], days[-1], freq="D")
+
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    day_pos = all_days.get_indexer(days[starts])
+    return starts, day_pos, all_days
 
-    if "LAY" in da.dims:
-        da = da.isel(LAY=0)
 
-    nt = da.sizes["TSTEP"]
-    ny = da.sizes["ROW"]
-    nx = da.sizes["COL"]
+def daily_mda8(values, datetimes):
+    """
+    MDA8 diário de uma série (TSTEP,) ou campo (TSTEP, ...) com o núcleo de
+    somas acumuladas. Retorna (array (dia, ...), intervalo de dias).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    starts, day_pos, all_days = _day_segments(datetimes)
 
-    arr = da.values.reshape(nt, -1)
-    df = pd.DataFrame(arr, index=datetimes)
+    block = np.moveaxis(values, 0, -1)
+    daily = _daily_metric_block(block, "daily_mda8", starts, day_pos, len(all_days))
+    return np.moveaxis(daily, -1, 0), all_days
 
+
+def _reduce_days(arr, rule, starts):
+    """
+    Reduz (pixel, TSTEP) aos dias presentes (pixel, dia) com reduceat.
+    """
     if rule == "daily_mean":
-        daily_df = df.resample("D").mean()
+        valid = np.isfinite(arr)
+        sums = np.add.reduceat(np.where(valid, arr, 0.0), starts, axis=-1)
+        counts = np.add.reduceat(valid, starts, axis=-1)
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
 
-    elif rule == "daily_max_hour":
-        daily_df = df.resample("D").max()
+    if rule in ("daily_max_hour", "daily_mda8"):
+        # fmax ignora NaN; dias só com NaN continuam NaN
+        return np.fmax.reduceat(arr, starts, axis=-1)
 
-    elif rule == "daily_mda8":
-        rolling8 = df.rolling(window=8, min_periods=8).mean()
-        daily_df = rolling8.resample("D").max()
+    raise ValueError(f"Regra desconhecida: {rule}")
 
-    else:
-        raise ValueError(f"Regra desconhecida: {rule}")
 
-    return daily_df, ny, nx
+def _daily_metric_block(block, rule, starts, day_pos, ndays):
+    """
+    Núcleo por bloco: block (..., TSTEP) -> (..., dia), percorrendo os
+    pixels em grupos de _PIXEL_GROUP.
+
+    `starts` são os índices do primeiro passo de cada dia presente e
+    `day_pos` a posição desses dias no intervalo completo de `ndays` dias
+    (dias sem nenhum passo ficam NaN, como no resample("D")).
+    """
+    lead = block.shape[:-1]
+    arr = block.reshape(-1, block.shape[-1])  # (pixel, TSTEP)
+
+    out = np.full((arr.shape[0], ndays), np.nan)
 
-def compute_quality_annual_mean_map(da):
+    for g0 in range(0, arr.shape[0], _PIXEL_GROUP):
+        group = arr[g0:g0 + _PIXEL_GROUP].astype(np.float64)
+
+        if rule == "daily_mda8":
+            group = _rolling_mean_cumsum(group, MDA8_WINDOW, MDA8_MIN_HOURS)
+
+        out[g0:g0 + _PIXEL_GROUP, day_pos] = _reduce_days(group, rule, starts)
+
+    return out.reshape(lead + (ndays,))
+
+
+def compute_quality_daily_metric_field(da, pol_name, datetimes, target_chunk_mb=128):
     """
-    Campo da média anual (ou média do período disponível) na camada superficial.
+    Calcula a métrica diária por pixel na camada superficial, sem carregar o
+    campo inteiro: o cálculo roda bloco a bloco (dask), com o espaço
+    dividido em chunks e o tempo inteiro em cada bloco.
+
+    Regras (QUALITY_RULES), iguais às do resample/rolling do pandas:
+    - daily_mean: média diária (ignora NaN)
+    - daily_max_hour: máxima horária diária
+    - daily_mda8: máxima diária da média móvel de 8 h (janela rotulada na
+      hora final, que pode começar no dia anterior; exige MDA8_MIN_HOURS
+      de 8 valores)
+
+    Os dias vão do primeiro ao último dia da série; dias sem dados ficam NaN.
+
+    Retorna um DataArray preguiçoso (day, ROW, COL).
     """
+    if pol_name not in QUALITY_RULES:
+        raise ValueError(f"Poluente {pol_name} não está definido em QUALITY_RULES.")
+
+    rule = QUALITY_RULES[pol_name]["daily_rule"]
+
     if "LAY" in da.dims:
         da = da.isel(LAY=0)
 
-    return da.mean(dim="TSTEP").compute()
+    if len(datetimes) != da.sizes["TSTEP"]:
+        raise ValueError("O tamanho da série e das datas não coincide.")
+
+    starts, day_pos, all_days = _day_segments(datetimes)
+
+    da = da.transpose("TSTEP", "ROW", "COL")
+    da = da.chunk(_quality_spatial_chunks(da, target_chunk_mb))
+
+    daily = xr.apply_ufunc(
+        _daily_metric_block,
+        da,
+        kwargs={"rule": rule, "starts": starts, "day_pos": day_pos, "ndays": len(all_days)},
+        input_core_dims=[["TSTEP"]],
+        output_core_dims=[["day"]],
+        dask="parallelized",
+        output_dtypes=[np.float64],
+        dask_gufunc_kwargs={"output_sizes": {"day": len(all_days)}},
+    )
+
+    daily = daily.assign_coords(day=all_days.values).transpose("day", "ROW", "COL")
+    return daily.rename(f"{pol_name}_{rule}")
 
 
 def compute_quality_daily_metric_mean_map(da, pol_name, datetimes):
     """
     Campo espacial da média da métrica diária ao longo do período.
     """
-    daily_df, ny, nx = compute_quality_daily_metric_field(da, pol_name, datetimes)
-    metric_mean = daily_df.mean(axis=0).values.reshape(ny, nx)
-    return metric_mean
+    daily = compute_quality_daily_metric_field(da, pol_name, datetimes)
+    return daily.mean(dim="day", skipna=True).values
+
+
+DAILY_SERIES_LABELS = {
+    "daily_mean": "Média diária",
+    "daily_max_hour": "Máxima média horária do dia",
+    "daily_mda8": "Máxima média móvel de 8h do dia",
+}
 
 
 def compute_quality_daily_metric_series(da, pol_name, datetimes):
     """
     Série diária da métrica apropriada, agregada no domínio.
     """
-    if "LAY" in da.dims:
-        da = da.isel(LAY=0)
+    rule = QUALITY_RULES[pol_name]["daily_rule"]
+    if rule not in DAILY_SERIES_LABELS:
+        raise ValueError(f"Regra desconhecida: {rule}")
 
-    dims_to_mean = [d for d in da.dims if d not in ["TSTEP"]]
-    ts = da.mean(dim=dims_to_mean).compute()
+    ts = compute_quality_surface_domain_series(da)
+    return _daily_domain_metric(ts.values, datetimes, pol_name), DAILY_SERIES_LABELS[rule]
 
-    s = pd.Series(np.asarray(ts.values, dtype=float), index=datetimes)
-    rule = QUALITY_RULES[pol_name]["daily_rule"]
 
-    if rule == "daily_mean":
-        return s.resample("D").mean(), "Média diária"
+#%% ── pacote de métricas por poluente ─────────────────────────────────────────
 
-    elif rule == "daily_max_hour":
-        return s.resample("D").max(), "Máxima média horária do dia"
+def compute_quality_bundle(da, pol_name, datetimes, keep_daily_field=True):
+    """
+    Calcula, em uma única passada dask pelos dados, tudo o que as figuras e
+    relatórios de qualidade usam de um poluente na camada superficial:
+
+    - "annual_map": média do período (ROW, COL)
+    - "yearly_mean_maps": média de cada ano (year, ROW, COL)
+    - "domain_series": série horária da média do domínio (pd.Series)
+    - "domain_mean": média do período no domínio (float)
+    - "daily_series": métrica diária do domínio (pd.Series)
+    - "daily_field": cubo diário por pixel (day, ROW, COL), se o poluente
+      estiver em QUALITY_RULES e keep_daily_field=True
+    - "daily_mean_map": média do cubo diário no período (ROW, COL)
+    - "daily_rule", "metric_label", "series_label"
+
+    O dicionário pode ser passado (bundle=) a plot_quality_summary,
+    plot_quality_legislative_mosaic e compute_conama_metrics, que então não
+    releem os dados.
+    """
+    datetimes = pd.DatetimeIndex(datetimes)
 
-    elif rule == "daily_mda8":
-        rolling8 = s.rolling(window=8, min_periods=8).mean()
-        return rolling8.resample("D").max(), "Máxima média móvel de 8h do dia"
+    surface = da.isel(LAY=0) if "LAY" in da.dims else da
+    if len(datetimes) != surface.sizes["TSTEP"]:
+        raise ValueError("O tamanho da série e das datas não coincide.")
 
-    else:
-        raise ValueError(f"Regra desconhecida: {rule}")
-        
-def plot_quality_legislative_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil, figpath):
+    surface = surface.assign_coords(TSTEP=datetimes.values)
+    space_dims = [d for d in surface.dims if d != "TSTEP"]
+
+    lazy = {
+        "annual_map": surface.mean(dim="TSTEP"),
+        "yearly_mean_maps": surface.groupby(surface["TSTEP"].dt.year.rename("year")).mean(dim="TSTEP"),
+        "domain_series": surface.mean(dim=space_dims),
+    }
+
+    rule = QUALITY_RULES.get(pol_name, {}).get("daily_rule")
+    if rule is not None:
+        lazy["daily_field"] = compute_quality_daily_metric_field(da, pol_name, datetimes)
+
+    (computed,) = dask.compute(lazy)
+
+    domain_series = pd.Series(np.asarray(computed["domain_series"].values, dtype=float),
+                              index=datetimes)
+
+    bundle = {
+        "pol_name": pol_name,
+        "annual_map": computed["annual_map"],
+        "yearly_mean_maps": computed["yearly_mean_maps"],
+        "domain_series": domain_series,
+        "domain_mean": float(domain_series.mean()),
+        "daily_series": _daily_domain_metric(domain_series.values, datetimes, pol_name),
+        "daily_rule": rule,
+        "metric_label": get_quality_metric_label(pol_name),
+        "series_label": DAILY_SERIES_LABELS.get(rule, get_quality_metric_label(pol_name)),
+        "daily_field": None,
+        "daily_mean_map": None,
+    }
+
+    if rule is not None:
+        daily = computed["daily_field"]
+        bundle["daily_mean_map"] = daily.mean(dim="day", skipna=True).values
+        if keep_daily_field:
+            bundle["daily_field"] = daily
+
+    return bundle
+
+
+CONAMA_STAGE_COLORS = ["#b2182b", "#ef8a62", "#fddbc7", "#92c5de", "#2166ac"]
+
+
+def _plot_conama_compliance_panel(ax, fig, compliance, xlon, ylat, brazil):
+    """
+    Painel categórico da etapa CONAMA atendida (pior ano de cada pixel).
+    """
+    stages = str(compliance.attrs.get("stages", "PI-1,PI-2,PI-3,PF")).split(",")
+    labels = ["Acima do\nPI-1"] + stages
+
+    stage_met = compliance["stage_met"]
+    if "year" in stage_met.dims:
+        stage_met = stage_met.min(dim="year", skipna=True)
+    stage_arr = np.asarray(stage_met.values, dtype=float)
+
+    cmap = colors.ListedColormap(CONAMA_STAGE_COLORS[:len(labels)])
+    norm = colors.BoundaryNorm(np.arange(len(labels) + 1) - 0.5, cmap.N)
+
+    m = plot_grid_field(ax, xlon, ylat, stage_arr, cmap=cmap, norm=norm)
+    add_brazil_inverse_mask(ax=ax, brazil=brazil, xlon=xlon, ylat=ylat, pad=1.0)
+    brazil.boundary.plot(ax=ax, color="black", linewidth=0.8, zorder=10)
+
+    ax.set_xticks([])
+    ax.set_yticks([])
+    ax.set_aspect("equal")
+    ax.set_anchor("C")
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+
+    years = compliance["year"].values if "year" in compliance.dims else []
+    period = f"{years.min()}-{years.max()}" if len(years) > 1 else (str(years[0]) if len(years) else "")
+    ax.set_title(
+        f"CONAMA 491/2018 ({compliance.attrs.get('averaging', '')})\n"
+        f"Etapa mais restritiva atendida {period}".rstrip(),
+        fontsize=12,
+        fontweight="bold"
+    )
+
+    cbar = fig.colorbar(
+        m,
+        ax=ax,
+        orientation="horizontal",
+        fraction=0.035,
+        pad=0.07,
+        ticks=np.arange(len(labels))
+    )
+    cbar.ax.set_xticklabels(labels, fontsize=9)
+
+
+def plot_quality_legislative_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil, figpath,
+                                    compliance=None, bundle=None):
     """
     Figura 1x2 para qualidade do ar:
     - mapa da média anual
     - mapa da média da métrica diária regulatória
+
+    Com `compliance` (saída de functions_conama.compute_conama_metrics ou o
+    NetCDF gravado por write_conama_compliance), um terceiro painel mostra
+    a etapa mais restritiva da CONAMA 491/2018 atendida em todos os anos.
+
+    `bundle` (compute_quality_bundle) evita recalcular as métricas.
     """
-    datetimes = get_quality_datetimes(ds)
+    if bundle is None:
+        bundle = compute_quality_bundle(da, pol_name, get_quality_datetimes(ds),
+                                        keep_daily_field=False)
+    if bundle["daily_mean_map"] is None:
+        raise ValueError(f"Poluente {pol_name} não está definido em QUALITY_RULES.")
 
-    annual_map = compute_quality_annual_mean_map(da)
-    metric_map = compute_quality_daily_metric_mean_map(da, pol_name, datetimes)
-    daily_series, metric_label = compute_quality_daily_metric_series(da, pol_name, datetimes)
+    annual_map = bundle["annual_map"]
+    metric_map = bundle["daily_mean_map"]
+    metric_label = bundle["series_label"]
 
     annual_arr = np.asarray(annual_map, dtype=float)
     metric_arr = np.asarray(metric_map, dtype=float)
@@ -441,16 +649,17 @@ def plot_quality_legislative_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil,
     cmap = plt.colormaps["Spectral_r"].copy()
     norm = colors.LogNorm(vmin=vmin, vmax=vmax)
 
-    fig = plt.figure(figsize=(13, 6))
-    gs = gridspec.GridSpec(1, 2, figure=fig, wspace=0.12)
+    ncols = 2 if compliance is None else 3
+    fig = plt.figure(figsize=(6.5 * ncols, 6))
+    gs = gridspec.GridSpec(1, ncols, figure=fig, wspace=0.12)
 
     ax1 = fig.add_subplot(gs[0, 0])
     ax2 = fig.add_subplot(gs[0, 1])
 
     # mapa 1 - média anual
-    m1 = ax1.pcolormesh(
-        xlon, ylat, annual_arr,
-        cmap=cmap, norm=norm, shading="auto"
+    m1 = plot_grid_field(
+        ax1, xlon, ylat, annual_arr,
+        cmap=cmap, norm=norm
     )
     add_brazil_inverse_mask(ax=ax1, brazil=brazil, xlon=xlon, ylat=ylat, pad=1.0)
     brazil.boundary.plot(ax=ax1, color="black", linewidth=0.8, zorder=10)
@@ -466,9 +675,9 @@ def plot_quality_legislative_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil,
     )
 
     # mapa 2 - média da métrica diária regulatória
-    m2 = ax2.pcolormesh(
-        xlon, ylat, metric_arr,
-        cmap=cmap, norm=norm, shading="auto"
+    m2 = plot_grid_field(
+        ax2, xlon, ylat, metric_arr,
+        cmap=cmap, norm=norm
     )
     add_brazil_inverse_mask(ax=ax2, brazil=brazil, xlon=xlon, ylat=ylat, pad=1.0)
     brazil.boundary.plot(ax=ax2, color="black", linewidth=0.8, zorder=10)
@@ -496,6 +705,11 @@ def plot_quality_legislative_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil,
     )
     cbar.set_label(f"{pol_name} ({unit}) [log]")
 
+    # mapa 3 - conformidade CONAMA 491/2018
+    if compliance is not None:
+        ax3 = fig.add_subplot(gs[0, 2])
+        _plot_conama_compliance_panel(ax3, fig, compliance, xlon, ylat, brazil)
+
     fig.suptitle(
         f"Qualidade do ar - {pol_name}",
         fontsize=18,
@@ -503,12 +717,11 @@ def plot_quality_legislative_mosaic(da, ds, pol_name, unit, xlon, ylat, brazil,
         y=0.98
     )
 
-    plt.savefig(
+    finish_figure(
+        fig,
         os.path.join(figpath, f"quality_legislative_mosaic_{pol_name}.png"),
-        dpi=300,
         bbox_inches="tight"
     )
-    plt.show()
 
 
 
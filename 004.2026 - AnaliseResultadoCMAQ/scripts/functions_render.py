@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Renderização das figuras em lote.
+
+- finish_figure: salva, mostra (apenas no modo interativo) e fecha a figura.
+- set_headless: força o backend Agg, sem janelas (servidores/execução em lote).
+- render_figure_jobs: executa as funções de plotagem como tarefas, em série
+  ou em um pool de processos, pulando as que já estão atualizadas.
+
+Uma figura está atualizada quando a impressão digital das entradas (dados,
+parâmetros, código do módulo que define a função de plotagem e
+RENDER_VERSION) é igual à registrada no .render_manifest.json da pasta de
+saída e todos os arquivos gerados existem.
+Objetos lazy (dask) entram na impressão digital pelo token do grafo, que
+inclui caminho e mtime dos arquivos .nc, sem ler os dados.
+"""
+
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+import matplotlib.pyplot as plt
+from dask.base import tokenize
+
+
+#%% ── modo sem janelas ───────────────────────────────────────────────────────
+
+# HEADLESS=1 (execução em lote/servidor) liga o modo sem janelas na importação
+_HEADLESS = os.environ.get("HEADLESS", "0") == "1"
+
+# arquivos salvos por finish_figure desde o último _collect_rendered()
+_RENDERED = []
+
+MANIFEST_NAME = ".render_manifest.json"
+
+# incrementar ao mudar algo que afete as figuras fora do módulo da função de
+# plotagem (ex.: finish_figure, estilo do matplotlib): refaz todas as figuras
+RENDER_VERSION = 1
+
+# hash do código-fonte por módulo, calculado uma vez por processo
+_MODULE_HASHES = {}
+
+
+def set_headless(enabled=True):
+    """
+    Liga/desliga o modo sem janelas. Ligado, usa o backend Agg e
+    finish_figure não chama plt.show().
+    """
+    global _HEADLESS
+    _HEADLESS = enabled
+    if enabled:
+        matplotlib.use("Agg")
+
+
+if _HEADLESS:
+    set_headless(True)
+
+
+def is_headless():
+    return _HEADLESS
+
+
+def finish_figure(fig, path, dpi=300, **savefig_kwargs):
+    """
+    Salva a figura em `path`, mostra apenas no modo interativo e sempre
+    fecha a figura, para não acumular figuras abertas em execuções longas.
+    """
+    fig.savefig(path, dpi=dpi, **savefig_kwargs)
+    _RENDERED.append(os.path.abspath(path))
+
+    if not _HEADLESS:
+        plt.show()
+
+    plt.close(fig)
+
+
+def _collect_rendered():
+    paths = list(_RENDERED)
+    _RENDERED.clear()
+    return paths
+
+
+#%% ── impressão digital e manifest ──────────────────────────────────────────
+
+def _module_source_hash(plot_func):
+    """
+    SHA-1 do código do módulo que define `plot_func`: mudanças em funções
+    auxiliares do mesmo módulo (eixos, escalas, rótulos) também invalidam
+    as figuras. Sem o arquivo-fonte, usa só o código da própria função.
+    """
+    module = inspect.getmodule(plot_func)
+    name = getattr(module, "__name__", None)
+
+    if name not in _MODULE_HASHES:
+        try:
+            source = inspect.getsource(module if module is not None else plot_func)
+        except (OSError, TypeError):
+            try:
+                source = inspect.getsource(plot_func)
+            except (OSError, TypeError):
+                source = plot_func.__qualname__
+        _MODULE_HASHES[name] = hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+    return _MODULE_HASHES[name]
+
+
+def figure_fingerprint(plot_func, kwargs):
+    """
+    Impressão digital de uma tarefa: código do módulo da função,
+    RENDER_VERSION e todos os argumentos.
+    """
+    code_hash = _module_source_hash(plot_func)
+    return tokenize(RENDER_VERSION, code_hash, plot_func.__qualname__, sorted(kwargs.items()))
+
+
+def _job_key(plot_func, kwargs):
+    """
+    Identifica a tarefa no manifest pelo nome da função e pelos argumentos
+    textuais (poluente, unidade, fonte...).
+    """
+    labels = [
+        f"{k}={v}" for k, v in sorted(kwargs.items())
+        if isinstance(v, str) and k != "figpath"
+    ]
+    return "|".join([plot_func.__name__] + labels)
+
+
+def _manifest_path(figpath):
+    return os.path.join(figpath, MANIFEST_NAME)
+
+
+def load_render_manifest(figpath):
+    path = _manifest_path(figpath)
+    if not os.path.isfile(path):
+        return {}
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f"Aviso: manifest de figuras ilegível, refazendo todas: {path}")
+        return {}
+
+
+def save_render_manifest(figpath, manifest):
+    os.makedirs(figpath, exist_ok=True)
+    tmp = _manifest_path(figpath) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, ensure_ascii=False)
+    os.replace(tmp, _manifest_path(figpath))
+
+
+def _is_current(entry, fingerprint, figpath):
+    if not entry or entry.get("fingerprint") != fingerprint:
+        return False
+    outputs = entry.get("outputs", [])
+    return bool(outputs) and all(
+        os.path.isfile(os.path.join(figpath, name)) for name in outputs
+    )
+
+
+#%% ── execução das tarefas ──────────────────────────────────────────────────
+
+def _init_render_worker():
+    set_headless(True)
+
+
+def _run_figure_job(plot_func, kwargs):
+    """
+    Executa uma função de plotagem e retorna (resultado, arquivos gerados).
+    """
+    _collect_rendered()
+    result = plot_func(**kwargs)
+    return result, _collect_rendered()
+
+
+def render_figure_jobs(jobs, figpath, max_workers=1, force=False, verbose=True):
+    """
+    Executa as tarefas de plotagem de uma pasta de saída.
+
+    jobs: lista de (funcao_de_plotagem, kwargs). Todas as tarefas devem
+    salvar em `figpath` (via finish_figure).
+
+    Tarefas cujas entradas não mudaram desde a última execução são puladas
+    (a menos que force=True). Com max_workers > 1 as tarefas rodam em um
+    pool de processos com backend Agg; o script chamador precisa então
+    estar protegido por `if __name__ == "__main__":`.
+
+    Retorna {chave_da_tarefa: retorno da função}; tarefas puladas ou com
+    erro não aparecem.
+    """
+    manifest = load_render_manifest(figpath)
+    pending = []
+    skipped = 0
+
+    for plot_func, kwargs in jobs:
+        key = _job_key(plot_func, kwargs)
+        fingerprint = figure_fingerprint(plot_func, kwargs)
+
+        if not force and _is_current(manifest.get(key), fingerprint, figpath):
+            skipped += 1
+            continue
+
+        pending.append((key, fingerprint, plot_func, kwargs))
+
+    if verbose:
+        print(f"Figuras em {figpath}: {len(pending)} a gerar, {skipped} atualizada(s).")
+
+    results = {}
+
+    def _record(key, fingerprint, value):
+        result, outputs = value
+        results[key] = result
+        manifest[key] = {
+            "fingerprint": fingerprint,
+            "outputs": sorted(os.path.basename(p) for p in outputs),
+        }
+
+    parallel = (max_workers is None or max_workers > 1) and len(pending) > 1
+
+    if parallel:
+        # spawn: processos novos, sem herdar locks de threads dask/HDF5 do pai
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_render_worker
+        ) as pool:
+            futures = {
+                pool.submit(_run_figure_job, plot_func, kwargs): (key, fingerprint)
+                for key, fingerprint, plot_func, kwargs in pending
+            }
+            for fut in as_completed(futures):
+                key, fingerprint = futures[fut]
+                try:
+                    _record(key, fingerprint, fut.result())
+                except Exception as e:
+                    manifest.pop(key, None)
+                    print(f"Erro ao gerar figura {key}: {e}")
+    else:
+        for key, fingerprint, plot_func, kwargs in pending:
+            try:
+                _record(key, fingerprint, _run_figure_job(plot_func, kwargs))
+            except Exception as e:
+                manifest.pop(key, None)
+                plt.close("all")
+                print(f"Erro ao gerar figura {key}: {e}")
+
+    save_render_manifest(figpath, manifest)
+    return results
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Comparação entre dois cenários de qualidade do ar do CMAQ (por exemplo,
+quality_finn contra um caso base sem queimadas).
+
+As duas pastas são abertas de forma preguiçosa, conferidas (LAT/LON iguais)
+e alinhadas pelo tempo (TFLAG). Para cada poluente, em um único
+dask.compute, são calculadas na camada superficial:
+- média do período de cada cenário e diferenças absoluta e relativa;
+- média da métrica diária regulatória (QUALITY_RULES) de cada cenário e
+  diferenças absoluta e relativa;
+- série diária da métrica no domínio para os dois cenários;
+- por macro-região (índice célula → região em cache), médias dos dois
+  cenários e a participação da diferença na concentração do cenário.
+
+Tudo é reduzido bloco a bloco; nenhum dos cenários é carregado inteiro.
+"""
+
+import glob
+import os
+
+import dask
+import matplotlib.colors as colors
+import matplotlib.gridspec as gridspec
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from functions_emissions import add_brazil_inverse_mask, aggregate_by_region, plot_grid_field
+from functions_quality import (
+    QUALITY_RULES,
+    _daily_domain_metric,
+    compute_quality_daily_metric_field,
+    get_quality_datetimes,
+    get_quality_pollutants,
+    get_quality_metric_label,
+)
+from functions_render import finish_figure
+
+
+#%% ── abertura e alinhamento ────────────────────────────────────────────────
+
+def open_quality_folder(path):
+    """
+    Abre (preguiçoso) todos os .nc de uma pasta de qualidade.
+    """
+    files = sorted(glob.glob(os.path.join(path, "*.nc")))
+    if not files:
+        raise FileNotFoundError(f"Nenhum arquivo .nc encontrado em: {path}")
+
+    # LAT/LON ficam 2D (não são concatenados ao longo de TSTEP)
+    return xr.open_mfdataset(files, combine="by_coords", data_vars="minimal")
+
+
+def align_quality_scenarios(ds_case, ds_base, atol=1e-4):
+    """
+    Confere o grid dos dois cenários e alinha os instantes de TFLAG.
+
+    LAT/LON precisam coincidir (até `atol` graus). Se os TFLAG forem
+    diferentes, só os instantes comuns são usados (com aviso); sem nenhum
+    instante comum, um ValueError é levantado.
+
+    Retorna (ds_case, ds_base, datetimes, pollutants), com TSTEP indexado
+    pelas datas e apenas os poluentes presentes nos dois cenários.
+    """
+    for coord in ["LAT", "LON"]:
+        a = np.asarray(ds_case[coord].values, dtype=float)
+        b = np.asarray(ds_base[coord].values, dtype=float)
+        if a.shape != b.shape or not np.allclose(a, b, atol=atol, equal_nan=True):
+            raise ValueError(f"Os cenários não têm o mesmo grid ({coord} diferente).")
+
+    ds_case = ds_case.assign_coords(TSTEP=get_quality_datetimes(ds_case).values)
+    ds_base = ds_base.assign_coords(TSTEP=get_quality_datetimes(ds_base).values)
+
+    if not ds_case.indexes["TSTEP"].equals(ds_base.indexes["TSTEP"]):
+        n_case, n_base = ds_case.sizes["TSTEP"], ds_base.sizes["TSTEP"]
+        ds_case, ds_base = xr.align(ds_case, ds_base, join="inner", exclude=["ROW", "COL", "LAY"])
+        if ds_case.sizes["TSTEP"] == 0:
+            raise ValueError("Os cenários não têm nenhum instante de TFLAG em comum.")
+        print(
+            f"Aviso: TFLAG diferente entre os cenários ({n_case} x {n_base} instantes); "
+            f"usando {ds_case.sizes['TSTEP']} instantes comuns."
+        )
+
+    pollutants = [p for p in get_quality_pollutants(ds_case) if p in get_quality_pollutants(ds_base)]
+    missing = sorted(set(get_quality_pollutants(ds_case)) ^ set(get_quality_pollutants(ds_base)))
+    if missing:
+        print(f"Aviso: poluentes presentes em só um cenário foram ignorados: {missing}")
+
+    return ds_case, ds_base, ds_case.indexes["TSTEP"], pollutants
+
+
+#%% ── diferenças entre cenários ─────────────────────────────────────────────
+
+def _relative_difference(case, base):
+    """
+    Diferença relativa (%) em relação ao caso base; NaN onde base <= 0.
+    """
+    return 100 * (case - base) / base.where(base > 0)
+
+
+def compute_scenario_differences(da_case, da_base, pol_name, datetimes, region_index=None):
+    """
+    Diferenças entre dois cenários de um poluente (caso - base) na camada
+    superficial, em um único dask.compute.
+
+    Retorna um dicionário com:
+    - "annual": Dataset (ROW, COL) com case, base, abs_diff e rel_diff (%)
+      da média do período
+    - "daily_metric": idem para a média da métrica diária regulatória
+      (None se o poluente não estiver em QUALITY_RULES)
+    - "daily_series": DataFrame diário com a métrica diária da série média
+      do domínio (case, base, abs_diff), como o daily_series de
+      compute_quality_bundle
+    - "region": DataFrame por macro-região com as médias dos cenários, a
+      diferença e a participação (%) da diferença na média do caso
+      (None sem region_index)
+    """
+    datetimes = pd.DatetimeIndex(datetimes)
+
+    surface = {
+        name: (da.isel(LAY=0) if "LAY" in da.dims else da).assign_coords(TSTEP=datetimes.values)
+        for name, da in [("case", da_case), ("base", da_base)]
+    }
+
+    lazy = {}
+    for name, da in surface.items():
+        lazy[f"annual_{name}"] = da.mean(dim="TSTEP")
+
+    has_rule = pol_name in QUALITY_RULES
+    if has_rule:
+        daily = {
+            name: compute_quality_daily_metric_field(da, pol_name, datetimes)
+            for name, da in [("case", da_case), ("base", da_base)]
+        }
+        for name, cube in daily.items():
+            lazy[f"daily_map_{name}"] = cube.mean(dim="day", skipna=True)
+        for name, da in surface.items():
+            lazy[f"domain_{name}"] = da.mean(dim=[d for d in da.dims if d != "TSTEP"])
+
+    if region_index is not None:
+        for name in ["case", "base"]:
+            lazy[f"region_{name}"] = aggregate_by_region(lazy[f"annual_{name}"], region_index)
+
+    (computed,) = dask.compute(lazy)
+
+    def _diff_dataset(case, base):
+        return xr.Dataset({
+            "case": case,
+            "base": base,
+            "abs_diff": case - base,
+            "rel_diff": _relative_difference(case, base),
+        })
+
+    result = {
+        "pol_name": pol_name,
+        "annual": _diff_dataset(computed["annual_case"], computed["annual_base"]),
+        "daily_metric": None,
+        "daily_series": None,
+        "region": None,
+    }
+
+    if has_rule:
+        result["daily_metric"] = _diff_dataset(computed["daily_map_case"], computed["daily_map_base"])
+        # métrica diária da série do domínio (e não a média espacial das
+        # métricas por célula), igual ao main_quality
+        series = pd.DataFrame({
+            name: _daily_domain_metric(computed[f"domain_{name}"].values, datetimes, pol_name)
+            for name in ["case", "base"]
+        })
+        series["abs_diff"] = series["case"] - series["base"]
+        result["daily_series"] = series
+
+    if region_index is not None:
+        n_cells = np.where(region_index["n_cells"] > 0, region_index["n_cells"], np.nan)
+        region = pd.DataFrame({
+            "case": computed["region_case"].values / n_cells,
+            "base": computed["region_base"].values / n_cells,
+        }, index=pd.Index(region_index["names"], name="region"))
+        region["abs_diff"] = region["case"] - region["base"]
+        region["share_pct"] = 100 * region["abs_diff"] / region["case"].where(region["case"] > 0)
+        result["region"] = region
+
+    return result
+
+
+#%% ── figuras ───────────────────────────────────────────────────────────────
+
+def _symmetric_limit(arr, q=99):
+    """
+    Limite simétrico da escala divergente (percentil de |arr|).
+    """
+    arr = np.abs(np.asarray(arr, dtype=float))
+    arr = arr[np.isfinite(arr)]
+    if arr.size == 0:
+        return 1.0
+    vmax = float(np.percentile(arr, q))
+    return vmax if vmax > 0 else 1.0
+
+
+def plot_scenario_difference_mosaic(result, pol_name, unit, xlon, ylat, brazil, figpath,
+                                    case_label="Caso", base_label="Base"):
+    """
+    Mosaico 2x2 das diferenças (caso - base): absoluta e relativa da média
+    do período e da média da métrica diária regulatória.
+    """
+    rows = [("Média do período", result["annual"])]
+    if result["daily_metric"] is not None:
+        rows.append((f"{get_quality_metric_label(pol_name)} (média)", result["daily_metric"]))
+
+    cmap = plt.colormaps["RdBu_r"].copy()
+
+    fig = plt.figure(figsize=(13, 6 * len(rows)))
+    gs = gridspec.GridSpec(len(rows), 2, figure=fig, wspace=0.12, hspace=0.4)
+
+    for i, (title, ds_diff) in enumerate(rows):
+        panels = [
+            ("abs_diff", f"{title}\nDiferença absoluta", unit, f"{pol_name} ({unit})"),
+            ("rel_diff", f"{title}\nDiferença relativa", "%", "%"),
+        ]
+        for j, (var, panel_title, panel_unit, label) in enumerate(panels):
+            ax = fig.add_subplot(gs[i, j])
+            arr = np.asarray(ds_diff[var].values, dtype=float)
+
+            vmax = _symmetric_limit(arr)
+            norm = colors.TwoSlopeNorm(vmin=-vmax, vcenter=0.0, vmax=vmax)
+
+            m = plot_grid_field(ax, xlon, ylat, arr, cmap=cmap, norm=norm)
+            add_brazil_inverse_mask(ax=ax, brazil=brazil, xlon=xlon, ylat=ylat, pad=1.0)
+            brazil.boundary.plot(ax=ax, color="black", linewidth=0.8, zorder=10)
+
+            ax.set_xticks([])
+            ax.set_yticks([])
+            ax.set_xlabel("")
+            ax.set_ylabel("")
+            ax.set_aspect("equal")
+            ax.set_anchor("C")
+            for spine in ax.spines.values():
+                spine.set_visible(False)
+
+            ax.set_title(
+                f"{panel_title}\nMédia do domínio = {np.nanmean(arr):.3f} {panel_unit}",
+                fontsize=12,
+                fontweight="bold"
+            )
+
+            cbar = fig.colorbar(m, ax=ax, orientation="horizontal", fraction=0.035, pad=0.07,
+                                extend="both")
+            cbar.set_label(label)
+
+    fig.suptitle(
+        f"Qualidade do ar - {pol_name}: {case_label} - {base_label}",
+        fontsize=18,
+        fontweight="bold",
+        y=0.99
+    )
+
+    finish_figure(
+        fig,
+        os.path.join(figpath, f"scenario_difference_mosaic_{pol_name}.png"),
+        bbox_inches="tight"
+    )
+
+
+def plot_scenario_region_share(result, pol_name, unit, figpath, case_label="Caso",
+                               base_label="Base"):
+    """
+    Barras por macro-região: médias dos dois cenários e participação (%) da
+    diferença na média do caso.
+    """
+    region = result["region"]
+    if region is None:
+        raise ValueError("Resultado sem tabela por macro-região (region_index ausente).")
+
+    region = region.sort_values("share_pct", ascending=False)
+    x = np.arange(len(region))
+
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5.5))
+
+    width = 0.38
+    ax1.bar(x - width / 2, region["base"], width, label=base_label, color="#9e9e9e")
+    ax1.bar(x + width / 2, region["case"], width, label=case_label, color="#d6604d")
+    ax1.set_xticks(x)
+    ax1.set_xticklabels(region.index, rotation=20)
+    ax1.set_ylabel(f"{pol_name} ({unit})")
+    ax1.set_title("Média do período por macro-região", fontsize=13, fontweight="bold")
+    ax1.legend(frameon=False)
+
+    ax2.bar(x, region["share_pct"], color="#2166ac")
+    for xi, val in zip(x, region["share_pct"]):
+        if np.isfinite(val):
+            ax2.text(xi, val, f"{val:.1f}%", ha="center", va="bottom", fontsize=9)
+    ax2.axhline(0, color="black", linewidth=0.8)
+    ax2.set_xticks(x)
+    ax2.set_xticklabels(region.index, rotation=20)
+    ax2.set_ylabel("%")
+    ax2.set_title(f"Participação de ({case_label} - {base_label})", fontsize=13, fontweight="bold")
+
+    for ax in [ax1, ax2]:
+        ax.grid(True, axis="y", linestyle="--", alpha=0.35)
+        for spine in ["top", "right"]:
+            ax.spines[spine].set_visible(False)
+
+    fig.suptitle(f"Qualidade do ar - {pol_name}", fontsize=18, fontweight="bold", y=1.0)
+
+    finish_figure(
+        fig,
+        os.path.join(figpath, f"scenario_region_share_{pol_name}.png"),
+        bbox_inches="tight"
+    )
@@ -0,0 +1,587 @@
+# -*- coding: utf-8 -*-
+"""
+Armazenamento em disco dos agregados de emissão (cubo pré-agregado).
+
+Para cada fonte e poluente são gravadas partições mensais em NetCDF4 com:
+- lay_map: soma no tempo por camada (LAY, ROW, COL)
+- domain_series: total do domínio em cada instante (TSTEP)
+- region_lay: soma por macro-região e camada (region, LAY)
+
+Os mapas anuais e as tabelas região x camada x ano são derivados das
+partições. Os cubos de perfis temporais por célula (hora, dia da semana,
+mês) ficam em {fonte}/perfis_temporais/{poluente}.nc e os cubos de injeção
+região x camada x hora/mês em {fonte}/injecao/{poluente}.nc. A atualização é incremental: um manifest.json guarda mtime,
+tamanho e intervalo do TFLAG de cada arquivo .nc, e só os meses tocados por
+arquivos novos, alterados ou removidos são recalculados. Poluentes sem
+espécies em um mês (ex.: CO em windblow) ficam registrados em "absent" no
+manifest e não são recalculados até o mês mudar.
+
+Os produtos da comparação entre fontes (mapa total, série do domínio e
+média anual por macro-região) ficam em um armazenamento próprio, só de
+acréscimo, com um NetCDF versionado por fonte x poluente e funções de
+consulta (list_comparison_products, query_comparison_inputs).
+"""
+
+import hashlib
+import json
+import os
+
+import dask
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from functions_emissions import (
+    aggregate_by_region,
+    attach_ioapi_time,
+    build_pollutant,
+    compute_region_injection_cubes,
+    compute_temporal_profile_cubes,
+    decode_ioapi_tflag,
+    get_required_species,
+    open_emission_dataset,
+    resolve_pollutant_species,
+)
+
+
+#%% ── manifest ───────────────────────────────────────────────────────────────
+
+def _manifest_path(source_store):
+    return os.path.join(source_store, "manifest.json")
+
+
+def load_store_manifest(source_store):
+    path = _manifest_path(source_store)
+    if not os.path.isfile(path):
+        return {"files": {}, "pollutants": {}, "region_key": None, "absent": {}}
+
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_store_manifest(source_store, manifest):
+    os.makedirs(source_store, exist_ok=True)
+    tmp = _manifest_path(source_store) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, ensure_ascii=False)
+    os.replace(tmp, _manifest_path(source_store))
+
+
+def _file_months(path):
+    """
+    Lê apenas o TFLAG de um arquivo e retorna (início, fim, meses cobertos).
+    """
+    with xr.open_dataset(path) as ds_file:
+        tflag = ds_file["TFLAG"]
+        if "VAR" in tflag.dims:
+            tflag = tflag.isel(VAR=0)
+        datetimes = pd.DatetimeIndex(decode_ioapi_tflag(tflag.values))
+
+    months = sorted(set(datetimes.strftime("%Y-%m")))
+    return str(datetimes.min()), str(datetimes.max()), months
+
+
+def _partition_path(source_store, pol_name, month):
+    return os.path.join(source_store, pol_name, f"{month}.nc")
+
+
+#%% ── atualização incremental ───────────────────────────────────────────────
+
+def _compute_month_partitions(files, month, pollutants, pollutant_specs, region_index):
+    """
+    Calcula as partições de um mês para todos os poluentes com um único
+    dask.compute sobre os arquivos que tocam o mês.
+    """
+    required = get_required_species(pollutant_specs, pollutants)
+    source = open_emission_dataset(files, required_vars=required, verbose=False)
+    ds = attach_ioapi_time(source)
+
+    in_month = pd.DatetimeIndex(ds["TSTEP"].values).strftime("%Y-%m") == month
+    ds = ds.isel(TSTEP=np.flatnonzero(in_month))
+
+    cache = {}
+    lazy = {}
+    for pol in pollutants:
+        da, _, _ = build_pollutant(ds, pol, pollutant_specs, verbose=False, cache=cache)
+        if da is None:
+            continue
+        if "LAY" not in da.dims:
+            da = da.expand_dims("LAY")
+
+        lazy[pol] = (
+            da.sum(dim="TSTEP"),
+            da.sum(dim=[d for d in da.dims if d != "TSTEP"]),
+        )
+
+    (computed,) = dask.compute(lazy)
+    source.close()
+
+    partitions = {}
+    for pol, (lay_map, domain_series) in computed.items():
+        region_lay = aggregate_by_region(lay_map, region_index)
+        partitions[pol] = xr.Dataset(
+            {
+                "lay_map": lay_map.astype("float64"),
+                "domain_series": domain_series.astype("float64"),
+                "region_lay": region_lay.astype("float64"),
+            },
+            attrs={"month": month, "n_files": len(files)},
+        )
+
+    return partitions
+
+
+def update_emission_store(store_path, source_name, files, pollutants, pollutant_specs,
+                          region_index, verbose=True):
+    """
+    Atualiza o cubo pré-agregado de uma fonte.
+
+    Só os meses cobertos por arquivos novos, alterados (mtime/tamanho) ou
+    removidos são recalculados, além dos meses de poluentes cuja definição
+    mudou. Se o índice regional mudou (outro grid/shapefile), tudo é refeito.
+
+    Retorna a lista de meses recalculados.
+    """
+    source_store = os.path.join(store_path, source_name)
+    manifest = load_store_manifest(source_store)
+
+    # meses sem partição porque o poluente não existe na fonte naquele mês
+    absent = {pol: set(months) for pol, months in manifest.get("absent", {}).items()}
+
+    old_files = manifest["files"]
+    new_files = {}
+    dirty = set()
+
+    for path in files:
+        name = os.path.basename(path)
+        stat = os.stat(path)
+        entry = old_files.get(name)
+
+        if entry is not None and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            new_files[name] = entry
+            continue
+
+        start, end, months = _file_months(path)
+        new_files[name] = {
+            "path": path,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "start": start,
+            "end": end,
+            "months": months,
+        }
+        dirty.update(months)
+        if entry is not None:
+            dirty.update(entry["months"])
+
+    for name, entry in old_files.items():
+        if name not in new_files:
+            dirty.update(entry["months"])
+
+    all_months = sorted({m for entry in new_files.values() for m in entry["months"]})
+
+    if manifest.get("region_key") != region_index["key"]:
+        dirty.update(all_months)
+
+    for pol in pollutants:
+        species = resolve_pollutant_species(pol, pollutant_specs)
+        if manifest["pollutants"].get(pol) != species:
+            dirty.update(all_months)
+        else:
+            pol_absent = absent.get(pol, set())
+            dirty.update(
+                m for m in all_months
+                if m not in pol_absent
+                and not os.path.isfile(_partition_path(source_store, pol, m))
+            )
+
+    dirty = sorted(dirty)
+
+    if verbose:
+        print(f"Cubo {source_name}: {len(all_months)} mês(es), {len(dirty)} a recalcular.")
+
+    for month in dirty:
+        month_files = sorted(
+            entry["path"] for entry in new_files.values() if month in entry["months"]
+        )
+
+        if not month_files:
+            for pol in pollutants:
+                path = _partition_path(source_store, pol, month)
+                if os.path.isfile(path):
+                    os.remove(path)
+                absent.get(pol, set()).discard(month)
+            continue
+
+        if verbose:
+            print(f"  {month}: {len(month_files)} arquivo(s)")
+
+        partitions = _compute_month_partitions(
+            month_files, month, pollutants, pollutant_specs, region_index
+        )
+
+        for pol in pollutants:
+            path = _partition_path(source_store, pol, month)
+
+            if pol not in partitions:
+                # poluente ausente no mês: sem partição, lembrado no manifest
+                absent.setdefault(pol, set()).add(month)
+                if os.path.isfile(path):
+                    os.remove(path)
+                continue
+
+            absent.get(pol, set()).discard(month)
+            part = partitions[pol]
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            encoding = {v: {"zlib": True, "complevel": 4} for v in part.data_vars}
+            part.to_netcdf(path + ".tmp", encoding=encoding)
+            os.replace(path + ".tmp", path)
+
+    manifest["files"] = new_files
+    manifest["region_key"] = region_index["key"]
+    manifest["pollutants"] = {
+        pol: resolve_pollutant_species(pol, pollutant_specs) for pol in pollutants
+    }
+    manifest["absent"] = {
+        pol: sorted(m for m in absent[pol] if m in all_months)
+        for pol in pollutants if absent.get(pol)
+    }
+    save_store_manifest(source_store, manifest)
+
+    return dirty
+
+
+#%% ── leitura ────────────────────────────────────────────────────────────────
+
+def load_emission_products(store_path, source_name, pol_name):
+    """
+    Monta, a partir das partições em disco, o mesmo dicionário de
+    compute_emission_products, para ser passado em `products` às funções de
+    plotagem. Retorna None se o poluente não existir no cubo.
+    """
+    pol_store = os.path.join(store_path, source_name, pol_name)
+    if not os.path.isdir(pol_store):
+        return None
+
+    months = sorted(f[:-3] for f in os.listdir(pol_store) if f.endswith(".nc"))
+    if not months:
+        return None
+
+    parts = []
+    for month in months:
+        with xr.open_dataset(os.path.join(pol_store, f"{month}.nc")) as part:
+            parts.append(part.load())
+
+    month_years = np.array([int(m[:4]) for m in months])
+    unique_years = np.unique(month_years)
+
+    lay_stack = xr.concat([p["lay_map"] for p in parts], dim="month")
+    region_stack = xr.concat([p["region_lay"] for p in parts], dim="month")
+    month_year = xr.DataArray(month_years, dims="month", name="year")
+
+    lay_map = lay_stack.sum(dim="month")
+    yearly_maps = lay_stack.sum(dim="LAY").groupby(month_year).sum(dim="month")
+    region_lay_year = region_stack.groupby(month_year).sum(dim="month")
+
+    domain_series = xr.concat([p["domain_series"] for p in parts], dim="TSTEP")
+
+    region_year = region_lay_year.sum(dim="LAY")
+    annual_df = pd.DataFrame(
+        region_year.transpose("year", "region").values,
+        index=unique_years,
+        columns=region_year["region"].values
+    )
+
+    return {
+        "datetimes": pd.DatetimeIndex(domain_series["TSTEP"].values),
+        "lay_map": lay_map,
+        "map": lay_map.sum(dim="LAY"),
+        "domain_series": domain_series,
+        "years": unique_years,
+        "yearly_maps": yearly_maps,
+        "yearly_totals": yearly_maps.sum(dim=["ROW", "COL"]).values.astype(float),
+        "region_lay": region_stack.sum(dim="month"),
+        "region_lay_year": region_lay_year,
+        "region_annual_mean": annual_df.mean(axis=0, skipna=True).fillna(0.0),
+    }
+
+
+#%% ── cubos de perfis temporais por célula ──────────────────────────────────
+
+def _files_signature(files, species):
+    """
+    Resumo (nome, mtime, tamanho) dos arquivos de entrada e das espécies.
+    """
+    h = hashlib.sha1()
+    for path in sorted(files):
+        stat = os.stat(path)
+        h.update(f"{os.path.basename(path)}|{stat.st_mtime}|{stat.st_size};".encode())
+    h.update("|".join(species).encode())
+    return h.hexdigest()[:16]
+
+
+def update_temporal_profile_cubes(store_path, source_name, pol_name, da, files,
+                                  pollutant_specs, region_index=None, verbose=True):
+    """
+    Retorna os cubos de perfis temporais por célula de uma fonte/poluente,
+    recalculando-os (compute_temporal_profile_cubes) apenas se os arquivos
+    de entrada, a definição do poluente ou o índice regional mudaram desde a
+    última gravação. Com `region_index`, os cubos trazem o mínimo/máximo
+    exato do total de cada macro-região.
+    """
+    path = os.path.join(store_path, source_name, "perfis_temporais", f"{pol_name}.nc")
+    species = resolve_pollutant_species(pol_name, pollutant_specs)
+    region_key = region_index["key"] if region_index is not None else "sem-regiao"
+    signature = _files_signature(files, species + [region_key])
+
+    if os.path.isfile(path):
+        with xr.open_dataset(path) as cached:
+            if cached.attrs.get("signature") == signature:
+                if verbose:
+                    print(f"Perfis temporais de {pol_name} atualizados em disco.")
+                return cached.load()
+
+    cubes = compute_temporal_profile_cubes(da, verbose=verbose, region_index=region_index)
+    cubes.attrs["signature"] = signature
+
+    # somas em float64 (a média = soma / contagem perde precisão em float32
+    # com muitos passos); mínimo/máximo em float32. A conversão é feita antes
+    # de gravar, para que o retorno seja igual ao que se lê do disco depois
+    for var in cubes.data_vars:
+        if var.endswith(("_min", "_max")):
+            cubes[var] = cubes[var].astype("float32")
+    encoding = {var: {"zlib": True, "complevel": 4} for var in cubes.data_vars}
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cubes.to_netcdf(path + ".tmp", encoding=encoding)
+    os.replace(path + ".tmp", path)
+
+    return cubes
+
+
+def update_region_injection_cubes(store_path, source_name, pol_name, da, files,
+                                  pollutant_specs, region_index, verbose=True):
+    """
+    Retorna os cubos de injeção região x camada x hora/mês de uma
+    fonte/poluente, recalculando-os (compute_region_injection_cubes) apenas
+    se os arquivos de entrada, a definição do poluente ou o índice regional
+    mudaram desde a última gravação.
+    """
+    path = os.path.join(store_path, source_name, "injecao", f"{pol_name}.nc")
+    species = resolve_pollutant_species(pol_name, pollutant_specs)
+    signature = _files_signature(files, species + [region_index["key"]])
+
+    if os.path.isfile(path):
+        with xr.open_dataset(path) as cached:
+            if cached.attrs.get("signature") == signature:
+                if verbose:
+                    print(f"Cubos de injeção de {pol_name} atualizados em disco.")
+                return cached.load()
+
+    cubes = compute_region_injection_cubes(da, region_index)
+    cubes.attrs["signature"] = signature
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    encoding = {v: {"zlib": True, "complevel": 4} for v in cubes.data_vars}
+    cubes.to_netcdf(path + ".tmp", encoding=encoding)
+    os.replace(path + ".tmp", path)
+
+    return cubes
+
+
+#%% ── produtos da comparação entre fontes ───────────────────────────────────
+
+# cada gravação vira um novo arquivo v0001.nc, v0002.nc... (apenas acréscimo);
+# uma gravação idêntica à última versão não gera arquivo novo
+COMPARISON_FIELDS = ("map", "xlon", "ylat", "time", "values", "region_mean")
+
+
+def _comparison_dir(store_path, source_name, pol_name):
+    return os.path.join(store_path, source_name, pol_name)
+
+
+def _comparison_versions(product_dir):
+    if not os.path.isdir(product_dir):
+        return []
+    return sorted(
+        int(f[1:-3]) for f in os.listdir(product_dir)
+        if f.startswith("v") and f.endswith(".nc") and f[1:-3].isdigit()
+    )
+
+
+def _comparison_hash(ds_product):
+    h = hashlib.sha1()
+    for name in sorted(ds_product.variables):
+        h.update(name.encode())
+        values = ds_product[name].values
+        if values.dtype.kind in "OUS":
+            h.update("|".join(map(str, values)).encode())
+        else:
+            h.update(np.ascontiguousarray(values).tobytes())
+    return h.hexdigest()[:16]
+
+
+def write_comparison_product(store_path, source_name, pol_name, product):
+    """
+    Grava o produto de comparação de uma fonte/poluente (dicionário com
+    map, xlon, ylat, time, values e region_mean, como devolvido por
+    process_emission_source) como nova versão em
+    {store}/{fonte}/{poluente}/vNNNN.nc.
+
+    Retorna o caminho da versão gravada (ou da última, se o conteúdo não
+    mudou).
+    """
+    region_mean = pd.Series(product["region_mean"], dtype=float)
+
+    ds_product = xr.Dataset(
+        {
+            "map": (("ROW", "COL"), np.asarray(product["map"], dtype="float64")),
+            "xlon": (("ROW", "COL"), np.asarray(product["xlon"], dtype="float64")),
+            "ylat": (("ROW", "COL"), np.asarray(product["ylat"], dtype="float64")),
+            "values": (("TSTEP",), np.asarray(product["values"], dtype="float64")),
+            "region_mean": (("region",), region_mean.values),
+        },
+        coords={
+            "TSTEP": pd.DatetimeIndex(product["time"]).values,
+            "region": region_mean.index.astype(str).values,
+        },
+    )
+    content_hash = _comparison_hash(ds_product)
+
+    product_dir = _comparison_dir(store_path, source_name, pol_name)
+    versions = _comparison_versions(product_dir)
+
+    if versions:
+        last = os.path.join(product_dir, f"v{versions[-1]:04d}.nc")
+        with xr.open_dataset(last) as previous:
+            if previous.attrs.get("content_hash") == content_hash:
+                return last
+
+    version = versions[-1] + 1 if versions else 1
+    ds_product.attrs = {
+        "source": source_name,
+        "pollutant": pol_name,
+        "version": version,
+        "created": pd.Timestamp.now().isoformat(timespec="seconds"),
+        "content_hash": content_hash,
+    }
+
+    path = os.path.join(product_dir, f"v{version:04d}.nc")
+    os.makedirs(product_dir, exist_ok=True)
+    encoding = {v: {"zlib": True, "complevel": 4} for v in ds_product.data_vars}
+    ds_product.to_netcdf(path + ".tmp", encoding=encoding)
+    os.replace(path + ".tmp", path)
+
+    return path
+
+
+def list_comparison_products(store_path, sources=None, pollutants=None):
+    """
+    Catálogo do armazenamento: DataFrame com source, pollutant, version
+    (última), n_versions e path, filtrado opcionalmente por fontes e
+    poluentes.
+    """
+    rows = []
+    if os.path.isdir(store_path):
+        for source_name in sorted(os.listdir(store_path)):
+            if sources is not None and source_name not in sources:
+                continue
+            source_dir = os.path.join(store_path, source_name)
+            if not os.path.isdir(source_dir):
+                continue
+
+            for pol_name in sorted(os.listdir(source_dir)):
+                if pollutants is not None and pol_name not in pollutants:
+                    continue
+                versions = _comparison_versions(os.path.join(source_dir, pol_name))
+                if not versions:
+                    continue
+                rows.append({
+                    "source": source_name,
+                    "pollutant": pol_name,
+                    "version": versions[-1],
+                    "n_versions": len(versions),
+                    "path": os.path.join(source_dir, pol_name, f"v{versions[-1]:04d}.nc"),
+                })
+
+    return pd.DataFrame(rows, columns=["source", "pollutant", "version", "n_versions", "path"])
+
+
+def load_comparison_product(store_path, source_name, pol_name, version=None,
+                            fields=COMPARISON_FIELDS):
+    """
+    Lê um produto de comparação (última versão, ou `version`) no mesmo
+    formato gravado, mais "version" e "created" (data da gravação).
+    `fields` limita o que é carregado. Retorna None se não existir.
+    """
+    product_dir = _comparison_dir(store_path, source_name, pol_name)
+    versions = _comparison_versions(product_dir)
+
+    if not versions:
+        return None
+    if version is None:
+        version = versions[-1]
+    elif version not in versions:
+        raise ValueError(
+            f"Versão {version} inexistente para {source_name}/{pol_name}: {versions}"
+        )
+
+    path = os.path.join(product_dir, f"v{version:04d}.nc")
+    product = {"version": version}
+    with xr.open_dataset(path) as ds_product:
+        product["created"] = ds_product.attrs.get("created", "")
+        for field in fields:
+            if field == "map":
+                product["map"] = ds_product["map"].load()
+            elif field in ("xlon", "ylat"):
+                product[field] = ds_product[field].values
+            elif field == "time":
+                product["time"] = pd.DatetimeIndex(ds_product["TSTEP"].values)
+            elif field == "values":
+                product["values"] = ds_product["values"].values
+            elif field == "region_mean":
+                product["region_mean"] = pd.Series(
+                    ds_product["region_mean"].values,
+                    index=ds_product["region"].values.astype(str)
+                )
+            else:
+                raise ValueError(f"Campo desconhecido: {field}")
+
+    return product
+
+
+def query_comparison_inputs(store_path, pol_name, sources=None, verbose=True):
+    """
+    Monta, para um poluente, as entradas das figuras de comparação a partir
+    do armazenamento (última versão de cada fonte, na ordem de `sources`):
+
+        (source_maps, source_series, region_source_means)
+
+    nos formatos de plot_source_comparison_mosaic,
+    plot_source_comparison_timeseries e plot_region_source_stacked_bars.
+    Com `verbose`, mostra a versão e a data de gravação usadas de cada fonte,
+    já que podem vir de execuções anteriores.
+    """
+    catalog = list_comparison_products(store_path, sources=sources, pollutants=[pol_name])
+    names = list(catalog["source"])
+    if sources is not None:
+        names = [s for s in sources if s in names]
+
+    source_maps, source_series, region_source_means = {}, {}, {}
+    for source_name in names:
+        product = load_comparison_product(store_path, source_name, pol_name)
+        if verbose:
+            print(f"  {source_name}/{pol_name}: versão {product['version']} "
+                  f"(gravada em {product['created'] or 'data desconhecida'})")
+        source_maps[source_name] = {
+            "data": product["map"],
+            "xlon": product["xlon"],
+            "ylat": product["ylat"],
+        }
+        source_series[source_name] = {
+            "time": product["time"],
+            "values": product["values"],
+        }
+        region_source_means[source_name] = product["region_mean"]
+
+    return source_maps, source_series, region_source_means
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Modo streaming dos agregados de emissão, para séries muito longas.
+
+Em vez de um único grafo dask sobre milhares de arquivos (open_mfdataset),
+cada arquivo IOAPI é aberto sozinho, reduzido em memória e liberado logo em
+seguida. Um pool limitado de processos lê alguns arquivos em paralelo (com
+threads, a leitura ficaria serializada pelo lock global do HDF5 usado pelo
+xarray/netCDF4) e os parciais são somados, na ordem dos arquivos, em
+acumuladores:
+- soma no tempo por camada (LAY, ROW, COL);
+- mapas por ano (year, ROW, COL);
+- total do domínio em cada instante (TSTEP);
+e, ao final, os agregados por macro-região x camada.
+
+A memória fica limitada a poucos arquivos por vez, qualquer que seja o
+comprimento da série. Antes da passada principal, só o TFLAG de cada
+arquivo é lido: o tempo é validado como em attach_ioapi_time e os instantes
+repetidos entre arquivos (ex.: a hora 00 dos arquivos diários de 25 passos)
+ficam só no primeiro arquivo em que aparecem. O resultado tem o mesmo formato (e os mesmos valores,
+a menos de arredondamento) de compute_emission_products.
+"""
+
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+from functions_emissions import (
+    _unique_step_mask,
+    attach_ioapi_time,
+    build_pollutant,
+    decode_ioapi_tflag,
+    finish_emission_products,
+    get_required_species,
+    yearly_grouped_sum,
+)
+
+
+#%% ── redução de um arquivo ─────────────────────────────────────────────────
+
+def _read_file_tflag(path):
+    """
+    Lê só o TFLAG (VAR=0) e o atributo TSTEP de um arquivo IOAPI.
+    """
+    with xr.open_dataset(path) as ds_file:
+        tflag = ds_file["TFLAG"]
+        if "VAR" in tflag.dims:
+            tflag = tflag.isel(VAR=0)
+        return np.asarray(tflag.values), ds_file.attrs.get("TSTEP", 0)
+
+
+def _read_file_partials(path, pollutants, pollutant_specs, required_vars, steps):
+    """
+    Lê os passos `steps` (índices de TSTEP) de um arquivo IOAPI e devolve os
+    parciais de cada poluente: {pol: (lay_map, domain_series, yearly_maps)}.
+    """
+    with xr.open_dataset(path) as ds_file:
+        keep = [v for v in ds_file.data_vars if v in required_vars]
+        ds_file = ds_file[keep].isel(TSTEP=steps)
+        if "VAR" in ds_file.dims:
+            ds_file = ds_file.isel(VAR=slice(0, 1))
+        ds_file = ds_file.load()
+
+    tflag = ds_file["TFLAG"]
+    if "VAR" in tflag.dims:
+        tflag = tflag.isel(VAR=0)
+
+    datetimes = decode_ioapi_tflag(tflag.values)
+
+    cache = {}
+    partials = {}
+    for pol in pollutants:
+        da, _, _ = build_pollutant(ds_file, pol, pollutant_specs, verbose=False, cache=cache)
+        if da is None:
+            continue
+        if "LAY" not in da.dims:
+            da = da.expand_dims("LAY")
+
+        yearly_maps, _ = yearly_grouped_sum(da, datetimes)
+        partials[pol] = (
+            da.sum(dim="TSTEP"),
+            da.sum(dim=[d for d in da.dims if d != "TSTEP"]).values,
+            yearly_maps,
+        )
+
+    return partials
+
+
+#%% ── acumuladores ──────────────────────────────────────────────────────────
+
+class _EmissionAccumulator:
+    """
+    Somas correntes (float64) de um poluente ao longo dos arquivos.
+    """
+
+    def __init__(self, lay_template):
+        self.lay_template = lay_template
+        self.dtype = lay_template.dtype
+        self.lay_sum = np.zeros(lay_template.shape, dtype="float64")
+        self.series = []
+        self.years = {}
+        self.year_template = None
+
+    def add(self, lay_map, domain_series, yearly_maps):
+        self.lay_sum += lay_map.values
+        self.series.append(domain_series)
+
+        if self.year_template is None:
+            self.year_template = yearly_maps.isel(year=0, drop=True)
+
+        for year, year_map in zip(yearly_maps["year"].values, yearly_maps.values):
+            year = int(year)
+            if year in self.years:
+                self.years[year] += year_map
+            else:
+                self.years[year] = year_map.astype("float64")
+
+    def finish(self, datetimes):
+        """
+        Converte os acumuladores nos DataArrays de compute_emission_products.
+        """
+        lay_map = self.lay_template.copy(data=self.lay_sum.astype(self.dtype))
+
+        domain_series = xr.DataArray(
+            np.concatenate(self.series).astype(self.dtype),
+            dims="TSTEP",
+            coords={"TSTEP": datetimes},
+            name=self.lay_template.name
+        )
+
+        unique_years = np.array(sorted(self.years))
+        yearly_maps = xr.concat(
+            [self.year_template.copy(data=self.years[y].astype(self.dtype)) for y in unique_years],
+            dim=xr.DataArray(unique_years, dims="year", name="year")
+        )
+
+        return lay_map, domain_series, yearly_maps, unique_years
+
+
+#%% ── passada em streaming ──────────────────────────────────────────────────
+
+def stream_emission_products(files, pollutants, pollutant_specs, region_index,
+                             max_workers=4, verbose=True):
+    """
+    Calcula, arquivo a arquivo, os produtos de todos os poluentes de uma
+    fonte em uma única passada pelos arquivos:
+
+        {pol: dicionário de compute_emission_products}
+
+    `max_workers` arquivos são lidos em paralelo (processos; no máximo
+    2 * max_workers parciais na memória) e somados na ordem de `files`, o
+    que torna o resultado determinístico. O TFLAG concatenado passa pelas
+    mesmas validações de attach_ioapi_time antes da leitura das espécies, e
+    os instantes repetidos são descartados (fica a primeira ocorrência).
+
+    Todos os arquivos precisam ter as mesmas espécies; caso contrário as
+    séries de tempo não seriam comparáveis e um ValueError é levantado.
+    """
+    if not files:
+        raise ValueError("Nenhum arquivo para o modo streaming.")
+
+    required = get_required_species(pollutant_specs, pollutants)
+    max_workers = max(1, int(max_workers or 1))
+
+    accumulators = None
+
+    # spawn: processos novos, sem herdar locks de threads dask/HDF5 do chamador
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        heads = list(pool.map(_read_file_tflag, files, chunksize=16))
+        tflags = [tflag for tflag, _ in heads]
+
+        # mesmas validações de tempo do caminho por grafo, antes da passada
+        time_ds = xr.Dataset(
+            {"TFLAG": (("TSTEP", "DATE-TIME"), np.concatenate(tflags))},
+            attrs={"TSTEP": heads[0][1]}
+        )
+        datetimes = attach_ioapi_time(time_ds).indexes["TSTEP"]
+
+        # passos mantidos em cada arquivo (instante repetido: só a 1ª ocorrência)
+        keep = _unique_step_mask(decode_ioapi_tflag(time_ds["TFLAG"].values))
+        bounds = np.cumsum([0] + [len(tflag) for tflag in tflags])
+        jobs = [
+            (path, np.flatnonzero(keep[start:stop]))
+            for path, start, stop in zip(files, bounds[:-1], bounds[1:])
+        ]
+        jobs = [(path, steps) for path, steps in jobs if len(steps)]
+
+        pending = deque()
+        next_job = 0
+
+        for i in range(len(jobs)):
+            # janela limitada de leituras em andamento
+            while next_job < len(jobs) and len(pending) < 2 * max_workers:
+                path, steps = jobs[next_job]
+                pending.append(pool.submit(
+                    _read_file_partials, path, pollutants, pollutant_specs, required, steps
+                ))
+                next_job += 1
+
+            part = pending.popleft().result()
+
+            if accumulators is None:
+                accumulators = {
+                    pol: _EmissionAccumulator(lay_map)
+                    for pol, (lay_map, _, _) in part.items()
+                }
+            elif set(part) != set(accumulators):
+                raise ValueError(
+                    f"Arquivo com poluentes diferentes dos anteriores: {jobs[i][0]} "
+                    f"({sorted(part)} em vez de {sorted(accumulators)})."
+                )
+
+            for pol, partial in part.items():
+                accumulators[pol].add(*partial)
+
+            if verbose and ((i + 1) % 100 == 0 or i + 1 == len(jobs)):
+                print(f"Streaming: {i + 1}/{len(jobs)} arquivo(s) acumulado(s).")
+
+    products = {}
+    for pol, acc in accumulators.items():
+        lay_map, domain_series, yearly_maps, unique_years = acc.finish(datetimes)
+        products[pol] = finish_emission_products(
+            datetimes, lay_map, domain_series, yearly_maps, unique_years, region_index
+        )
+
+    return products
@@ -34,36 +34,60 @@ garantindo organização e escalabilidade para diferentes cenários e inventári
 # o quão sensível isso é em cada uma das camadas
 '''
 
-import glob
 import os
 
 import geopandas as gpd
 import xarray as xr
 
 from functions_emissions import (
-    ioapiCoords,
-    eqmerc2latlon,
-    squeeze_var_dim,
-    build_pollutant,
-    plot_spatial_mosaic,
-    calculate_by_region_lay,
-    plot_regional_vertical_profile,
-    plot_temporal_mosaic,
-    plot_annual_spatial_mosaic,
-    plot_regional_total_map,
+    get_required_species,
     plot_source_comparison_mosaic,
     plot_source_comparison_timeseries,
-    get_ioapi_datetimes,
-    build_domain_time_series,
-    calculate_region_annual_mean,
     plot_region_source_stacked_bars,
 )
+from functions_pipeline import run_emission_sources
+from functions_render import render_figure_jobs, set_headless
+from functions_store import query_comparison_inputs
 
 #%% ── caminhos de entrada/saída ─────────────────────────────────────────────
 
 inputs_base_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\inputs"
 shp_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\input_base\BR_UF_2024\BR_UF_2024.shp"
 figures_base_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\figures"
+cache_base_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\cache"
+store_base_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\outputs\cubo_emissoes"
+comparison_store_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\outputs\comparacao_fontes"
+
+# True: agregados vêm do cubo em disco, atualizado só para arquivos novos/alterados
+# False: agregados calculados a partir dos arquivos brutos a cada execução
+USE_EMISSION_STORE = True
+
+# True: quando os agregados não vêm do cubo, são calculados arquivo a arquivo
+# (STREAM_WORKERS processos lendo arquivos em paralelo), com memória constante mesmo
+# para séries de vários anos; False: um único grafo dask sobre todos os arquivos
+STREAMING_PRODUCTS = False
+STREAM_WORKERS = 4
+
+# cubos de perfis hora/dia da semana/mês por célula (uma passada extra nos
+# arquivos, refeita só quando eles mudam) e figura de faixas por macro-região
+BUILD_TEMPORAL_CUBES = True
+
+# execução das fontes: em paralelo, cada fonte roda em um processo próprio
+# com limite de memória residente (RSS) e número de threads dask controlados
+RUN_PARALLEL = True
+MAX_PARALLEL_SOURCES = 3
+WORKER_MEMORY_LIMIT_GB = 12
+THREADS_PER_SOURCE = 4
+
+# figuras: HEADLESS_RENDER=True não abre janelas (servidores/execução em lote);
+# figuras cujas entradas não mudaram são puladas, a menos que FORCE_RENDER=True
+HEADLESS_RENDER = False
+RENDER_WORKERS = 1
+FORCE_RENDER = False
+
+# True: refaz apenas as figuras de comparação entre fontes, lendo os produtos
+# já gravados em comparison_store_path (nenhuma fonte é reprocessada)
+COMPARISON_ONLY = False
 
 # fontes de emissão a processar
 EMISSION_SOURCES = {
@@ -98,14 +122,8 @@ POLLUTANT_SPECS = {
         "PMFINE_SI", "PMFINE_TI", "PMFINE_MN", "PMFINE_H2O",
         "PMFINE_OTHR"
     ],
-    "MP10": [
-        "PMC",
-        "PMFINE_LVPO1", "PMFINE_LVOO1", "PMFINE_SO4", "PMFINE_NO3",
-        "PMFINE_CL", "PMFINE_NH4", "PMFINE_NA", "PMFINE_CA",
-        "PMFINE_MG", "PMFINE_K", "PMFINE_FE", "PMFINE_AL",
-        "PMFINE_SI", "PMFINE_TI", "PMFINE_MN", "PMFINE_H2O",
-        "PMFINE_OTHR"
-    ],
+    # poluentes compostos podem referenciar outros poluentes (DAG)
+    "MP10": ["MP25", "PMC"],
 }
 
 POLLUTANT_UNITS = {
@@ -118,286 +136,181 @@ POLLUTANT_UNITS = {
 
 pollutants = ["NO2", "SO2", "MP10", "MP25", "CO"]
 
+# variáveis lidas dos arquivos (espécies dos poluentes + TFLAG)
+REQUIRED_SPECIES = get_required_species(POLLUTANT_SPECS, pollutants)
+
+# mosaico por camada: camadas 1-based (None = 1, 2, 3, 4, 39, 40) ou faixas
+# de altura (primeira, última), ex.: [(1, 1), (2, 5), (6, 20), (21, 40)]
+MOSAIC_LAYERS = None
+MOSAIC_LAYER_BINS = None
+
+# folha com todas as camadas (small multiples), sem reprocessar os arquivos
+LAYER_SHEET = True
+
+# cubos região x camada x hora/mês (uma passada extra nos arquivos) e
+# figuras de injeção vertical: a divisão entre camadas muda entre horas
+# convectivas e estáveis? (inventários multicamadas)
+INJECTION_CUBES = True
+
 # fontes que precisam de correção de orientação
 ROTATED_SOURCES = [
     "emission_braves_classic",
     "emission_braves_ressuspension"
 ]
 
-# cache para o mosaico comparativo entre fontes
-comparison_maps = {pol: {} for pol in pollutants}
-comparison_series = {pol: {} for pol in pollutants}
-region_comparison = {pol: {} for pol in pollutants}
-
-#%% ── shapefile do Brasil ───────────────────────────────────────────────────
-
-brazil = gpd.read_file(shp_path).to_crs("EPSG:4326")
-
-#%% ── loop por fonte de emissão ─────────────────────────────────────────────
-
-for source_name, repo_path in EMISSION_SOURCES.items():
-    print(f"\n{'#' * 50}")
-    print(f"Processando fonte de emissão: {source_name}")
-    print(f"{'#' * 50}")
-    
-    display_name = SOURCE_LABELS.get(source_name, source_name)
-    
-    if not os.path.isdir(repo_path):
-        print(f"Pasta não encontrada. Pulando: {repo_path}")
-        continue
-
-    file_pattern = os.path.join(repo_path, "*.nc")
-    files = sorted(glob.glob(file_pattern))
-
-    if not files:
-        print(f"Nenhum arquivo .nc encontrado em: {repo_path}")
-        continue
-
-    print(f"Arquivos encontrados: {len(files)}")
-
-    ds = xr.open_mfdataset(
-        files,
-        concat_dim="TSTEP",
-        combine="nested",
-        parallel=True
-    )
-
-    print("Dataset carregado com sucesso.")
-
-    # coordenadas do grid
-    # coordenadas do grid
-    xv, yv, lon, lat = ioapiCoords(ds)
-    xlon, ylat = eqmerc2latlon(ds, xv, yv)
-    
-    # correção global de orientação para fontes invertidas
-    if source_name in ROTATED_SOURCES:
-        xlon = xlon[::-1, :]
-        ylat = ylat[::-1, :]
-
-    # pasta de saída específica da fonte
-    figpath = os.path.join(figures_base_path, source_name)
-    os.makedirs(figpath, exist_ok=True)
-
-    ### ── dimensões padrão ──────────────────────────────────────────────────
-
-    candidate_vars = [v for v in ds.data_vars if v != "TFLAG"]
-
-    if not candidate_vars:
-        print("Nenhuma variável de emissão encontrada além de TFLAG. Pulando esta fonte.")
-        ds.close()
-        continue
-    
-    ref_var = "CO" if "CO" in candidate_vars else candidate_vars[0]
-    ref_da = squeeze_var_dim(ds[ref_var])
-    
-    dims_time = [d for d in ["TSTEP"] if d in ref_da.dims]
-
-    if not dims_time:
-        print("A dimensão TSTEP não foi encontrada no dataset. Pulando esta fonte.")
-        ds.close()
-        continue
-
-    ### ── loop por poluente ─────────────────────────────────────────────────
+# configuração repassada a cada fonte (também aos processos do pool)
+PIPELINE_CONFIG = {
+    "pollutants": pollutants,
+    "pollutant_specs": POLLUTANT_SPECS,
+    "pollutant_units": POLLUTANT_UNITS,
+    "required_species": REQUIRED_SPECIES,
+    "rotated_sources": ROTATED_SOURCES,
+    "figures_base_path": figures_base_path,
+    "cache_base_path": cache_base_path,
+    "store_base_path": store_base_path,
+    "comparison_store_path": comparison_store_path,
+    "use_store": USE_EMISSION_STORE,
+    "streaming": STREAMING_PRODUCTS,
+    "stream_workers": STREAM_WORKERS,
+    "temporal_cubes": BUILD_TEMPORAL_CUBES,
+    "mosaic_layers": MOSAIC_LAYERS,
+    "mosaic_layer_bins": MOSAIC_LAYER_BINS,
+    "layer_sheet": LAYER_SHEET,
+    "injection_cubes": INJECTION_CUBES,
+    "render_workers": RENDER_WORKERS,
+    "force_render": FORCE_RENDER,
+}
 
-    for pol in pollutants:
-        print(f"\n{'=' * 60}")
-        print(f"Fonte: {source_name} | Processando poluente: {pol}")
-        print(f"{'=' * 60}")
+#%% ── execução ──────────────────────────────────────────────────────────────
 
-        try:
-            da, present, missing = build_pollutant(
-                ds=ds,
-                pol_name=pol,
-                pollutant_specs=POLLUTANT_SPECS,
-                verbose=True
-            )
-
-            if da is None:
-                print(f"{pol}: não disponível em {source_name}. Pulando apenas este poluente.")
-                continue
-
-            unit = POLLUTANT_UNITS[pol]
-
-            print(f"{pol}: usando {len(present)} espécie(s).")
-            if missing:
-                print(f"{pol}: cálculo parcial. Espécies ausentes: {len(missing)}")
-
-            # mapa acumulado para comparação entre fontes
-            dims_map_compare = [d for d in da.dims if d in ["TSTEP", "LAY"]]
-            da_map_compare = da.sum(dim=dims_map_compare).compute()
-
-            comparison_maps[pol][source_name] = {
-                "data": da_map_compare,
-                "xlon": xlon,
-                "ylat": ylat
-            }
-            # série temporal agregada do domínio para comparação entre fontes
-            datetimes = get_ioapi_datetimes(ds)
-            ts_domain = build_domain_time_series(da)
-            
-            comparison_series[pol][source_name] = {
-                "time": datetimes,
-                "values": ts_domain.values
-            }
-            
-            # média anual por macro-região para gráfico de barras empilhadas
-            region_mean_annual = calculate_region_annual_mean(
-                da=da,
-                ds=ds,
-                xlon=xlon,
-                ylat=ylat,
-                brazil=brazil
-            )
-            
-            region_comparison[pol][source_name] = region_mean_annual
-
-            nlay = da.sizes.get("LAY", 1)
-            print(f"LAY size para {source_name} - {pol}: {nlay}")
-
-            if nlay > 1:
-                plot_spatial_mosaic(
-                    da=da,
-                    pol_name=pol,
-                    unit=unit,
-                    xlon=xlon,
-                    ylat=ylat,
-                    brazil=brazil,
-                    dims_time=dims_time,
-                    figpath=figpath
-                )
-
-                by_region_lay = calculate_by_region_lay(
-                    da=da,
-                    xlon=xlon,
-                    ylat=ylat,
-                    brazil=brazil
-                )
-
-                plot_regional_vertical_profile(
-                    by_region_lay=by_region_lay,
-                    pol_name=pol,
-                    unit=unit,
-                    brazil=brazil,
-                    figpath=figpath
-                )
-
-            else:
-                print(f"{pol}: inventário monocamada. Pulando análises por camada.")
-
-                plot_regional_total_map(
-                    da=da,
-                    pol_name=pol,
-                    unit=unit,
-                    xlon=xlon,
-                    ylat=ylat,
-                    brazil=brazil,
-                    figpath=figpath
-                )
-
-            plot_temporal_mosaic(
-                da=da,
-                ds=ds,
-                pol_name=pol,
-                unit=unit,
-                xlon=xlon,
-                ylat=ylat,
-                brazil=brazil,
-                figpath=figpath,
-                source_name=source_name
-            )
-            plot_annual_spatial_mosaic(
-                da=da,
-                ds=ds,
-                pol_name=pol,
-                unit=unit,
-                xlon=xlon,
-                ylat=ylat,
-                brazil=brazil,
-                figpath=figpath,
-                source_name=source_name
-            )
+# no Windows os processos do pool reimportam este script: todo o trabalho
+# precisa ficar protegido pelo bloco abaixo
+if __name__ == "__main__":
 
-        except Exception as e:
-            print(f"Erro ao processar {pol} em {source_name}: {e}")
-            continue
+    if HEADLESS_RENDER:
+        set_headless(True)
 
-print("\nProcessamento concluído.")
+    ### ── shapefile do Brasil ───────────────────────────────────────────────
 
-#%% ── mosaico comparativo entre fontes ──────────────────────────────────────
+    brazil = gpd.read_file(shp_path).to_crs("EPSG:4326")
 
-comparison_figpath = os.path.join(figures_base_path, "_comparacao_fontes")
-os.makedirs(comparison_figpath, exist_ok=True)
+    ### ── processamento por fonte de emissão ────────────────────────────────
 
-for pol in pollutants:
-    unit = POLLUTANT_UNITS[pol]
-
-    print(f"\nMontando mosaico comparativo entre fontes para {pol}...")
-    source_maps = comparison_maps.get(pol, {})
-    if source_maps:
-       plot_source_comparison_mosaic(
-            source_maps=source_maps,
-            pol_name=pol,
-            unit=unit,
+    # os produtos de comparação de cada fonte/poluente vão para
+    # comparison_store_path; nada fica acumulado em memória entre fontes
+    if not COMPARISON_ONLY:
+        results, failures = run_emission_sources(
+            sources=EMISSION_SOURCES,
             brazil=brazil,
-            figpath=comparison_figpath,
-            source_labels=SOURCE_LABELS
+            config=PIPELINE_CONFIG,
+            parallel=RUN_PARALLEL,
+            max_workers=MAX_PARALLEL_SOURCES,
+            memory_limit_gb=WORKER_MEMORY_LIMIT_GB,
+            threads_per_worker=THREADS_PER_SOURCE
         )
-    else:
-        print(f"Nenhuma fonte disponível para o mosaico de {pol}.")
-
-    print(f"Montando comparação temporal entre fontes para {pol}...")
-    source_series = comparison_series.get(pol, {})
-    if source_series:
-        plot_source_comparison_timeseries(
-            source_series=source_series,
-            pol_name=pol,
-            unit=unit,
-            figpath=comparison_figpath,
-            source_labels=SOURCE_LABELS
+
+        if failures:
+            print("\nFontes com falha:")
+            for source_name, error in failures.items():
+                print(f"  {source_name}: {error}")
+
+        print("\nProcessamento concluído.")
+
+    ### ── mosaico comparativo entre fontes ────────────────────────────────
+
+    comparison_figpath = os.path.join(figures_base_path, "_comparacao_fontes")
+    os.makedirs(comparison_figpath, exist_ok=True)
+
+    # um poluente por vez: só os produtos dele ficam em memória
+    for pol in pollutants:
+        unit = POLLUTANT_UNITS[pol]
+        comparison_jobs = []
+
+        # última versão de cada fonte, na ordem de EMISSION_SOURCES; após o
+        # processamento, só as fontes que produziram o poluente nesta execução
+        # (produtos antigos de fontes com falha não entram na comparação)
+        if COMPARISON_ONLY:
+            pol_sources = list(EMISSION_SOURCES)
+        else:
+            pol_sources = [s for s in EMISSION_SOURCES if pol in (results.get(s) or {})]
+
+        source_maps, source_series, region_source_means = query_comparison_inputs(
+            comparison_store_path, pol, sources=pol_sources
         )
-    else:
-        print(f"Nenhuma série temporal disponível para {pol}.")
-
-    print(f"Montando barras empilhadas por macro-região para {pol}...")
-    region_source_means = region_comparison.get(pol, {})
-    if region_source_means:
-        plot_region_source_stacked_bars(
-            region_source_means=region_source_means,
-            pol_name=pol,
-            unit=unit,
-            figpath=comparison_figpath,
-            source_labels=SOURCE_LABELS
+
+        print(f"\nMontando mosaico comparativo entre fontes para {pol}...")
+        if source_maps:
+            comparison_jobs.append((plot_source_comparison_mosaic, dict(
+                source_maps=source_maps,
+                pol_name=pol,
+                unit=unit,
+                brazil=brazil,
+                figpath=comparison_figpath,
+                source_labels=SOURCE_LABELS
+            )))
+        else:
+            print(f"Nenhuma fonte disponível para o mosaico de {pol}.")
+
+        print(f"Montando comparação temporal entre fontes para {pol}...")
+        if source_series:
+            comparison_jobs.append((plot_source_comparison_timeseries, dict(
+                source_series=source_series,
+                pol_name=pol,
+                unit=unit,
+                figpath=comparison_figpath,
+                source_labels=SOURCE_LABELS
+            )))
+        else:
+            print(f"Nenhuma série temporal disponível para {pol}.")
+
+        print(f"Montando barras empilhadas por macro-região para {pol}...")
+        if region_source_means:
+            comparison_jobs.append((plot_region_source_stacked_bars, dict(
+                region_source_means=region_source_means,
+                pol_name=pol,
+                unit=unit,
+                figpath=comparison_figpath,
+                source_labels=SOURCE_LABELS
+            )))
+        else:
+            print(f"Nenhum dado regional disponível para {pol}.")
+
+        render_figure_jobs(
+            comparison_jobs,
+            comparison_figpath,
+            max_workers=RENDER_WORKERS,
+            force=FORCE_RENDER
         )
-    else:
-        print(f"Nenhum dado regional disponível para {pol}.")
-        
-print("\nProcessamento concluído.")
+
+    print("\nProcessamento concluído.")
 
 #%% Air quality
 
-import glob
-import os
+if __name__ == "__main__":
+
+    import glob
+    import os
 
-repo_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\inputs\quality_finn"
-files = sorted(glob.glob(os.path.join(repo_path, "*.nc")))
+    repo_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\inputs\quality_finn"
+    files = sorted(glob.glob(os.path.join(repo_path, "*.nc")))
 
-print(len(files))
-print(files[:5])
-print(files[-5:])
+    print(len(files))
+    print(files[:5])
+    print(files[-5:])
 
-ds = xr.open_mfdataset(files, combine="by_coords")
-print(ds)
+    ds = xr.open_mfdataset(files, combine="by_coords")
+    print(ds)
 
-print(ds["TFLAG"])
-print(ds["TFLAG"].values[:10])
+    print(ds["TFLAG"])
+    print(ds["TFLAG"].values[:10])
 
-print(ds["TFLAG"].attrs)
+    print(ds["TFLAG"].attrs)
 
-print(ds["NO2"].attrs)
-print(ds["O3"].attrs)
+    print(ds["NO2"].attrs)
+    print(ds["O3"].attrs)
 
-print(ds["LAT"])
-print(ds["LON"])
+    print(ds["LAT"])
+    print(ds["LON"])
 
 
 
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+'''
+Este script avalia uma rodada de qualidade do ar do CMAQ contra observações
+de estações de monitoramento (CSV locais).
+
+Cada estação é associada a uma célula da grade (LAT/LON dos arquivos de
+qualidade), as séries do modelo são extraídas de uma só vez e pareadas com
+as observações no tempo do TFLAG (UTC). As estatísticas MB, NMB, NME, RMSE,
+r, IOA e FAC2 são calculadas por estação e para todas as estações, em três
+períodos:
+- horário;
+- média diária;
+- métrica diária regulatória (MP: média diária; NO2: máxima horária;
+  O3: máxima média móvel de 8 h).
+
+Saídas: tabelas CSV (pares, estatísticas e resumo), figura com a tabela
+resumo e diagramas "soccer" (NMB x NME) com as metas e critérios de
+Emery et al. (2017) para O3 e MP2,5.
+'''
+
+import glob
+import os
+
+import xarray as xr
+
+from functions_evaluation import (
+    compute_evaluation_stats,
+    extract_station_series,
+    load_observations,
+    load_stations,
+    pair_observations,
+    plot_evaluation_table,
+    plot_soccer,
+    summarize_evaluation,
+)
+from functions_points import build_grid_locator
+from functions_quality import get_quality_datetimes, get_quality_pollutants
+from functions_render import render_figure_jobs, set_headless
+
+#%% ── caminhos de entrada/saída ─────────────────────────────────────────────
+
+quality_base_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\inputs\quality_finn"
+observations_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\inputs\observacoes"
+stations_file = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\inputs\observacoes\estacoes\estacoes.csv"
+figures_base_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\figures"
+outputs_base_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\outputs"
+
+quality_name = "quality_finn"
+figpath = os.path.join(figures_base_path, "avaliacao", quality_name)
+tables_path = os.path.join(outputs_base_path, "avaliacao", quality_name)
+os.makedirs(figpath, exist_ok=True)
+os.makedirs(tables_path, exist_ok=True)
+
+# fuso das observações (horário de Brasília = -3); o TFLAG do CMAQ é UTC
+OBS_UTC_OFFSET_HOURS = -3
+
+# célula da estação: "nearest" (célula que contém a estação) ou "bilinear"
+POINT_METHOD = "nearest"
+
+# mínimo de pares para uma estação entrar nas estatísticas
+MIN_PAIRS = 24
+
+HEADLESS_RENDER = False
+FORCE_RENDER = False
+
+if HEADLESS_RENDER:
+    set_headless(True)
+
+#%% ── observações e estações ────────────────────────────────────────────────
+
+obs = load_observations(observations_path, utc_offset_hours=OBS_UTC_OFFSET_HOURS)
+stations = load_stations(stations_file)
+
+print(f"Observações: {len(obs)} registros, {obs['station'].nunique()} estações, "
+      f"poluentes {sorted(obs['pollutant'].unique())}")
+
+#%% ── modelo ────────────────────────────────────────────────────────────────
+
+files = sorted(glob.glob(os.path.join(quality_base_path, "*.nc")))
+if not files:
+    raise FileNotFoundError(f"Nenhum arquivo .nc encontrado em: {quality_base_path}")
+
+ds = xr.open_mfdataset(files, combine="by_coords", data_vars="minimal")
+datetimes = get_quality_datetimes(ds)
+
+pollutants = [p for p in get_quality_pollutants(ds) if p in set(obs["pollutant"])]
+if not pollutants:
+    raise ValueError("Nenhum poluente em comum entre o modelo e as observações.")
+
+print("Poluentes avaliados:", pollutants)
+
+locator = build_grid_locator(ds["LON"].values, ds["LAT"].values)
+model, inside = extract_station_series(
+    ds, pollutants, stations, datetimes, method=POINT_METHOD, locator=locator
+)
+print(f"Estações dentro da grade: {len(inside)}")
+
+#%% ── pares e estatísticas ──────────────────────────────────────────────────
+
+pairs = pair_observations(obs, model)
+stats = compute_evaluation_stats(pairs, min_pairs=MIN_PAIRS)
+summary = summarize_evaluation(stats)
+
+pairs.to_csv(os.path.join(tables_path, "pares_modelo_observacao.csv"), index=False)
+stats.to_csv(os.path.join(tables_path, "estatisticas_por_estacao.csv"))
+summary.to_csv(os.path.join(tables_path, "resumo_avaliacao.csv"))
+
+print(summary.round(2).to_string())
+
+#%% ── figuras ───────────────────────────────────────────────────────────────
+
+jobs = [(plot_evaluation_table, dict(summary=summary, figpath=figpath))]
+
+for pol, period in summary.index:
+    jobs.append((plot_soccer, dict(stats=stats, pol_name=pol, period=period, figpath=figpath)))
+
+render_figure_jobs(jobs, figpath, force=FORCE_RENDER)
+
+ds.close()
+print("\nAvaliação concluída.")
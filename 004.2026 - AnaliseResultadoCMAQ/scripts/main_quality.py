@@ -18,6 +18,11 @@ Para cada poluente disponível, o script gera uma figura resumo contendo:
 - MP10 / PM25 / PMC: média diária
 - NO2: máxima horária diária
 - O3: máxima média móvel de 8 horas diária
+
+Para MP10, PM25, NO2 e O3 são avaliados também os padrões da CONAMA 491/2018
+(dias de ultrapassagem por etapa, percentis 98/99 e médias anuais). Os mapas
+de conformidade são gravados em NetCDF e entram como terceiro painel do
+mosaico legislativo.
 '''
 
 import glob
@@ -26,21 +31,45 @@ import os
 import geopandas as gpd
 import xarray as xr
 
+from functions_conama import (
+    CONAMA_491_STANDARDS,
+    compute_conama_metrics,
+    summarize_conama_compliance,
+    write_conama_compliance,
+)
 from functions_quality import (
+    compute_quality_bundle,
+    get_quality_datetimes,
     get_quality_pollutants,
     plot_quality_summary,
     plot_quality_legislative_mosaic,
 )
+from functions_render import render_figure_jobs, set_headless
 
 #%% ── caminhos de entrada/saída ─────────────────────────────────────────────
 
 quality_base_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\inputs\quality_finn"
 shp_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\input_base\BR_UF_2024\BR_UF_2024.shp"
 figures_base_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\figures"
+conama_base_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\outputs\conama491"
 
 quality_name = "quality_finn"
 figpath = os.path.join(figures_base_path, quality_name)
 os.makedirs(figpath, exist_ok=True)
+conama_path = os.path.join(conama_base_path, quality_name)
+
+# padrões CONAMA 491/2018: CONAMA_ALLOWED_EXCEEDANCES é o número de dias de
+# ultrapassagem tolerado por etapa (0 = nenhuma ultrapassagem)
+CONAMA_COMPLIANCE = True
+CONAMA_ALLOWED_EXCEEDANCES = 0
+
+# figuras: HEADLESS_RENDER=True não abre janelas (servidores/execução em lote);
+# figuras cujas entradas não mudaram são puladas, a menos que FORCE_RENDER=True
+HEADLESS_RENDER = False
+FORCE_RENDER = False
+
+if HEADLESS_RENDER:
+    set_headless(True)
 
 #%% ── shapefile do Brasil ───────────────────────────────────────────────────
 
@@ -70,13 +99,18 @@ if not quality_pollutants:
 
 print("Poluentes disponíveis:", quality_pollutants)
 
+datetimes = get_quality_datetimes(ds)
+
 #%% ── loop por poluente ─────────────────────────────────────────────────────
 
+jobs = []
+
 for pol in quality_pollutants:
     print(f"\n{'=' * 60}")
     print(f"Processando poluente de qualidade: {pol}")
     print(f"{'=' * 60}")
 
+    # erro em um poluente (ex.: variável sem TSTEP) pula só esse poluente
     try:
         da = ds[pol]
         unit = da.attrs.get("units", "N/A")
@@ -86,18 +120,10 @@ for pol in quality_pollutants:
         print(f"Dims: {da.dims}")
         print(f"Shape: {da.shape}")
 
-        plot_quality_summary(
-            da=da,
-            ds=ds,
-            pol_name=pol,
-            unit=unit,
-            xlon=xlon,
-            ylat=ylat,
-            brazil=brazil,
-            figpath=figpath
-        )
-        
-        plot_quality_legislative_mosaic(
+        # uma única passada pelos dados por poluente; figuras e CONAMA leem daqui
+        bundle = compute_quality_bundle(da, pol, datetimes)
+
+        kwargs = dict(
             da=da,
             ds=ds,
             pol_name=pol,
@@ -105,12 +131,42 @@ for pol in quality_pollutants:
             xlon=xlon,
             ylat=ylat,
             brazil=brazil,
-            figpath=figpath
+            figpath=figpath,
+            bundle=bundle
         )
-                
+        pol_jobs = [(plot_quality_summary, kwargs)]
+
+        # falha na conformidade (ex.: unidade desconhecida) não impede as figuras;
+        # o mosaico legislativo sai sem o painel CONAMA
+        compliance = None
+        if CONAMA_COMPLIANCE and pol in CONAMA_491_STANDARDS:
+            try:
+                compliance = compute_conama_metrics(
+                    da, pol, datetimes,
+                    allowed_exceedances=CONAMA_ALLOWED_EXCEEDANCES,
+                    bundle=bundle
+                )
+                nc_path = write_conama_compliance(compliance, conama_path)
+                print(f"Conformidade CONAMA 491 salva em: {nc_path}")
+                print(summarize_conama_compliance(compliance).to_string())
+            except Exception as e:
+                print(f"Erro na conformidade CONAMA 491 de {pol}: {e}")
+                compliance = None
+
+        # as figuras só usam os mapas e séries; o cubo diário sai da memória
+        bundle["daily_field"] = None
+
+        if bundle["daily_mean_map"] is not None:
+            pol_jobs.append((plot_quality_legislative_mosaic, dict(kwargs, compliance=compliance)))
+
+        jobs.extend(pol_jobs)
+
     except Exception as e:
         print(f"Erro ao processar {pol}: {e}")
         continue
 
+# erros de uma figura são reportados sem interromper as demais
+render_figure_jobs(jobs, figpath, force=FORCE_RENDER)
+
 ds.close()
-print("\nProcessamento de qualidade concluído.")
\ No newline at end of file
+print("\nProcessamento de qualidade concluído.")
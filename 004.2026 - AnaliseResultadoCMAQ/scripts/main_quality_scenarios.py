@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+'''
+Este script compara duas rodadas de qualidade do ar do CMAQ: um cenário
+(por exemplo, quality_finn, com queimadas) e um caso base (sem a fonte).
+As duas pastas são abertas de forma preguiçosa, conferidas quanto ao grid
+(LAT/LON) e alinhadas pelo TFLAG.
+
+Para cada poluente comum aos dois cenários, o script gera:
+(i) mosaico das diferenças absoluta e relativa (cenário - base) da média do
+período e da média da métrica diária regulatória;
+(ii) barras por macro-região com as médias dos dois cenários e a
+participação da diferença na concentração do cenário;
+(iii) tabelas CSV por macro-região e da série diária no domínio.
+
+As reduções são feitas bloco a bloco (dask): um ano completo dos dois
+cenários não precisa caber na memória.
+'''
+
+import os
+
+import geopandas as gpd
+
+from functions_emissions import get_region_index
+from functions_render import render_figure_jobs, set_headless
+from functions_scenarios import (
+    align_quality_scenarios,
+    compute_scenario_differences,
+    open_quality_folder,
+    plot_scenario_difference_mosaic,
+    plot_scenario_region_share,
+)
+
+#%% ── caminhos de entrada/saída ─────────────────────────────────────────────
+
+inputs_base_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\inputs"
+shp_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\input_base\BR_UF_2024\BR_UF_2024.shp"
+figures_base_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\figures"
+outputs_base_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\outputs"
+cache_base_path = r"C:\Users\glima\OneDrive\Documentos\Mestrado_GitHub\004.2026 - AnaliseResultadoCMAQ\cache"
+
+# cenário comparado e caso base (pastas em inputs)
+CASE_NAME = "quality_finn"
+BASE_NAME = "quality_base"
+CASE_LABEL = "Com queimadas"
+BASE_LABEL = "Sem queimadas"
+
+comparison_name = f"{CASE_NAME}_vs_{BASE_NAME}"
+figpath = os.path.join(figures_base_path, "cenarios", comparison_name)
+tables_path = os.path.join(outputs_base_path, "cenarios", comparison_name)
+os.makedirs(figpath, exist_ok=True)
+os.makedirs(tables_path, exist_ok=True)
+
+HEADLESS_RENDER = False
+FORCE_RENDER = False
+
+if HEADLESS_RENDER:
+    set_headless(True)
+
+#%% ── shapefile do Brasil ───────────────────────────────────────────────────
+
+brazil = gpd.read_file(shp_path).to_crs("EPSG:4326")
+
+#%% ── carregar e alinhar cenários ───────────────────────────────────────────
+
+ds_case = open_quality_folder(os.path.join(inputs_base_path, CASE_NAME))
+ds_base = open_quality_folder(os.path.join(inputs_base_path, BASE_NAME))
+
+ds_case, ds_base, datetimes, pollutants = align_quality_scenarios(ds_case, ds_base)
+
+if not pollutants:
+    raise ValueError("Nenhum poluente comum aos dois cenários.")
+
+print(f"Instantes comparados: {len(datetimes)} ({datetimes[0]} a {datetimes[-1]})")
+print("Poluentes comparados:", pollutants)
+
+xlon = ds_case["LON"].values
+ylat = ds_case["LAT"].values
+
+# índice célula → macro-região, calculado uma vez por grid e salvo em cache
+region_index = get_region_index(xlon, ylat, brazil, ds=ds_case, cache_dir=cache_base_path)
+
+#%% ── loop por poluente ─────────────────────────────────────────────────────
+
+jobs = []
+
+for pol in pollutants:
+    print(f"\n{'=' * 60}")
+    print(f"Comparando cenários: {pol}")
+    print(f"{'=' * 60}")
+
+    try:
+        unit = ds_case[pol].attrs.get("units", "N/A")
+
+        result = compute_scenario_differences(
+            ds_case[pol], ds_base[pol], pol, datetimes, region_index=region_index
+        )
+
+        result["region"].to_csv(os.path.join(tables_path, f"regioes_{pol}.csv"))
+        if result["daily_series"] is not None:
+            result["daily_series"].to_csv(
+                os.path.join(tables_path, f"serie_diaria_{pol}.csv")
+            )
+        print(result["region"].round(3).to_string())
+
+        kwargs = dict(
+            result=result,
+            pol_name=pol,
+            unit=unit,
+            figpath=figpath,
+            case_label=CASE_LABEL,
+            base_label=BASE_LABEL
+        )
+        # as figuras do poluente só entram na fila se as tabelas foram gravadas
+        pol_jobs = [
+            (plot_scenario_difference_mosaic, dict(kwargs, xlon=xlon, ylat=ylat, brazil=brazil)),
+            (plot_scenario_region_share, kwargs),
+        ]
+        jobs.extend(pol_jobs)
+
+    except Exception as e:
+        print(f"Erro ao processar {pol}: {e}")
+        continue
+
+render_figure_jobs(jobs, figpath, force=FORCE_RENDER)
+
+ds_case.close()
+ds_base.close()
+print("\nComparação de cenários concluída.")
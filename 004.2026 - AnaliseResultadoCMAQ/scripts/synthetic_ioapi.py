@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+Arquivos IOAPI/CMAQ sintéticos, para medir desempenho e memória das
+análises sem os NetCDF de produção.
+
+- make_emission_dataset / write_emission_files: emissões no padrão IOAPI
+  (TFLAG <YYYYDDD, HHMMSS> em (TSTEP, VAR, DATE-TIME), atributos do grid
+  XORIG/YORIG/XCELL/YCELL/NCOLS/NROWS/XCENT/TSTEP/NLAYS/NVARS/VAR-LIST e uma
+  variável (TSTEP, LAY, ROW, COL) por espécie), um arquivo por dia.
+- make_quality_dataset / write_quality_files: saídas de qualidade do ar pós
+  CMAQ (TFLAG 1D YYYYMMDDHH, LAT/LON 2D e um campo por poluente).
+- make_synthetic_regions: macro-regiões (NM_REGIA) retangulares cobrindo o
+  domínio, no lugar do shapefile do Brasil.
+
+O domínio tem sempre a mesma extensão física (Mercator equatorial com
+XCENT=-52, aprox. 74,5°O–34°O e 33°S–6°N); NCOLS/NROWS mudam apenas a
+resolução. Os campos têm ciclo diário e semanal, para que os perfis
+temporais não sejam degenerados.
+"""
+
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import xarray as xr
+from shapely.geometry import box
+
+
+#%% ── grid ───────────────────────────────────────────────────────────────────
+
+# extensão do domínio em metros (Mercator equatorial, esfera de 6370 km)
+SYNTHETIC_XORIG = -2.5e6
+SYNTHETIC_YORIG = -3.9e6
+SYNTHETIC_WIDTH = 4.5e6
+SYNTHETIC_HEIGHT = 4.6e6
+SYNTHETIC_XCENT = -52.0
+
+DEFAULT_EMISSION_SPECIES = (
+    "CO", "NO2", "SO2", "PMC",
+    "PMFINE_SO4", "PMFINE_NO3", "PMFINE_OTHR",
+)
+
+DEFAULT_QUALITY_POLLUTANTS = {
+    "O3": "ppbV",
+    "NO2": "ppbV",
+    "PM10": "ug/m3",
+    "PM25": "ug/m3",
+}
+
+
+def synthetic_grid_attrs(ncols, nrows, nlays, species=()):
+    """
+    Atributos globais IOAPI do grid sintético. XCELL/YCELL são inteiros em
+    metros, para que ioapiCoords gere exatamente NCOLS x NROWS pontos.
+    """
+    species = list(species)
+    return {
+        "IOAPI_VERSION": "sintetico",
+        "FTYPE": 1,
+        "GDTYP": 7,
+        "P_ALP": 0.0,
+        "P_BET": 0.0,
+        "P_GAM": SYNTHETIC_XCENT,
+        "XCENT": SYNTHETIC_XCENT,
+        "YCENT": 0.0,
+        "XORIG": SYNTHETIC_XORIG,
+        "YORIG": SYNTHETIC_YORIG,
+        "XCELL": float(round(SYNTHETIC_WIDTH / ncols)),
+        "YCELL": float(round(SYNTHETIC_HEIGHT / nrows)),
+        "NCOLS": int(ncols),
+        "NROWS": int(nrows),
+        "NLAYS": int(nlays),
+        "NVARS": len(species),
+        "NTHIK": 1,
+        "TSTEP": 10000,
+        "VGTYP": 7,
+        "VGTOP": 5000.0,
+        "VAR-LIST": "".join(f"{sp:<16}" for sp in species),
+    }
+
+
+def _grid_lonlat(attrs):
+    """
+    Longitude/latitude dos centros das células (ROW, COL) do grid sintético.
+    """
+    import pyproj
+
+    p = pyproj.Proj(
+        f"+proj=merc +a=6370000 +b=6370000 +lat_ts=0 +lon_0={attrs['XCENT']} +units=m +no_defs"
+    )
+    x = attrs["XORIG"] + attrs["XCELL"] * np.arange(attrs["NCOLS"])
+    y = attrs["YORIG"] + attrs["YCELL"] * np.arange(attrs["NROWS"])
+    lon, _ = p(x, np.zeros_like(x), inverse=True)
+    _, lat = p(np.zeros_like(y), y, inverse=True)
+    return np.meshgrid(np.asarray(lon), np.asarray(lat))
+
+
+def _spatial_pattern(nrows, ncols, rng, n_hotspots=12):
+    """
+    Campo espacial positivo com alguns focos (cidades/indústrias) sobre um
+    fundo fraco, normalizado para máximo 1.
+    """
+    yy, xx = np.meshgrid(np.linspace(0, 1, nrows), np.linspace(0, 1, ncols), indexing="ij")
+    field = np.full((nrows, ncols), 0.02)
+
+    for cy, cx, width, amp in zip(
+        rng.random(n_hotspots), rng.random(n_hotspots),
+        rng.uniform(0.01, 0.08, n_hotspots), rng.uniform(0.2, 1.0, n_hotspots)
+    ):
+        field += amp * np.exp(-((yy - cy) ** 2 + (xx - cx) ** 2) / (2 * width ** 2))
+
+    return field / field.max()
+
+
+def _time_modulation(datetimes):
+    """
+    Ciclo diário (pico à tarde) e semanal (fim de semana menor), em (TSTEP,).
+    """
+    hours = datetimes.hour.values
+    weekday = datetimes.dayofweek.values
+    diurnal = 1.0 + 0.6 * np.sin(2 * np.pi * (hours - 9) / 24)
+    weekly = np.where(weekday >= 5, 0.7, 1.0)
+    return diurnal * weekly
+
+
+def encode_ioapi_tflag(datetimes, nvars):
+    """
+    TFLAG IOAPI (TSTEP, VAR, DATE-TIME) com <YYYYDDD, HHMMSS> repetido por
+    variável (inverso de decode_ioapi_tflag).
+    """
+    datetimes = pd.DatetimeIndex(datetimes)
+    yyyyddd = (datetimes.year * 1000 + datetimes.dayofyear).values.astype("int32")
+    hhmmss = (datetimes.hour * 10000 + datetimes.minute * 100 + datetimes.second).values.astype("int32")
+
+    tflag = np.stack([yyyyddd, hhmmss], axis=-1)
+    return np.ascontiguousarray(
+        np.broadcast_to(tflag[:, None, :], (len(datetimes), max(nvars, 1), 2))
+    )
+
+
+#%% ── emissões ───────────────────────────────────────────────────────────────
+
+def make_emission_dataset(ncols=100, nrows=100, nlays=10, nsteps=24, start="2019-01-01",
+                          species=DEFAULT_EMISSION_SPECIES, seed=0):
+    """
+    Dataset de emissão IOAPI sintético em memória (float32).
+
+    A emissão de cada espécie é padrão espacial x ciclo temporal x perfil
+    vertical decrescente (a maior parte nas primeiras camadas), mais ruído.
+    """
+    rng = np.random.default_rng(seed)
+    species = list(species)
+    datetimes = pd.date_range(start, periods=nsteps, freq="h")
+
+    attrs = synthetic_grid_attrs(ncols, nrows, nlays, species)
+    attrs["SDATE"] = int(datetimes[0].year * 1000 + datetimes[0].dayofyear)
+    attrs["STIME"] = int(datetimes[0].hour * 10000)
+
+    modulation = _time_modulation(datetimes).astype("float32")
+    vertical = np.exp(-np.arange(nlays) / 2.0).astype("float32")
+    vertical /= vertical.sum()
+
+    data_vars = {
+        "TFLAG": (("TSTEP", "VAR", "DATE-TIME"), encode_ioapi_tflag(datetimes, len(species)),
+                  {"units": "<YYYYDDD,HHMMSS>", "long_name": "TFLAG"}),
+    }
+
+    for sp in species:
+        pattern = _spatial_pattern(nrows, ncols, rng).astype("float32")
+        scale = np.float32(rng.uniform(0.5, 5.0))
+        noise = rng.random((nsteps, nlays, nrows, ncols), dtype=np.float32)
+
+        values = noise
+        values *= np.float32(0.4)
+        values += np.float32(0.8)
+        values *= pattern[None, None]
+        values *= vertical[None, :, None, None]
+        values *= modulation[:, None, None, None]
+        values *= scale
+
+        unit = "g/s" if sp.startswith("PM") else "moles/s"
+        data_vars[sp] = (("TSTEP", "LAY", "ROW", "COL"), values,
+                         {"units": unit, "long_name": sp, "var_desc": f"{sp} sintético"})
+
+    return xr.Dataset(data_vars, attrs=attrs)
+
+
+def write_emission_files(out_dir, ncols=100, nrows=100, nlays=10, nsteps=24,
+                         start="2019-01-01", species=DEFAULT_EMISSION_SPECIES,
+                         steps_per_file=24, seed=0, overwrite=False):
+    """
+    Grava a série sintética em arquivos diários (steps_per_file passos cada),
+    como nas pastas de emissão de produção, e retorna a lista de caminhos.
+
+    Arquivos já existentes com o mesmo nome são reaproveitados, a menos que
+    overwrite=True.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    start = pd.Timestamp(start)
+    files = []
+
+    for i, first in enumerate(range(0, nsteps, steps_per_file)):
+        n = min(steps_per_file, nsteps - first)
+        file_start = start + pd.Timedelta(hours=first)
+        path = os.path.join(out_dir, f"emis_sintetica_{file_start:%Y%m%d_%H}.nc")
+        files.append(path)
+
+        if os.path.isfile(path) and not overwrite:
+            continue
+
+        ds = make_emission_dataset(
+            ncols=ncols, nrows=nrows, nlays=nlays, nsteps=n, start=file_start,
+            species=species, seed=seed + i
+        )
+        ds.to_netcdf(path + ".tmp", format="NETCDF4")
+        os.replace(path + ".tmp", path)
+
+    return files
+
+
+#%% ── qualidade do ar ───────────────────────────────────────────────────────
+
+def make_quality_dataset(ncols=100, nrows=100, nsteps=24, start="2019-01-01",
+                         pollutants=None, nlays=1, seed=0):
+    """
+    Dataset de qualidade do ar sintético no formato das pastas quality_*:
+    TFLAG (TSTEP,) YYYYMMDDHH, LAT/LON (ROW, COL) e poluentes
+    (TSTEP, LAY, ROW, COL) com o atributo units.
+    """
+    rng = np.random.default_rng(seed)
+    pollutants = dict(DEFAULT_QUALITY_POLLUTANTS if pollutants is None else pollutants)
+    datetimes = pd.date_range(start, periods=nsteps, freq="h")
+
+    attrs = synthetic_grid_attrs(ncols, nrows, nlays, list(pollutants))
+    lon, lat = _grid_lonlat(attrs)
+    modulation = _time_modulation(datetimes).astype("float32")
+
+    tflag = (
+        datetimes.year * 1000000 + datetimes.month * 10000
+        + datetimes.day * 100 + datetimes.hour
+    ).values.astype("int64")
+
+    data_vars = {
+        "TFLAG": (("TSTEP",), tflag, {"units": "YYYYMMDDHH"}),
+        "LAT": (("ROW", "COL"), lat.astype("float32"), {"units": "degrees_north"}),
+        "LON": (("ROW", "COL"), lon.astype("float32"), {"units": "degrees_east"}),
+    }
+
+    for pol, unit in pollutants.items():
+        pattern = _spatial_pattern(nrows, ncols, rng).astype("float32")
+        background = np.float32(rng.uniform(5.0, 30.0))
+        values = rng.random((nsteps, nlays, nrows, ncols), dtype=np.float32)
+        values *= np.float32(0.5)
+        values += np.float32(0.75)
+        values *= (background * (0.5 + pattern))[None, None]
+        values *= modulation[:, None, None, None]
+
+        data_vars[pol] = (("TSTEP", "LAY", "ROW", "COL"), values,
+                          {"units": unit, "long_name": pol})
+
+    return xr.Dataset(data_vars, attrs=attrs)
+
+
+def write_quality_files(out_dir, ncols=100, nrows=100, nsteps=24, start="2019-01-01",
+                        pollutants=None, steps_per_file=24, seed=0, overwrite=False):
+    """
+    Grava a série de qualidade sintética em arquivos diários e retorna os
+    caminhos. Os arquivos combinam com xr.open_mfdataset(combine="by_coords")
+    como em main_quality.py (TSTEP recebe o próprio TFLAG como coordenada);
+    use data_vars="minimal" para que LAT/LON não sejam concatenados em TSTEP.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    start = pd.Timestamp(start)
+    files = []
+
+    for i, first in enumerate(range(0, nsteps, steps_per_file)):
+        n = min(steps_per_file, nsteps - first)
+        file_start = start + pd.Timedelta(hours=first)
+        path = os.path.join(out_dir, f"qualidade_sintetica_{file_start:%Y%m%d_%H}.nc")
+        files.append(path)
+
+        if os.path.isfile(path) and not overwrite:
+            continue
+
+        ds = make_quality_dataset(
+            ncols=ncols, nrows=nrows, nsteps=n, start=file_start,
+            pollutants=pollutants, seed=seed + i
+        )
+        ds = ds.assign_coords(TSTEP=ds["TFLAG"].values)
+        ds.to_netcdf(path + ".tmp", format="NETCDF4")
+        os.replace(path + ".tmp", path)
+
+    return files
+
+
+#%% ── macro-regiões ─────────────────────────────────────────────────────────
+
+def make_synthetic_regions():
+    """
+    Cinco macro-regiões retangulares (coluna NM_REGIA, EPSG:4326) que cobrem
+    o domínio sintético, no lugar do shapefile BR_UF.
+    """
+    boxes = {
+        "Norte": box(-74.5, -10.0, -54.0, 6.0),
+        "Nordeste": box(-54.0, -10.0, -34.0, 6.0),
+        "Centro-oeste": box(-74.5, -20.0, -48.0, -10.0),
+        "Sudeste": box(-48.0, -25.0, -34.0, -10.0),
+        "Sul": box(-74.5, -34.0, -48.0, -20.0),
+    }
+    return gpd.GeoDataFrame(
+        {"NM_REGIA": list(boxes)}, geometry=list(boxes.values()), crs="EPSG:4326"
+    )
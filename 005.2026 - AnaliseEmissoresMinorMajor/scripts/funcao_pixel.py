@@ -9,6 +9,9 @@ import matplotlib.patheffects as pe
 from matplotlib.colorbar import ColorbarBase
 import matplotlib.ticker as mticker
 
+# HEADLESS=1 (execução em lote/servidor): backend Agg, sem janelas
+from functions_headless import HEADLESS
+
 def plot_mosaico_pixels_poluentes(
     inv_gdf,
     br_estado,
@@ -220,7 +223,8 @@ def plot_mosaico_pixels_poluentes(
 
     path_mos = os.path.join(figures, nome_mosaico)
     plt.savefig(path_mos, dpi=dpi, bbox_inches='tight', facecolor='white')
-    plt.show()
+    if not HEADLESS:
+        plt.show()
     plt.close(fig_mos)
     out_paths.append(path_mos)
 
@@ -14,6 +14,9 @@ import matplotlib.patheffects as pe
 from matplotlib.colorbar import ColorbarBase
 import matplotlib.ticker as mticker
 
+# HEADLESS=1 (execução em lote/servidor): backend Agg, sem janelas
+from functions_headless import HEADLESS
+
 
 #Utilizado
 def plot_mapa_emissoes_por_poluente(
@@ -103,7 +106,8 @@ def plot_mapa_emissoes_por_poluente(
             os.path.join(figures, f'mapa_espacial_{pol}.png'),
             dpi=dpi, bbox_inches='tight'
         )
-        plt.show()
+        if not HEADLESS:
+            plt.show()
         plt.close()
         
 #utilizado
@@ -224,7 +228,8 @@ def plot_mapas_impacto(
                 )
 
     plt.savefig(os.path.join(figures, 'impact_points_map.png'), dpi=dpi, bbox_inches='tight')
-    plt.show()
+    if not HEADLESS:
+        plt.show()
     plt.close()
 
 #utilizado
@@ -374,7 +379,8 @@ def plot_barrash_impacto_poluentes(
     plt.tight_layout(w_pad=1.0)
     plt.subplots_adjust(bottom=0.12)  # abre espaço embaixo
     plt.savefig(os.path.join(figures,'barras_impacto_poluentes.png'),dpi=dpi, bbox_inches='tight')
-    plt.show()
+    if not HEADLESS:
+        plt.show()
     plt.close()
 
 def plot_barras_estado_poluente(
@@ -529,7 +535,8 @@ def plot_barras_estado_poluente(
         os.path.join(figures, 'barras_estado_poluente_v2.png'),
         dpi=dpi, bbox_inches='tight', facecolor='white',
     )
-    plt.show()
+    if not HEADLESS:
+        plt.show()
     plt.close()
     
 
@@ -629,7 +636,8 @@ def plot_mapa_regioes(
         os.path.join(figures, 'mapa_regioes.png'),
         dpi=dpi, bbox_inches='tight', facecolor='white',
     )
-    plt.show()
+    if not HEADLESS:
+        plt.show()
     plt.close()
 
 
@@ -804,5 +812,6 @@ def plot_barras_estado_poluente(
         os.path.join(figures, 'barras_estado_poluente_v2.png'),
         dpi=dpi, bbox_inches='tight', facecolor='white',
     )
-    plt.show()
+    if not HEADLESS:
+        plt.show()
     plt.close()
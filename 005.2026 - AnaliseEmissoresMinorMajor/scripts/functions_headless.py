@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""
+Modo sem janelas compartilhado pelos módulos de figuras.
+
+HEADLESS=1 (execução em lote/servidor): backend Agg, sem janelas, e as
+funções de plotagem não chamam plt.show().
+"""
+
+import os
+
+import matplotlib.pyplot as plt
+
+HEADLESS = os.environ.get("HEADLESS", "0") == "1"
+if HEADLESS:
+    plt.switch_backend("Agg")
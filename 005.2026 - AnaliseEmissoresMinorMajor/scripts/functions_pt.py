@@ -14,6 +14,9 @@ import matplotlib.patheffects as pe
 from matplotlib.colorbar import ColorbarBase
 import matplotlib.ticker as mticker
 
+# HEADLESS=1 (execução em lote/servidor): backend Agg, sem janelas
+from functions_headless import HEADLESS
+
 # Cor fixa por setor agrupado (Combustão externa = cinza, vai por baixo)
 # Cor fixa por NFR (o mais frequente, 1.A.2.e, fica cinza = fundo)
 SETOR_AGRUPADO_COLORS = {
@@ -165,7 +168,8 @@ def plot_mapa_emissoes_por_poluente(
 
         plt.savefig(os.path.join(figures, f'mapa_espacial_{pol}.png'),
                     dpi=dpi, bbox_inches='tight')
-        plt.show()
+        if not HEADLESS:
+            plt.show()
         plt.close()
 
         
@@ -344,7 +348,8 @@ def plot_barras_poluente_estado(
     plt.subplots_adjust(hspace=0.15)
     plt.savefig(os.path.join(figures, nome_arquivo),
                 dpi=dpi, bbox_inches='tight', facecolor='white')
-    plt.show()
+    if not HEADLESS:
+        plt.show()
     plt.close()
 
 